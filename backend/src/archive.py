@@ -0,0 +1,153 @@
+'''Archive segments: spilled messages compressed in blocks of a few thousand
+each. Chat text compresses several-fold, so archives take a fraction of the
+disk and page cache of a mapped segment. A small index of each block's message
+id and time range means reads only decompress the blocks they touch, and the
+most recently used decompressed blocks are kept in a cache shared by every
+archive.'''
+import itertools
+import lzma
+import mmap
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from segment import Segment, Columns, write_file
+
+'''Messages compressed together in each block'''
+BLOCK_MESSAGES = 4096
+'''Decompressed blocks kept in the cache'''
+CACHE_BLOCKS = 64
+
+'''Compression method -> (code in the file, compress, decompress)'''
+METHODS = {
+    'zlib': (0, lambda raw: zlib.compress(raw, 6), zlib.decompress),
+    'lzma': (1, lzma.compress, lzma.decompress),
+}
+DECOMPRESS = {code: decompress for code, _, decompress in METHODS.values()}
+
+'''(archive key, block number) -> decompressed Columns, least recently used first'''
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Tells apart archives that reuse the path of a deleted one
+_keys = itertools.count()
+'''Block reads answered from the cache and by decompressing'''
+cache_stats = {'hits': 0, 'misses': 0}
+
+def archive_cache_clear():
+    with _cache_lock:
+        _cache.clear()
+
+class ArchiveSegment(Segment):
+    '''A segment file of compressed blocks. After the header comes an index
+    entry per block, then the blocks, each the compressed Columns of up to
+    BLOCK_MESSAGES messages. Every block but the last is full, so row r is in
+    block r // block_messages.'''
+    # magic, version, compression code, messages per block, number of messages
+    HEADER = struct.Struct('<4sIIIQ')
+    # first and last message_id, first and last time, offset and length
+    INDEX = struct.Struct('<qqddQQ')
+    MAGIC = b'FARC'
+    VERSION = 1
+
+    def __init__(self, path, overlay=None):
+        super().__init__(path, overlay)
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, code, self._block_messages, self.count = \
+            self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f'{path} is not a version {self.VERSION} archive')
+        self._decompress = DECOMPRESS[code]
+        blocks = -(-self.count // self._block_messages)
+        self._index = [self.INDEX.unpack_from(self._map, self.HEADER.size +
+                                              block * self.INDEX.size)
+                       for block in range(blocks)]
+        self._first_ids = [entry[0] for entry in self._index]
+        self.first_id = self._index[0][0]
+        self.last_id = self._index[-1][1]
+        self._key = next(_keys)
+
+    @classmethod
+    def write(cls, path, messages, method='zlib'):
+        '''Write messages to a new archive file at path, compressed with method'''
+        code, compress, _ = METHODS[method]
+        blocks = [messages[start:start + BLOCK_MESSAGES]
+                  for start in range(0, len(messages), BLOCK_MESSAGES)]
+        compressed = [compress(b''.join(Columns.encode(block))) for block in blocks]
+        offset = cls.HEADER.size + cls.INDEX.size * len(blocks)
+        index = []
+        for block, data in zip(blocks, compressed):
+            index.append(cls.INDEX.pack(block[0].message_id, block[-1].message_id,
+                                        block[0].time_created, block[-1].time_created,
+                                        offset, len(data)))
+            offset += len(data)
+        write_file(path, [cls.HEADER.pack(cls.MAGIC, cls.VERSION, code, BLOCK_MESSAGES,
+                                          len(messages)), *index, *compressed])
+
+    def _block(self, number):
+        '''Return the Columns of a block, decompressing it on a cache miss'''
+        key = (self._key, number)
+        with _cache_lock:
+            columns = _cache.get(key)
+            if columns is not None:
+                _cache.move_to_end(key)
+                cache_stats['hits'] += 1
+                return columns
+            cache_stats['misses'] += 1
+        *_, offset, length = self._index[number]
+        # Blocks are decompressed outside the lock, so readers of other
+        # blocks do not wait for this one
+        raw = self._decompress(self._map[offset:offset + length])
+        count = min(self._block_messages, self.count - number * self._block_messages)
+        columns = Columns(raw, 0, count)
+        with _cache_lock:
+            _cache[key] = columns
+            while len(_cache) > CACHE_BLOCKS:
+                _cache.popitem(last=False)
+        return columns
+
+    def _rows(self, number, rows):
+        first = number * self._block_messages
+        return [first + row for row in rows]
+
+    def _row(self, message_id):
+        number = bisect_right(self._first_ids, message_id) - 1
+        if number < 0 or message_id > self._index[number][1]:
+            return None
+        row = self._block(number).row(message_id)
+        return None if row is None else number * self._block_messages + row
+
+    def _fields(self, row):
+        number, row = divmod(row, self._block_messages)
+        return self._block(number).fields(row)
+
+    def messages(self, rows):
+        # Each block is looked up once for all of its rows
+        messages = []
+        for number, block_rows in itertools.groupby(
+                self.live_rows(rows), lambda row: row // self._block_messages):
+            columns = self._block(number)
+            first = number * self._block_messages
+            messages.extend(self._record(columns.fields(row - first)) for row in block_rows)
+        return messages
+
+    def _text_rows(self, needle):
+        rows = []
+        for number in range(len(self._index)):
+            rows.extend(self._rows(number, self._block(number).text_rows(needle)))
+        return rows
+
+    def _user_rows(self, u_id):
+        rows = []
+        for number in range(len(self._index)):
+            rows.extend(self._rows(number, self._block(number).user_rows(u_id)))
+        return rows
+
+    def _time_rows(self, start, end):
+        rows = []
+        for number, (_, _, first_time, last_time, _, _) in enumerate(self._index):
+            # Only blocks whose time range meets [start, end) are decompressed
+            if first_time < end and last_time >= start:
+                rows.extend(self._rows(number, self._block(number).time_rows(start, end)))
+        return rows
@@ -0,0 +1,50 @@
+import pytest
+import archive
+from archive import ArchiveSegment, cache_stats, archive_cache_clear
+from records import Message
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(archive, 'BLOCK_MESSAGES', 10)
+    monkeypatch.setattr(archive, 'CACHE_BLOCKS', 2)
+    archive_cache_clear()
+    yield
+    archive_cache_clear()
+
+def make_archive(path, method):
+    messages = [Message(number * 2, number % 2, f'message {number}', 100 + number)
+                for number in range(35)]
+    ArchiveSegment.write(str(path), messages, method)
+    return ArchiveSegment(str(path))
+
+def ids(messages):
+    return [message.message_id for message in messages]
+
+def misses(action):
+    before = cache_stats['misses']
+    action()
+    return cache_stats['misses'] - before
+
+# Test if an archive holds its messages in blocks and compresses them
+@pytest.mark.parametrize('method', ['zlib', 'lzma'])
+def test_archive_blocks(tmp_path, small_blocks, method):
+    segment = make_archive(tmp_path / 'archive.seg', method)
+    assert len(segment) == 35 and (segment.first_id, segment.last_id) == (0, 68)
+    assert segment.message_ids() == list(range(0, 70, 2))
+    assert ids(segment.page(8, 12)) == [16, 18, 20, 22]
+    assert segment.row(22) == 11 and segment.row(23) is None and segment.row(70) is None
+    assert segment.message(34).message == 'message 34'
+    assert ids(segment.search('message 3')) == [6, 60, 62, 64, 66, 68]
+    assert ids(segment.in_time_range(118, 121)) == [36, 38, 40]
+
+# Test if reads decompress only the blocks they touch, through an LRU cache
+def test_archive_cache(tmp_path, small_blocks):
+    segment = make_archive(tmp_path / 'archive.seg', 'zlib')
+    assert misses(lambda: segment.page(0, 5)) == 1
+    assert misses(lambda: segment.page(5, 15)) == 1
+    assert misses(lambda: segment.in_time_range(100, 103)) == 0
+    # The time index skips every block outside the range
+    assert misses(lambda: segment.in_time_range(131, 133)) == 1
+    # Only two blocks fit in the cache, block 1 was the least recently used
+    assert misses(lambda: segment.page(0, 1)) == 0
+    assert misses(lambda: segment.page(10, 11)) == 1
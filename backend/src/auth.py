@@ -3,10 +3,10 @@ import hashlib
 import jwt
 import random
 from database import data_email_search, data_handle, data_upload, data_login, data_logout, \
-    data_u_id, data_reset_code_renew, data_password_renew
+    data_u_id, data_reset_code_renew, data_password_renew, data_upload_bulk, users_lock
 from error import InputError
 from utility import token_generate, email_check, register_check, login_check, password_encode, \
-    check_reset_code, check_valid_password, send_email
+    check_reset_code, check_valid_password, send_email, register_bulk_check
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
@@ -41,20 +41,35 @@ def auth_register(email, password, name_first, name_last):
     '''Check whether the input argument email, password, name_first
     and name_last are valid. If yes, create u_id, token, handle and
     upload the data. Then return u_id and token'''
-    register_check(email, password, name_first, name_last)
+    # Checked and uploaded in one step, so users registering at the same time
+    # cannot take the same email or u_id
+    with users_lock:
+        register_check(email, password, name_first, name_last)
 
-    # Encode password, create u_id, token, handle and upload the data
-    password = password_encode(password)
-    u_id = data_u_id()
-    token = token_generate(u_id)
-    handle = data_handle(name_first, name_last, u_id)
-    data_upload(u_id, email, password, name_first, name_last, handle, token)
+        # Encode password, create u_id, token, handle and upload the data
+        password = password_encode(password)
+        u_id = data_u_id()
+        token = token_generate(u_id)
+        handle = data_handle(name_first, name_last, u_id)
+        data_upload(u_id, email, password, name_first, name_last, handle, token)
 
     return {
         'u_id': u_id,
         'token': token,
     }
 
+def auth_register_bulk(users):
+    '''Register a batch of users, each a dict with the arguments of
+    auth_register. If any is not valid none are registered. The users are not
+    logged in, so no tokens are made. Return their u_ids in order.'''
+    with users_lock:
+        register_bulk_check(users)
+        u_ids = data_upload_bulk([(user['email'], password_encode(user['password']),
+                                   user['name_first'], user['name_last']) for user in users])
+    return {
+        'u_ids': u_ids,
+    }
+
 def auth_u_id_from_token(token):
     '''Input a token, return its corresponding u_id'''
     decoded_jwt = jwt.decode(token.encode(), SECRET, algorithms=['HS256'])
@@ -67,7 +82,7 @@ def auth_passwordreset_request(email):
     sample_numbers = '1234567890'
     reset_code = ''.join((random.choice(sample_numbers) for i in range(5)))
     user = data_email_search(email)
-    data_reset_code_renew(user['u_id'], reset_code)
+    data_reset_code_renew(user.u_id, reset_code)
     send_email(email, reset_code)
 
     return {}
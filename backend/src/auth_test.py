@@ -1,8 +1,10 @@
 import pytest
+import threading
 from auth import auth_register, auth_login, auth_logout, auth_passwordreset_request, \
-    auth_passwordreset_reset
+    auth_passwordreset_reset, auth_register_bulk
 from other import clear
-from database import data
+from database import data, data_handle
+from user import user_profile_sethandle
 from utility import token_generate, password_encode
 from error import InputError, AccessError
 
@@ -196,4 +198,64 @@ def test_password_reset_wrong_reset_code1():
     # User 2 change the password with wrong reset_code
     reset_code = data['users'][2]['reset_code']
     with pytest.raises(InputError):
-        auth_passwordreset_reset(reset_code, "Qwer7")
\ No newline at end of file
+        auth_passwordreset_reset(reset_code, "Qwer7")
+
+
+# Test if a batch of users is registered with unique handles, and is only
+# registered if every user in it is valid
+def test_register_bulk():
+    clear()
+    first = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    users = [
+        {'email': f'user{number}@gmail.com', 'password': 'password', 'name_first': 'Bill',
+         'name_last': 'Gates'} for number in range(3)
+    ]
+    assert auth_register_bulk(users) == {'u_ids': [1, 2, 3]}
+    assert [data['users'][u_id].handle for u_id in (1, 2, 3)] == \
+        ['billgates', 'billga2', 'billga3']
+    assert data['users'][1].permission_id == 2 and data['users'][1].token is None
+    assert auth_login('user2@gmail.com', 'password')['u_id'] == 3
+    for invalid in ({'email': 'leonwu@gmail.com'}, {'email': 'user4@gmail.com'},
+                    {'password': '123'}, {'name_first': ''}, {'email': 'invalid'}):
+        batch = [
+            {'email': 'user4@gmail.com', 'password': 'password', 'name_first': 'A',
+             'name_last': 'B'},
+            {'email': 'user5@gmail.com', 'password': 'password', 'name_first': 'A',
+             'name_last': 'B', **invalid},
+        ]
+        with pytest.raises(InputError, match='User 1'):
+            auth_register_bulk(batch)
+    with pytest.raises(InputError):
+        auth_register_bulk([{'email': 'user4@gmail.com'}])
+    assert len(data['users']) == 4
+    assert auth_register("user4@gmail.com", "ihfeh3hgi00d", "Yilang", "W")['u_id'] == 4
+    assert first['u_id'] == 0
+    clear()
+
+# Test if a handle taken by another user falls back to a numbered handle
+# that is free
+def test_register_handle_suffix():
+    clear()
+    auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    user1 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    user_profile_sethandle(user1['token'], 'billga2')
+    auth_register("billgates2@outlook.com", "VukkFs", "Bill", "Gates")
+    auth_register("billgates3@outlook.com", "VukkFs", "Bill", "Gates")
+    assert [user.handle for user in data['users']] == \
+        ['billgates', 'billga2', 'billgates1', 'billga3']
+    clear()
+
+# Test if handles made at the same time are all different
+def test_register_handle_concurrent():
+    clear()
+    handles = []
+    def make(first):
+        for u_id in range(first, first + 100):
+            handles.append(data_handle('Bill', 'Gates', u_id % 7))
+    threads = [threading.Thread(target=make, args=(first,)) for first in range(0, 800, 100)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(handles)) == len(handles) == 800
+    clear()
@@ -0,0 +1,339 @@
+'''Micro benchmarks for the database layer.
+
+Run from the backend directory, e.g. `python3 src/benchmark.py users`.
+Every benchmark clears the database before and after it runs. Set
+FLOCKR_STORAGE=sqlite to measure the message benchmarks on the sqlite engine.'''
+import os
+import random
+import sys
+import tempfile
+import threading
+import tracemalloc
+from timeit import timeit
+from column_store import ColumnStore
+from auth import auth_register
+from provision import provision_users
+from snapshot import snapshot_save, snapshot_load
+from wal import wal_open, wal_close
+from records import Message
+from clock import VirtualClock, clock_set
+from scheduler import scheduler_add, scheduler_advance, scheduler_clear
+from database import data_clear, data_upload, data_email_search, data_user, \
+    data_permission, is_token_exist, is_user_exist, data_channel_create, data_add_member, \
+    data_message_send, data_get_channel_id, data_find_message, \
+    data_search_message, data_channel_messages, data_message_remove, data_standup_start, \
+    data_message_buffer, data_standup_finish, data_schedule_message, index, storage
+
+USER_COUNTS = [100, 1000, 10000, 100000]
+MESSAGE_COUNTS = [1000, 100000, 1000000]
+CHANNEL_COUNT = 10
+LOOKUPS = 10000
+
+def populate_users(count):
+    '''Upload count users straight into the database, skipping validation'''
+    for u_id in range(count):
+        data_upload(u_id, f'user{u_id}@test.com', 'password', 'First', 'Last',
+                    f'handle{u_id}', f'token{u_id}')
+
+def populate_channels(count):
+    '''Create count public channels with user 0 as their only member'''
+    for number in range(count):
+        channel_id = data_channel_create(f'channel{number}', True)
+        data_add_member(0, channel_id)
+
+def populate_messages(count, channel_count):
+    '''Send count messages round robin over the channels'''
+    for i in range(count):
+        data_message_send(i % channel_count, 0, f'message number {i}')
+
+def bench_users():
+    '''Time the per-request user lookups as the number of users grows'''
+    print(f"{'users':>8} {'u_id':>10} {'email':>10} {'token':>10} {'perm':>10}  (ns/lookup)")
+    for count in USER_COUNTS:
+        data_clear()
+        populate_users(count)
+        # Always look up the most recently registered user
+        last = count - 1
+        timings = [
+            timeit(lambda: is_user_exist(last) and data_user(last), number=LOOKUPS),
+            timeit(lambda: data_email_search(f'user{last}@test.com'), number=LOOKUPS),
+            timeit(lambda: is_token_exist(f'token{last}'), number=LOOKUPS),
+            timeit(lambda: data_permission(last), number=LOOKUPS),
+        ]
+        print(f'{count:>8} ' + ' '.join(f'{t / LOOKUPS * 1e9:>10.0f}' for t in timings))
+    data_clear()
+
+def bench_register():
+    '''Time registering users one at a time and in bulk, with every check'''
+    count = 10000
+    users = [{'email': f'user{number}@test.com', 'password': 'password',
+              'name_first': 'First', 'name_last': 'Last'} for number in range(count)]
+    data_clear()
+    single = timeit(lambda: [auth_register(**user) for user in users], number=1)
+    data_clear()
+    bulk = timeit(lambda: provision_users(users), number=1)
+    print(f"{'users':>8} {'single':>10} {'bulk':>10}  (users/s)")
+    print(f'{count:>8} {count / single:>10.0f} {count / bulk:>10.0f}')
+    data_clear()
+
+def bench_messages():
+    '''Time locating a message by id as the number of stored messages grows'''
+    print(f"{'messages':>8} {'locate':>10}  (ns/lookup)")
+    for count in MESSAGE_COUNTS:
+        data_clear()
+        populate_users(1)
+        populate_channels(CHANNEL_COUNT)
+        populate_messages(count, CHANNEL_COUNT)
+        # The oldest message in the last channel, the worst case for a scan
+        message_id = CHANNEL_COUNT - 1
+        def locate():
+            data_find_message(message_id, data_get_channel_id(message_id))
+        timing = timeit(locate, number=LOOKUPS)
+        print(f'{count:>8} {timing / LOOKUPS * 1e9:>10.0f}')
+    data_clear()
+
+def bench_search():
+    '''Time a search with a handful of matches as the number of stored messages grows'''
+    print(f"{'messages':>8} {'search':>10}  (us/query)")
+    for count in MESSAGE_COUNTS:
+        data_clear()
+        populate_users(1)
+        populate_channels(CHANNEL_COUNT)
+        populate_messages(count, CHANNEL_COUNT)
+        # 'number 999' matches 1, 111 and 1111 messages as the corpus grows
+        timing = timeit(lambda: data_search_message('number 999', 0), number=100)
+        print(f'{count:>8} {timing / 100 * 1e6:>10.0f}')
+    data_clear()
+
+def bench_pages():
+    '''Time fetching a page of 50 messages deep into one large channel'''
+    print(f"{'messages':>8} {'oldest':>10} {'newest':>10}  (us/page)")
+    for count in MESSAGE_COUNTS:
+        data_clear()
+        populate_users(1)
+        populate_channels(1)
+        populate_messages(count, 1)
+        start = count - 100
+        timings = [
+            timeit(lambda: data_channel_messages(0, start, start + 50), number=1000),
+            timeit(lambda: data_channel_messages(0, start, start + 50, True), number=1000),
+        ]
+        print(f'{count:>8} ' + ' '.join(f'{t / 1000 * 1e6:>10.1f}' for t in timings))
+    data_clear()
+
+def bench_remove():
+    '''Time removing messages spread over one large channel'''
+    print(f"{'messages':>8} {'remove':>10}  (us/remove)")
+    for count in MESSAGE_COUNTS:
+        data_clear()
+        populate_users(1)
+        populate_channels(1)
+        populate_messages(count, 1)
+        removed = range(0, count, count // 1000)
+        timing = timeit(lambda: [data_message_remove(0, i) for i in removed], number=1)
+        print(f'{count:>8} {timing / len(removed) * 1e6:>10.1f}')
+    data_clear()
+
+def allocated_bytes(build, count):
+    '''Return the bytes allocated by build(i) for count messages, excluding the
+    message ids and texts which both representations share'''
+    ids = list(range(count))
+    texts = [f'message number {i}' for i in ids]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    messages = [build(i, texts[i]) for i in ids]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del messages
+    return after - before
+
+def column_bytes(count):
+    '''Return the bytes a ColumnStore allocates for count messages, excluding
+    the bytes of their texts which it copies into its buffer'''
+    messages = [Message(i, 0, f'message number {i}', 1600000000.0) for i in range(count)]
+    text_bytes = sum(len(message.message) for message in messages)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = ColumnStore(messages)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del store
+    return after - before - text_bytes
+
+def bench_memory():
+    '''Compare bytes per message of the old dict messages, Message records and
+    column storage'''
+    count = MESSAGE_COUNTS[-1]
+    as_dict = allocated_bytes(lambda i, text: {
+        'message_id': i,
+        'u_id': 0,
+        'message': text,
+        'time_created': 1600000000.0,
+        'reacts': [],
+        'is_pinned': False,
+    }, count)
+    as_record = allocated_bytes(lambda i, text: Message(i, 0, text, 1600000000.0), count)
+    as_column = column_bytes(count)
+    print(f"{'messages':>8} {'dict':>10} {'record':>10} {'column':>10}  (bytes/message)")
+    print(f'{count:>8} {as_dict / count:>10.1f} {as_record / count:>10.1f} '
+          f'{as_column / count:>10.1f}')
+
+def bench_snapshot():
+    '''Time saving and loading a snapshot as the number of stored messages grows,
+    and the first page of a channel after loading, which loads that channel'''
+    print(f"{'messages':>8} {'save':>10} {'paused':>10} {'load':>10} {'first':>10} "
+          f"{'MB':>10}  (s)")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'flockr.snapshot')
+        for count in MESSAGE_COUNTS:
+            data_clear()
+            populate_users(1)
+            populate_channels(CHANNEL_COUNT)
+            populate_messages(count, CHANNEL_COUNT)
+            saved = snapshot_save(path)
+            loaded = snapshot_load(path)
+            first = timeit(lambda: data_channel_messages(0, 0, 50), number=1)
+            print(f"{count:>8} {saved['seconds']:>10.3f} {saved['paused']:>10.4f} "
+                  f"{loaded['seconds']:>10.4f} {first:>10.4f} "
+                  f"{saved['bytes'] / 1e6:>10.1f}")
+    data_clear()
+
+def bench_wal():
+    '''Time sending messages with no write-ahead log and under each fsync policy'''
+    count = 10000
+    print(f"{'policy':>8} {'send':>10}  (us/message)")
+    for policy in (None, 'never', 'interval', 'always'):
+        data_clear()
+        populate_users(1)
+        populate_channels(1)
+        with tempfile.TemporaryDirectory() as directory:
+            if policy is not None:
+                wal_open(directory, policy)
+            timing = timeit(lambda: populate_messages(count, 1), number=1)
+            wal_close()
+        print(f'{policy or "off":>8} {timing / count * 1e6:>10.1f}')
+    data_clear()
+
+def bench_tiers():
+    '''Compare the memory held and the time of a deep page for one large channel
+    with every message in memory and with older messages spilled to disk'''
+    print(f"{'messages':>8} {'tiers':>6} {'MB held':>10} {'oldest':>10} {'newest':>10}"
+          f"  (us/page)")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in MESSAGE_COUNTS[1:]:
+            for cold_directory in (None, directory):
+                storage.cold_directory = cold_directory
+                data_clear()
+                populate_users(1)
+                tracemalloc.start()
+                populate_channels(1)
+                populate_messages(count, 1)
+                held = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                timings = [
+                    timeit(lambda: data_channel_messages(0, 50, 100), number=1000),
+                    timeit(lambda: data_channel_messages(0, count - 100, count - 50, True),
+                           number=1000),
+                ]
+                print(f"{count:>8} {'on' if cold_directory else 'off':>6} {held / 1e6:>10.1f} "
+                      + ' '.join(f'{t / 1000 * 1e6:>10.1f}' for t in timings))
+        storage.cold_directory = None
+        data_clear()
+
+def bench_archive():
+    '''Compare the disk taken by one channel's spilled messages and the time of
+    deep pages and searches over them, mapped and compressed in blocks'''
+    count = MESSAGE_COUNTS[-1]
+    print(f"{'method':>8} {'MB disk':>10} {'page':>10} {'search':>10}  (us)")
+    for compression in (None, 'zlib', 'lzma'):
+        with tempfile.TemporaryDirectory() as directory:
+            storage.cold_directory, storage.compression = directory, compression
+            data_clear()
+            populate_users(1)
+            populate_channels(1)
+            populate_messages(count, 1)
+            disk = sum(os.path.getsize(os.path.join(directory, name))
+                       for name in os.listdir(directory))
+            # Pages spread over the history, so most are not in the block cache
+            starts = [start * 9973 % (count // 2) for start in range(1000)]
+            page = timeit(lambda: [data_channel_messages(0, start, start + 50)
+                                   for start in starts], number=1)
+            search = timeit(lambda: data_search_message('number 999', 0), number=10)
+            print(f"{compression or 'mmap':>8} {disk / 1e6:>10.1f} "
+                  f"{page / len(starts) * 1e6:>10.1f} {search / 10 * 1e6:>10.0f}")
+            storage.cold_directory, storage.compression = None, None
+            data_clear()
+
+def bench_standups():
+    '''Time starting standups, buffering messages to them and sending them,
+    and count the threads they take'''
+    count, fragments = 1000, 100
+    print(f"{'standups':>8} {'start':>10} {'send':>10} {'finish':>10} {'threads':>8}")
+    data_clear()
+    populate_users(1)
+    populate_channels(count)
+    threads = threading.active_count()
+    start = timeit(lambda: [data_standup_start(0, channel_id, 3600)
+                            for channel_id in range(count)], number=1)
+    started = threading.active_count() - threads
+    send = timeit(lambda: [data_message_buffer(0, f'fragment {number}', channel_id)
+                           for number in range(fragments) for channel_id in range(count)],
+                  number=1)
+    channels = [index['channel'][channel_id] for channel_id in range(count)]
+    finish = timeit(lambda: [data_standup_finish(channel, channel.standup)
+                             for channel in channels], number=1)
+    print(f'{count:>8} {start / count * 1e6:>8.1f}us {send / count / fragments * 1e6:>8.1f}us '
+          f'{finish / count * 1e6:>8.1f}us {started:>8}')
+    data_clear()
+
+def bench_scheduler():
+    '''Time adding and running a day of scheduled jobs and messages sent
+    later, on a virtual clock so none of it waits'''
+    day = 24 * 60 * 60
+    print(f"{'kind':>8} {'count':>10} {'add':>10} {'run':>10}  (us/job)")
+    previous = clock_set(VirtualClock(0))
+    try:
+        count = 1000000
+        times = [random.uniform(0, day) for _ in range(count)]
+        ran = []
+        add = timeit(lambda: [scheduler_add(when, ran.append, (when,)) for when in times],
+                     number=1)
+        run = timeit(lambda: scheduler_advance(day), number=1)
+        assert len(ran) == count and ran == sorted(ran)
+        print(f"{'jobs':>8} {count:>10} {add / count * 1e6:>10.2f} {run / count * 1e6:>10.2f}")
+        count = 100000
+        data_clear()
+        populate_users(1)
+        populate_channels(CHANNEL_COUNT)
+        add = timeit(lambda: [data_schedule_message(day + number * day // count,
+                                                    number % CHANNEL_COUNT, 0, f'later {number}')
+                              for number in range(count)], number=1)
+        run = timeit(lambda: scheduler_advance(day), number=1)
+        assert sum(len(index['channel'][channel_id].messages)
+                   for channel_id in range(CHANNEL_COUNT)) == count
+        print(f"{'later':>8} {count:>10} {add / count * 1e6:>10.2f} {run / count * 1e6:>10.2f}")
+    finally:
+        scheduler_clear()
+        clock_set(previous)
+        data_clear()
+
+BENCHMARKS = {
+    'users': bench_users,
+    'register': bench_register,
+    'messages': bench_messages,
+    'search': bench_search,
+    'pages': bench_pages,
+    'remove': bench_remove,
+    'memory': bench_memory,
+    'snapshot': bench_snapshot,
+    'wal': bench_wal,
+    'tiers': bench_tiers,
+    'archive': bench_archive,
+    'standups': bench_standups,
+    'scheduler': bench_scheduler,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
@@ -32,8 +32,8 @@ def channel_messages(token, channel_id, start):
     u_id = auth_u_id_from_token(token)
     check_authorised_member_channel(channel_id, u_id)
     end = data_channel_messages_end(start, channel_id)
-    before_list = data_channel_messages(channel_id, start, end)
-    message_list = data_react_modify(before_list, u_id)
+    message_list = [data_message_view(message, u_id) \
+        for message in data_channel_messages(channel_id, start, end)]
 
     return {
         'messages': message_list,
@@ -44,7 +44,7 @@ def channel_messages(token, channel_id, start):
 def channel_leave(token, channel_id):
     channel = valid_channel(channel_id)
     member = valid_member(channel, token)
-    channel['members'].remove(member)
+    data_remove_member(member.u_id, channel_id)
     return {}
 
 def channel_join(token, channel_id):
@@ -27,25 +27,8 @@ def channels_create(token, name, is_public):
     # if the name is more than 20 or token is invalid raise an Exception
     check_valid_channel_name(name)
     check_valid_token(token)
-    if is_channel_empty():
-        # when the channel is empty
-        channel_id = 0
-    else:
-        # The last channel's id plus 1
-        channel_id = data_last_channel_id() + 1
-    new_channel = {
-        'channel_id' : channel_id,
-        'name' : name,
-        'visibility' : is_public,
-        'members' : [],
-        'owners' : [],
-        'messages' : [],
-        'is_active': False,
-        'standup_message': '',
-        'time_finish': None,
-    }
-    # add new_channel to the list
-    data_add_channel(new_channel)
+    # add a new channel to the list
+    channel_id = data_channel_create(name, is_public)
     u_id = auth_u_id_from_token(token)
     data_add_owner(u_id, channel_id)
     data_add_member(u_id, channel_id)
@@ -14,6 +14,20 @@ def test_channels_create():
     assert channels.channels_create(info['token'], 'second', False) == {'channel_id' : 1}
     assert channel_numbers() == 2
 
+# test if channel ids are not used up by failed creates and restart after clear
+def test_channels_create_ids():
+    clear()
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    assert channels.channels_create(info['token'], 'first', True) == {'channel_id' : 0}
+    with pytest.raises(InputError):
+        channels.channels_create(info['token'], "jdjdkdidnekdmedkwdemdkeimd", False)
+    assert channels.channels_create(info['token'], 'second', True) == {'channel_id' : 1}
+    assert data_get_channel(1)['name'] == 'second'
+    clear()
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    assert channels.channels_create(info['token'], 'third', True) == {'channel_id' : 0}
+    assert data_get_channel(1) is None
+
 # test if the function raises an Exception if the input is invalid or token is
 # invalid
 def test_channels_create_except():
@@ -40,6 +54,26 @@ def test_channels_list():
     [{'channel_id': 0, 'name': 'first'},
      {'channel_id': 2, 'name': 'third'}]
 
+# test if leaving a channel removes it from the user's list of channels
+def test_channels_list_after_leave():
+    clear()
+    info1 = auth.auth_register("eviedunstone@gmail.com", "Qwerty6", "Evie", "Dunstone")
+    info2 = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channels.channels_create(info1['token'], 'first', True)
+    channels.channels_create(info1['token'], 'second', True)
+    channel.channel_join(info2['token'], 1)
+    channel.channel_join(info2['token'], 0)
+    channel.channel_leave(info2['token'], 1)
+    assert channels.channels_list(info2['token'])['channels'] == \
+    [{'channel_id': 0, 'name': 'first'}]
+    channel.channel_join(info2['token'], 1)
+    assert channels.channels_list(info2['token'])['channels'] == \
+    [{'channel_id': 0, 'name': 'first'},
+     {'channel_id': 1, 'name': 'second'}]
+    channel.channel_leave(info1['token'], 0)
+    assert channels.channels_list(info1['token'])['channels'] == \
+    [{'channel_id': 1, 'name': 'second'}]
+
 # test if the function raises an Exception if token is invalid
 def test_channels_list_except():
     clear()
@@ -6,7 +6,7 @@ from time import sleep
 import requests
 import json
 from database import *
-from datetime import datetime, timedelta
+from datetime import datetime, timezone, timedelta
 
 # Use this fixture to get the URL of the server. It starts the server for you,
 # so you don't need to.
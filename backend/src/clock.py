@@ -0,0 +1,46 @@
+'''The clock that messages, standups and the scheduler read the time from.
+The server runs on the system clock. Tests and benchmarks can set a
+VirtualClock instead, whose time only moves when scheduler_advance moves it,
+so what would take minutes of waiting runs at once.'''
+import time
+
+class SystemClock:
+    '''The time of the system'''
+    virtual = False
+
+    def time(self):
+        return time.time()
+
+class VirtualClock:
+    '''A time that stands still until advanced. It starts from the system
+    time unless given start, so the timestamps it gives look real.'''
+    virtual = True
+
+    def __init__(self, start=None):
+        self.now = time.time() if start is None else start
+
+    def time(self):
+        return self.now
+
+_state = {'clock': SystemClock()}
+# Called with no arguments after the clock is set
+_listeners = []
+
+def clock_time():
+    '''Return the time of the current clock, a timestamp in seconds'''
+    return _state['clock'].time()
+
+def clock_get():
+    return _state['clock']
+
+def clock_set(clock):
+    '''Make clock the current clock. Returns the clock it replaces.'''
+    previous, _state['clock'] = _state['clock'], clock
+    for listener in _listeners:
+        listener()
+    return previous
+
+def clock_listen(listener):
+    '''Call listener whenever the clock is set, as the scheduler does to stop
+    or start waiting on the system time'''
+    _listeners.append(listener)
@@ -0,0 +1,430 @@
+'''Column storage for the messages of a large channel. Instead of a record per
+message, each field of the channel's messages is kept in one typed array and
+the texts are kept in one contiguous utf-8 buffer. A message takes about 30
+bytes plus its text, and scans like "messages by user X" or "messages in a
+time range" run over a single column. Texts are encoded with surrogatepass,
+as a lone surrogate sent in json is still a valid str.'''
+from array import array
+from bisect import bisect_left, bisect_right, insort
+import threading
+from message_store import live_slot, COMPACT_RATIO, COMPACT_MIN
+from records import Record, Message
+
+class ColumnMessage(Record):
+    '''A message in a ColumnStore. Its fields are read from and written to the
+    store's columns, so changes made through it are kept by the store.'''
+    __slots__ = ('_store', 'message_id')
+
+    def __init__(self, store, message_id):
+        self._store = store
+        self.message_id = message_id
+
+    def __repr__(self):
+        return f'ColumnMessage(message_id={self.message_id!r})'
+
+    @property
+    def u_id(self):
+        return self._store._read(self.message_id, 'u_id')
+
+    @property
+    def time_created(self):
+        return self._store._read(self.message_id, 'time_created')
+
+    @property
+    def message(self):
+        return self._store._read(self.message_id, 'message')
+
+    @message.setter
+    def message(self, value):
+        self._store._write(self.message_id, 'message', value)
+
+    @property
+    def reacts(self):
+        return self._store._read(self.message_id, 'reacts')
+
+    @reacts.setter
+    def reacts(self, value):
+        self._store._write(self.message_id, 'reacts', value)
+
+    @property
+    def is_pinned(self):
+        return self._store._read(self.message_id, 'is_pinned')
+
+    @is_pinned.setter
+    def is_pinned(self, value):
+        self._store._write(self.message_id, 'is_pinned', value)
+
+class ColumnStore:
+    '''The messages of a channel, oldest first, with the same interface as
+    MessageStore. get() returns a ColumnMessage that writes through to the
+    columns, every other read returns Message records copied out of them.
+
+    Message ids ascend with the rows and so do their creation times, so
+    both can be bisected. Removed rows are tombstoned and edited texts are
+    kept aside until a background compaction rebuilds the columns.
+
+    freeze() starts a point-in-time view for a checkpoint. Rows are only
+    ever appended to the columns, so the view just remembers how many there
+    were. Until thaw(), a column changed in place is copied first and
+    reacts are copied before their first change through writable().'''
+
+    def __init__(self, messages=()):
+        self._ids = array('q')
+        self._u_ids = array('i')
+        self._times = array('d')
+        self._pinned = bytearray()
+        self._live = bytearray()
+        self._text = bytearray()
+        # The text of row i is _text[_starts[i]:_starts[i + 1]]
+        self._starts = array('q', [0])
+        # message_id -> new text of an edited message, its old text stays in
+        # the buffer until the next compaction
+        self._edited = {}
+        # message_id -> reacts, only for the messages that have any
+        self._reacts = {}
+        # Sorted row positions of the tombstones
+        self._tombstones = []
+        self._lock = threading.Lock()
+        self._compacting = False
+        # Columns still shared with the frozen view
+        self._shared = set()
+        # Ids of the messages whose reacts were copied out of the frozen
+        # view, None when not frozen
+        self._copied = None
+        for message in messages:
+            self._append(message)
+
+    def __len__(self):
+        return len(self._ids) - len(self._tombstones)
+
+    def __iter__(self):
+        # Compaction swaps in new columns instead of changing these ones, so
+        # the rows that were here when iteration started stay readable
+        with self._lock:
+            columns = self._columns()
+        for row in range(len(columns[0])):
+            if columns[4][row]:
+                yield self._message(row, columns)
+
+    def _columns(self):
+        return (self._ids, self._u_ids, self._times, self._pinned, self._live, self._text,
+                self._starts, self._edited)
+
+    def _message(self, row, columns=None):
+        '''Return a Message record copied from the given row'''
+        ids, u_ids, times, pinned, _, text, starts, edits = columns or self._columns()
+        message_id = ids[row]
+        edited = edits.get(message_id)
+        if edited is None:
+            edited = text[starts[row]:starts[row + 1]].decode(errors='surrogatepass')
+        return Message(message_id, u_ids[row], edited, times[row],
+                       self._reacts.get(message_id), bool(pinned[row]))
+
+    def _append(self, message):
+        self._ids.append(message.message_id)
+        self._u_ids.append(message.u_id)
+        self._times.append(message.time_created)
+        self._pinned.append(bool(message.is_pinned))
+        self._live.append(1)
+        self._text += message.message.encode(errors='surrogatepass')
+        self._starts.append(len(self._text))
+        if message.reacts:
+            self._reacts[message.message_id] = message.reacts
+
+    def id_range(self):
+        '''Return the first and last message ids the store has held, or None'''
+        with self._lock:
+            return (self._ids[0], self._ids[-1]) if len(self._ids) else None
+
+    def message_ids(self):
+        '''Return the ids of the messages, oldest first'''
+        with self._lock:
+            if not self._tombstones:
+                return array('q', self._ids)
+            return array('q', (message_id for message_id, live in zip(self._ids, self._live)
+                               if live))
+
+    def append(self, message):
+        with self._lock:
+            self._append(message)
+
+    def _position(self, message_id):
+        position = bisect_left(self._ids, message_id)
+        if position < len(self._ids) and self._ids[position] == message_id \
+                and self._live[position]:
+            return position
+        return None
+
+    def get(self, message_id):
+        '''Return a copy of the message with the given id, or None. Use
+        writable() for one whose changes are kept.'''
+        with self._lock:
+            row = self._position(message_id)
+            if row is None:
+                return None
+            return self._message(row)
+
+    def _read(self, message_id, field):
+        with self._lock:
+            row = self._position(message_id)
+            if row is None:
+                raise KeyError(message_id)
+            if field == 'message':
+                edited = self._edited.get(message_id)
+                if edited is not None:
+                    return edited
+                text = self._text[self._starts[row]:self._starts[row + 1]]
+                return text.decode(errors='surrogatepass')
+            if field == 'reacts':
+                return self._reacts.get(message_id)
+            if field == 'is_pinned':
+                return bool(self._pinned[row])
+            if field == 'u_id':
+                return self._u_ids[row]
+            return self._times[row]
+
+    def writable(self, message_id):
+        '''Return the message with the given id to be changed in place, or None'''
+        with self._lock:
+            if self._position(message_id) is None:
+                return None
+            if self._copied is not None and message_id not in self._copied:
+                reacts = self._reacts.get(message_id)
+                if reacts is not None:
+                    self._unshare('reacts')
+                    self._reacts[message_id] = {react_id: dict(u_ids)
+                                                for react_id, u_ids in reacts.items()}
+                self._copied.add(message_id)
+        return ColumnMessage(self, message_id)
+
+    def _unshare(self, *names):
+        '''Copy the named columns if the frozen view still shares them'''
+        for name in names:
+            if name in self._shared:
+                self._shared.discard(name)
+                column = getattr(self, '_' + name)
+                setattr(self, '_' + name, type(column)(column))
+
+    def _write(self, message_id, field, value):
+        with self._lock:
+            row = self._position(message_id)
+            if row is None:
+                raise KeyError(message_id)
+            if field == 'message':
+                self._unshare('edited')
+                self._edited[message_id] = value
+            elif field == 'is_pinned':
+                self._unshare('pinned')
+                self._pinned[row] = bool(value)
+            else:
+                self._unshare('reacts')
+                if value is None:
+                    self._reacts.pop(message_id, None)
+                else:
+                    self._reacts[message_id] = value
+            start_compaction = self._claim_compaction()
+        if start_compaction:
+            threading.Thread(target=self._compact, daemon=True).start()
+
+    def remove(self, message_id):
+        '''Tombstone the message with the given id, returns whether it was there'''
+        with self._lock:
+            position = self._position(message_id)
+            if position is None:
+                return False
+            self._unshare('live', 'tombstones', 'edited', 'reacts')
+            self._live[position] = 0
+            insort(self._tombstones, position)
+            self._edited.pop(message_id, None)
+            self._reacts.pop(message_id, None)
+            start_compaction = self._claim_compaction()
+        if start_compaction:
+            threading.Thread(target=self._compact, daemon=True).start()
+        return True
+
+    def _claim_compaction(self):
+        '''Return whether a compaction should start, marking it as started'''
+        stale = len(self._tombstones) + len(self._edited)
+        if self._compacting or stale < COMPACT_MIN or stale <= len(self._ids) * COMPACT_RATIO:
+            return False
+        self._compacting = True
+        return True
+
+    def page(self, start, end=-1, newest_first=False):
+        '''Return the messages from index start up to but excluding end (-1 for
+        the last message), counted from the oldest or the newest message'''
+        with self._lock:
+            total = len(self)
+            if end == -1 or end > total:
+                end = total
+            count = end - start
+            if count <= 0:
+                return []
+            if not newest_first:
+                row, step = live_slot(self._tombstones, start), 1
+            else:
+                row, step = live_slot(self._tombstones, total - 1 - start), -1
+            messages = []
+            while len(messages) < count:
+                if self._live[row]:
+                    messages.append(self._message(row))
+                row += step
+            return messages
+
+    def _messages(self, rows):
+        return [self._message(row) for row in rows if self._live[row]]
+
+    def search(self, query_str):
+        '''Return the messages whose text contains query_str, oldest first'''
+        with self._lock:
+            if query_str == '':
+                return self._messages(range(len(self._ids)))
+            needle = query_str.encode(errors='surrogatepass')
+            text, starts = self._text, self._starts
+            rows = set()
+            # Substrings of utf-8 text match exactly where the decoded text
+            # does, so the whole buffer can be searched at once
+            found = text.find(needle)
+            while found != -1:
+                row = bisect_right(starts, found) - 1
+                if found + len(needle) <= starts[row + 1]:
+                    rows.add(row)
+                    found = text.find(needle, starts[row + 1])
+                else:
+                    found = text.find(needle, found + 1)
+            # Edited rows are matched against their new text instead
+            rows = {row for row in rows if self._ids[row] not in self._edited}
+            for message_id, edited in self._edited.items():
+                if query_str in edited:
+                    rows.add(self._position(message_id))
+            return self._messages(sorted(rows))
+
+    def by_user(self, u_id):
+        '''Return the messages sent by the user with u_id, oldest first'''
+        with self._lock:
+            column = self._u_ids.tobytes()
+            needle = array(self._u_ids.typecode, [u_id]).tobytes()
+            size = self._u_ids.itemsize
+            rows = []
+            found = column.find(needle)
+            while found != -1:
+                # Only matches aligned to an item are a whole u_id
+                if found % size == 0:
+                    rows.append(found // size)
+                    found = column.find(needle, found + size)
+                else:
+                    found = column.find(needle, found + 1)
+            return self._messages(rows)
+
+    def in_time_range(self, start, end):
+        '''Return the messages created from time start up to but excluding end'''
+        with self._lock:
+            first = bisect_left(self._times, start)
+            last = bisect_left(self._times, end, first)
+            return self._messages(range(first, last))
+
+    def compact(self):
+        '''Rebuild the columns without tombstones or stale texts'''
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        self._compact()
+
+    def _view(self):
+        '''Return the columns and the number of rows in them. The lock must be held.'''
+        return (self._ids, self._u_ids, self._times, self._pinned, self._live, self._text,
+                self._starts, self._edited, self._reacts, len(self._ids))
+
+    @staticmethod
+    def _compacted(view):
+        '''Return new ids, u_ids, times, pinned, text and starts columns holding
+        only the live rows of a view, with edited texts folded in'''
+        ids, u_ids, times, pinned, live, text, starts, edited, _, length = view
+        if not edited and 0 not in live[:length]:
+            return (ids[:length], u_ids[:length], times[:length], pinned[:length],
+                    text[:starts[length]], starts[:length + 1])
+        rows = [row for row in range(length) if live[row]]
+        new_text = bytearray()
+        new_starts = array('q', [0])
+        for row in rows:
+            new = edited.get(ids[row])
+            if new is None:
+                new_text += text[starts[row]:starts[row + 1]]
+            else:
+                new_text += new.encode(errors='surrogatepass')
+            new_starts.append(len(new_text))
+        return (array('q', (ids[row] for row in rows)),
+                array('i', (u_ids[row] for row in rows)),
+                array('d', (times[row] for row in rows)),
+                bytearray(pinned[row] for row in rows), new_text, new_starts)
+
+    def _compact(self):
+        # Edits go through the lock too, so the rebuild holds it throughout.
+        # New columns are built rather than changing the old ones in place.
+        with self._lock:
+            self._ids, self._u_ids, self._times, self._pinned, self._text, self._starts = \
+                self._compacted(self._view())
+            self._live = bytearray(b'\x01') * len(self._ids)
+            self._edited = {}
+            self._tombstones = []
+            # The reacts are not rebuilt, so a frozen view may still share them
+            self._shared &= {'reacts'}
+            self._compacting = False
+
+    @classmethod
+    def _export(cls, view):
+        ids, u_ids, times, pinned, text, starts = cls._compacted(view)
+        reacts = {message_id: {react_id: list(u_ids) for react_id, u_ids in react.items()}
+                  for message_id, react in view[8].items()}
+        return {
+            'ids': ids.tobytes(),
+            'u_ids': u_ids.tobytes(),
+            'times': times.tobytes(),
+            'pinned': bytes(pinned),
+            'text': bytes(text),
+            'starts': starts.tobytes(),
+            'reacts': reacts,
+        }
+
+    def export_columns(self):
+        '''Return the live messages as a dict of column bytes, plus the reacts of
+        the messages that have any'''
+        with self._lock:
+            return self._export(self._view())
+
+    def freeze(self):
+        '''Start a point-in-time view of the store, returned for export_frozen'''
+        with self._lock:
+            self._shared = {'pinned', 'live', 'tombstones', 'edited', 'reacts'}
+            self._copied = set()
+            return self._view()
+
+    def thaw(self):
+        '''End the view started by freeze'''
+        with self._lock:
+            self._shared = set()
+            self._copied = None
+
+    @classmethod
+    def export_frozen(cls, view):
+        '''Return the messages of a view returned by freeze as export_columns
+        does, without holding up changes to the store'''
+        return cls._export(view)
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''Return a store holding the messages exported by export_columns'''
+        store = cls()
+        store._ids.frombytes(columns['ids'])
+        store._u_ids.frombytes(columns['u_ids'])
+        store._times.frombytes(columns['times'])
+        store._pinned = bytearray(columns['pinned'])
+        store._live = bytearray(b'\x01') * len(store._ids)
+        store._text = bytearray(columns['text'])
+        store._starts = array('q')
+        store._starts.frombytes(columns['starts'])
+        store._reacts = {message_id: {react_id: dict.fromkeys(u_ids)
+                                      for react_id, u_ids in react.items()}
+                         for message_id, react in columns['reacts'].items()}
+        return store
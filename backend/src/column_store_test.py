@@ -0,0 +1,125 @@
+from column_store import ColumnStore
+from records import Message
+
+def make_store(count):
+    store = ColumnStore()
+    for message_id in range(count):
+        store.append(Message(message_id * 2, message_id % 3, f'message {message_id}',
+                             float(message_id)))
+    return store
+
+def ids(messages):
+    return [message.message_id for message in messages]
+
+# Test if pages are counted from the oldest or the newest message
+def test_page():
+    store = make_store(5)
+    assert len(store) == 5
+    assert ids(store.page(0)) == [0, 2, 4, 6, 8]
+    assert ids(store.page(1, 3)) == [2, 4]
+    assert ids(store.page(1, 3, True)) == [6, 4]
+    assert store.page(5) == []
+    assert store.page(0, 1)[0]['message'] == 'message 0'
+
+# Test if changes made through writable() are kept in the columns, while get()
+# returns a copy that a removal does not affect
+def test_writable_writes_through():
+    store = make_store(3)
+    copied = store.get(2)
+    message = store.writable(2)
+    assert message['u_id'] == 1 and message['time_created'] == 1.0
+    message.is_pinned = True
+    message.message = 'edited'
+    message.reacts = {1: {0: None}}
+    assert repr(store.page(1, 2)[0]) == \
+        "Message(message_id=2, u_id=1, message='edited', time_created=1.0, reacts={1: {0: None}}, is_pinned=True)"
+    message.reacts = None
+    assert store.get(2).reacts is None
+    assert store.get(3) is None
+    store.remove(2)
+    assert (copied.message, copied.is_pinned) == ('message 1', False)
+
+# Test if removed messages are skipped and compaction keeps what the store holds
+def test_remove_compact():
+    store = make_store(10)
+    for message_id in (0, 6, 8, 18):
+        assert store.remove(message_id)
+    assert not store.remove(6)
+    store.writable(10).message = 'changed'
+    assert ids(store) == [2, 4, 10, 12, 14, 16]
+    assert ids(store.page(2, -1, True)) == [12, 10, 4, 2]
+    store.compact()
+    assert store._tombstones == [] and store._edited == {}
+    assert len(store._ids) == 6
+    assert ids(store.page(1, 4)) == [4, 10, 12]
+    assert store.get(10).message == 'changed'
+    assert store.get(12).message == 'message 6'
+
+# Test if searching the text buffer only matches within one message
+def test_search():
+    store = ColumnStore([
+        Message(0, 0, 'hello wor', 0.0),
+        Message(1, 0, 'ld héllo', 0.0),
+        Message(2, 0, 'héllo héllo', 0.0),
+        Message(3, 0, '', 0.0),
+    ])
+    assert ids(store.search('héllo')) == [1, 2]
+    assert ids(store.search('world')) == []
+    assert ids(store.search('')) == [0, 1, 2, 3]
+    store.writable(0).message = 'bye'
+    store.remove(2)
+    assert ids(store.search('hello')) == []
+    assert ids(store.search('ye')) == [0]
+
+# Test if messages can be selected by author and by creation time
+def test_by_user_in_time_range():
+    store = make_store(10)
+    store.append(Message(20, 256, 'high byte', 10.0))
+    assert ids(store.by_user(1)) == [2, 8, 14]
+    assert ids(store.by_user(256)) == [20]
+    assert ids(store.by_user(7)) == []
+    store.remove(8)
+    assert ids(store.by_user(1)) == [2, 14]
+    assert ids(store.in_time_range(2.0, 5.0)) == [4, 6]
+    assert ids(store.in_time_range(9.5, 100.0)) == [20]
+
+# Test if a frozen view keeps the columns as they were while the store changes
+def test_freeze():
+    store = make_store(5)
+    store.writable(0).reacts = {1: {0: None}}
+    view = store.freeze()
+    store.writable(2).message = 'changed'
+    store.writable(2).is_pinned = True
+    store.writable(0).reacts[1][2] = None
+    store.remove(4)
+    store.append(Message(10, 0, 'late', 5.0))
+    frozen = ColumnStore.from_columns(ColumnStore.export_frozen(view))
+    assert ids(frozen) == [0, 2, 4, 6, 8]
+    assert frozen.get(2).message == 'message 1' and not frozen.get(2).is_pinned
+    assert frozen.get(0).reacts == {1: {0: None}}
+    store.compact()
+    store.thaw()
+    assert ids(store) == [0, 2, 6, 8, 10]
+    assert store.get(2).message == 'changed' and store.get(2).is_pinned
+    assert store.get(0).reacts == {1: {0: None, 2: None}}
+
+# Test if reacts changed after a compaction stay out of a frozen view
+def test_freeze_compact_reacts():
+    store = make_store(5)
+    view = store.freeze()
+    store.writable(4).message = 'changed'
+    store.compact()
+    store.writable(6).reacts = {1: {7: None}}
+    assert ColumnStore.export_frozen(view)['reacts'] == {}
+    store.thaw()
+    assert store.get(6).reacts == {1: {7: None}}
+
+# Test if texts with a lone surrogate are kept, found and exported
+def test_surrogate():
+    store = ColumnStore([Message(0, 0, 'hi \ud800', 0.0), Message(1, 0, 'hi', 0.0)])
+    store.writable(1).message = 'bye \udfff'
+    assert ids(store.search('\ud800')) == [0]
+    assert ids(store.search('\udfff')) == [1]
+    store.compact()
+    copied = ColumnStore.from_columns(store.export_columns())
+    assert [message.message for message in copied] == ['hi \ud800', 'bye \udfff']
@@ -0,0 +1,24 @@
+'''Settings for the server, read from environment variables so a deployment
+can change them without editing the code'''
+import os
+
+'''File the database is snapshotted to, persistence is off when it is not set'''
+SNAPSHOT_PATH = os.environ.get('FLOCKR_SNAPSHOT')
+'''Seconds between snapshots'''
+SNAPSHOT_INTERVAL = float(os.environ.get('FLOCKR_SNAPSHOT_INTERVAL', 60))
+'''Directory of the write-ahead log, logging is off when it is not set'''
+WAL_DIRECTORY = os.environ.get('FLOCKR_WAL')
+'''When log records are synced to disk: always, interval or never'''
+WAL_FSYNC = os.environ.get('FLOCKR_WAL_FSYNC', 'interval')
+'''Seconds between syncs under the interval policy'''
+WAL_INTERVAL = float(os.environ.get('FLOCKR_WAL_INTERVAL', 0.01))
+'''Engine storing the messages: memory or sqlite'''
+STORAGE = os.environ.get('FLOCKR_STORAGE', 'memory')
+'''Database file of the sqlite engine'''
+SQLITE_PATH = os.environ.get('FLOCKR_SQLITE', ':memory:')
+'''Directory the memory engine spills older messages to, every message stays
+in memory when it is not set'''
+COLD_DIRECTORY = os.environ.get('FLOCKR_COLD')
+'''zlib or lzma to compress spilled messages in blocks, they are read through
+mmap uncompressed when it is not set'''
+COLD_COMPRESSION = os.environ.get('FLOCKR_COLD_COMPRESSION')
@@ -0,0 +1,13 @@
+import pytest
+from clock import VirtualClock, clock_set
+from scheduler import scheduler_clear
+
+# Time stands still in tests using this until scheduler_advance moves it
+@pytest.fixture
+def virtual_clock():
+    clock = VirtualClock()
+    previous = clock_set(clock)
+    yield clock
+    # Jobs left due on the virtual clock must not run on the system one
+    scheduler_clear()
+    clock_set(previous)
@@ -1,243 +1,419 @@
 from error import AccessError, InputError
-from datetime import datetime, timezone, timedelta
-from time import sleep
+from records import User, Channel, Message, Standup
+from storage import storage_open
+from rwlock import RWLock
+from id_allocator import IdAllocator
+from scheduler import job_ids, scheduler_add, scheduler_cancel
+from clock import clock_time
+import config
+from wal import wal_write, wal_wait
+from contextlib import contextmanager
 import threading
 
 '''The database for the user and channel data'''
 data = {
     'users': [],
     'channels': [],
-    'num_message': 0,
+    'message_ids': IdAllocator(),
+    'channel_ids': IdAllocator(),
+    # job_id -> (time, channel_id, u_id, message) of a message sent later
+    # that is still to be sent
+    'scheduled': {},
+    # Shared with the scheduler, which allocates ids of its own jobs from it
+    'job_ids': job_ids,
 }
 
+'''The engine storing the messages of every channel'''
+storage = storage_open(config.STORAGE, config.SQLITE_PATH, config.COLD_DIRECTORY,
+                       config.COLD_COMPRESSION)
+
+'''Indexes over the database so that lookups do not have to scan the lists above'''
+index = {
+    'u_id': {},
+    'email': {},
+    'token': {},
+    'handle': {},
+    # Handles data_handle made for users not uploaded yet
+    'handle_claims': set(),
+    # Handle made from a user's name -> next number to try as its suffix
+    'handle_suffix': {},
+    'channel': {},
+    # u_id -> set of the channel_ids the user is a member of
+    'user_channels': {},
+}
+
+'''Held to check a handle is free and take it in one step, so two users never
+get the same handle'''
+handle_lock = threading.Lock()
+'''Held to check a new user's email and u_id are free and take them in one
+step. Always taken before the gate, never while holding it.'''
+users_lock = threading.Lock()
+# Held to allocate a channel_id and add the channel in one step, so the
+# channels stay in order
+_channels_lock = threading.Lock()
+
+'''Every change to the database holds this shared, and data_barrier holds it
+exclusively to see the database in between changes. A change to a channel
+then holds the channel's lock exclusively.'''
+gate = RWLock()
+
+@contextmanager
+def mutation(op, *args):
+    '''Make a change to the database, then log it to the write-ahead log as op
+    with args. Replaying the record with data_replay makes the same change.
+    The block gets args as a list, to add the values it decides, such as ids
+    allocated under the gate.'''
+    args = list(args)
+    gate.acquire_shared()
+    try:
+        yield args
+        sequence = wal_write(op, *args)
+    finally:
+        gate.release_shared()
+    wal_wait(sequence)
+
+@contextmanager
+def channel_mutation(channel_id, op, *args):
+    '''A mutation of the channel with channel_id, holding the channel's lock
+    exclusively. The block gets the channel and the args. The record is
+    written before the lock is released, so the changes to a channel are
+    logged in the order they are made.'''
+    args = list(args)
+    gate.acquire_shared()
+    try:
+        channel = index['channel'][channel_id]
+        channel.lock.acquire_exclusive()
+        try:
+            yield channel, args
+            sequence = wal_write(op, *args)
+        finally:
+            channel.lock.release_exclusive()
+    finally:
+        gate.release_shared()
+    wal_wait(sequence)
+
+@contextmanager
+def data_barrier():
+    '''Hold off every change to the database until the block ends'''
+    with gate.exclusive():
+        yield
+
 def data_email_search(email):
-    ''' Loop through the database to find whether there is a same email in the database'''
-    for user in data['users']:
-        if user['email'] == email:
-            return user
-    return None
+    '''Return the user registered with the given email, or None'''
+    return index['email'].get(email)
+
+def data_handle_search(handle):
+    '''Return the user owning the given handle, or None'''
+    return index['handle'].get(handle)
+
+def is_handle_taken(handle):
+    return handle in index['handle'] or handle in index['handle_claims']
 
 def data_handle(name_first, name_last, u_id):
-    '''Create a handle using the first name and the last name'''
-    handle = (name_first + name_last).lower()
-    for user in data['users']:
-        if user['handle'] == handle[:20]:
+    '''Create a handle using the first name and the last name, and claim it
+    for the user with u_id until the user is uploaded'''
+    handle = (name_first + name_last).lower()[:20]
+    with handle_lock:
+        if is_handle_taken(handle):
             # Solution for a handle that is the same as a existing handle being created
-            handle = handle[:6] + str(u_id)
-            handle = handle[:20]
+            base, handle = handle, handle[:6] + str(u_id)
+            if is_handle_taken(handle):
+                handle = _suffixed_handle(base)
+        index['handle_claims'].add(handle)
+    return handle
+
+def _suffixed_handle(base):
+    '''Return the first free handle of base with a number on the end. Numbers
+    already tried for base are skipped, so each is tried once.'''
+    number = index['handle_suffix'].get(base, 1)
+    while True:
+        suffix = str(number)
+        handle = base[:20 - len(suffix)] + suffix
+        number += 1
+        if not is_handle_taken(handle):
             break
-    return handle[:20]
+    index['handle_suffix'][base] = number
+    return handle
 
 def data_upload(u_id, email, password, name_first, name_last, handle, token):
     '''If the register is the first register, set this register as a flockr owner. Then
     upload the data of a new user to the database'''
+    with mutation('data_upload', u_id, email, password, name_first, name_last, handle, token):
+        _add_user(u_id, email, password, name_first, name_last, handle, token)
+
+def data_upload_bulk(users):
+    '''Upload new users given as (email, password, name_first, name_last)
+    tuples, with their passwords encoded and no tokens, in one change.
+    Returns their u_ids. The caller holds users_lock.'''
+    records = [(u_id, email, password, name_first, name_last,
+                data_handle(name_first, name_last, u_id), None)
+               for u_id, (email, password, name_first, name_last)
+               in enumerate(users, data_u_id())]
+    data_insert_users(records)
+    return [record[0] for record in records]
+
+def data_insert_users(records):
+    '''Add the users of (u_id, email, password, name_first, name_last, handle,
+    token) records, logged as one change'''
+    with mutation('data_insert_users', records):
+        for record in records:
+            _add_user(*record)
+
+def _add_user(u_id, email, password, name_first, name_last, handle, token):
     permission_id = 2
     if u_id == 0:
         permission_id = 1
-    data['users'].append({
-        'u_id': u_id,
-        'email': email,
-        'password': password,
-        'name_first': name_first,
-        'name_last': name_last,
-        'handle': handle,
-        'token': token,
-        'permission_id': permission_id,
-        'profile_img_url': f'static/{u_id}.jpg',
-        'reset_code': "",
-    })
+    user = User(u_id, email, password, name_first, name_last, handle, token, permission_id)
+    data['users'].append(user)
+    index['u_id'][u_id] = user
+    index['email'][email] = user
+    with handle_lock:
+        index['handle'][handle] = user
+        index['handle_claims'].discard(handle)
+    if token is not None:
+        index['token'][token] = user
 
 def data_login(u_id, token):
-    data['users'][u_id]['token'] = token
+    with mutation('data_login', u_id, token):
+        user = index['u_id'][u_id]
+        if user.token is not None:
+            index['token'].pop(user.token, None)
+        user.token = token
+        index['token'][token] = user
 
 def data_logout(token):
     '''If a valid u_id is given, then turn the token into None to
      logged out, returns true, otherwise raise AccessError.'''
-
-    for user in data['users']:
-        if user['token'] == token:
-            user['token'] = None
-            return {
-                'is_success': True
-            }
-    raise AccessError("Error, token is invalid")
+    with mutation('data_logout', token):
+        user = index['token'].pop(token, None)
+        if user is None:
+            raise AccessError("Error, token is invalid")
+        user.token = None
+    return {
+        'is_success': True
+    }
+
+def data_set_email(user, email):
+    '''Change the email of a user and move it in the email index. Raises an
+    InputError if another user has taken it meanwhile.'''
+    with users_lock, mutation('data_set_email', user.u_id, email):
+        if index['email'].get(email, user) is not user:
+            raise InputError("The email has already been used by another user")
+        index['email'].pop(user.email, None)
+        user.email = email
+        index['email'][email] = user
+
+def data_set_handle(user, handle):
+    '''Change the handle of a user and move it in the handle index. Raises an
+    InputError if another user has taken it meanwhile.'''
+    with mutation('data_set_handle', user.u_id, handle), handle_lock:
+        if is_handle_taken(handle) and index['handle'].get(handle) is not user:
+            raise InputError('Handle is already used by another user')
+        index['handle'].pop(user.handle, None)
+        user.handle = handle
+        index['handle'][handle] = user
+
+def data_set_name(user, name_first, name_last):
+    '''Change the first and last name of a user'''
+    with mutation('data_set_name', user.u_id, name_first, name_last):
+        user.name_first = name_first
+        user.name_last = name_last
 
 def data_u_id():
     '''Create u_id'''
     return len(data['users'])
 
-def data_last_channel_id():
-    return data['channels'][-1]['channel_id']
+def data_new_store(channel_id):
+    '''Return an empty message store for a new channel'''
+    return storage.new_store(channel_id)
+
+def data_channel_create(name, visibility):
+    '''Add a new channel, allocating its id. Returns the channel_id.'''
+    with _channels_lock, mutation('data_add_channel', name, visibility) as args:
+        channel_id = data['channel_ids'].allocate()
+        args.insert(0, channel_id)
+        _add_channel(Channel(channel_id, name, visibility, data_new_store(channel_id)))
+    return channel_id
 
 def data_add_channel(new_channel):
-    data['channels'].append(new_channel)
+    with mutation('data_add_channel', new_channel.channel_id, new_channel.name,
+                  new_channel.visibility):
+        _add_channel(new_channel)
     return
 
-def is_channel_empty():
-    if data['channels'] == []:
-        return True
-    return False
+def _add_channel(new_channel):
+    data['channels'].append(new_channel)
+    index['channel'][new_channel.channel_id] = new_channel
+
+def data_get_channel(channel_id):
+    '''Return the channel with the given channel_id, or None'''
+    try:
+        return index['channel'].get(channel_id)
+    except TypeError:
+        # An unhashable channel_id can never refer to a channel
+        return None
 
 def is_user_exist(u_id):
-    for user in data['users']:
-        if u_id == user['u_id']:
-            return True
-    return False
+    return u_id in index['u_id']
 
 
 def is_token_exist(token):
-    for user in data['users']:
-        if token == user['token']:
-            return user
-    return False
+    return index['token'].get(token, False)
 
 def is_public_channel(channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return channel['visibility']
-    raise InputError("Channel is invalid")
+    channel = data_get_channel(channel_id)
+    if channel is None:
+        raise InputError("Channel is invalid")
+    return channel.visibility
 
 def is_channel_exist(channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return True
-    return False
+    return data_get_channel(channel_id) is not None
 
 def data_channels_list():
     # creat an empty list and append channels to it
     channels = []
     for channel in data['channels']:
         new_channel = {}
-        new_channel['channel_id'] = channel['channel_id']
-        new_channel['name'] = channel['name']
+        new_channel['channel_id'] = channel.channel_id
+        new_channel['name'] = channel.name
         channels.append(new_channel)
     return channels
 
 def data_user_channels(u_id):
     # create an empty list
     user_channel = []
-    for channel in data['channels']:
-        for member in channel['members']:
-            # add channel to list if the user is a member of that channel
-            if member['u_id'] == u_id:
-                new_channel = {}
-                new_channel['channel_id'] = channel['channel_id']
-                new_channel['name'] = channel['name']
-                user_channel.append(new_channel)
-                break
+    for channel_id in sorted(index['user_channels'].get(u_id, ())):
+        new_channel = {}
+        new_channel['channel_id'] = channel_id
+        new_channel['name'] = index['channel'][channel_id].name
+        user_channel.append(new_channel)
     return user_channel
 
 def data_channel_name(channel_id):
-    for channels in data['channels']:
-        if channel_id == channels['channel_id']:
-            channel_name = channels['name']
-    return channel_name
+    return index['channel'][channel_id].name
 
 def data_channel_owners(channel_id):
-    for channels in data['channels']:
-        if channel_id == channels['channel_id']:
-            owners = []
-            for owner in channels['owners']:
-                new_owner = {}
-                new_owner['u_id'] = owner['u_id']
-                new_owner['name_first'] = owner['name_first']
-                new_owner['name_last'] = owner['name_last']
-                new_owner['profile_img_url'] = owner['profile_img_url']
-                owners.append(new_owner)
-            return owners
+    owners = []
+    channel = index['channel'][channel_id]
+    with channel.lock.shared():
+        channel_owners = list(channel.owners)
+    for owner in channel_owners:
+        new_owner = {}
+        new_owner['u_id'] = owner.u_id
+        new_owner['name_first'] = owner.name_first
+        new_owner['name_last'] = owner.name_last
+        new_owner['profile_img_url'] = owner.profile_img_url
+        owners.append(new_owner)
+    return owners
 
 def data_channel_members(channel_id):
-    for channels in data['channels']:
-        if channel_id == channels['channel_id']:
-            members = []
-            for member in channels['members']:
-                new_member = {}
-                new_member['u_id'] = member['u_id']
-                new_member['name_first'] = member['name_first']
-                new_member['name_last'] = member['name_last']
-                new_member['profile_img_url'] = member['profile_img_url']
-                members.append(new_member)
-            return members
+    members = []
+    channel = index['channel'][channel_id]
+    with channel.lock.shared():
+        channel_members = list(channel.members)
+    for member in channel_members:
+        new_member = {}
+        new_member['u_id'] = member.u_id
+        new_member['name_first'] = member.name_first
+        new_member['name_last'] = member.name_last
+        new_member['profile_img_url'] = member.profile_img_url
+        members.append(new_member)
+    return members
 
 def data_channel_messages_end(start, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            if start + 49 < len(channel['messages']):
-                end = start + 50
-            else:
-                end = -1
-    return end
-
-def data_channel_messages(channel_id, start, end):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            message_list = []
-            if end == -1:
-                i = 0
-                for message in channel['messages']:
-                    if i >= start:
-	                    message_list.append(message)
-                    i += 1
-            else:
-	            for i, message in enumerate(channel['messages']):
-	                if i >= start:
-	                    if i < end:
-	                        message_list.append(message)
-    return message_list
+    if start + 49 < len(index['channel'][channel_id].messages):
+        return start + 50
+    return -1
+
+def data_channel_messages(channel_id, start, end, newest_first=False):
+    '''Return the page of messages from start to end (-1 for all the rest),
+    oldest first unless newest_first is set'''
+    channel = index['channel'][channel_id]
+    with channel.lock.shared():
+        return channel.messages.page(start, end, newest_first)
+
+def data_channel_messages_by_user(channel_id, u_id):
+    '''Return the messages the user with u_id sent in the channel, oldest first'''
+    channel = index['channel'][channel_id]
+    with channel.lock.shared():
+        return channel.messages.by_user(u_id)
+
+def data_channel_messages_in_range(channel_id, start, end):
+    '''Return the messages of the channel created from time start up to but
+    excluding end, oldest first'''
+    channel = index['channel'][channel_id]
+    with channel.lock.shared():
+        return channel.messages.in_time_range(start, end)
 
 def is_owner_exist(u_id, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for owner in channel['owners']:
-                if u_id == owner['u_id']:
-                    return True
-    return False
+    channel = data_get_channel(channel_id)
+    return channel is not None and u_id in channel.owner_ids
 
 
 def is_member_exist(u_id, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for member in channel['members']:
-                if u_id == member['u_id']:
-                    return True
-    return False
+    channel = data_get_channel(channel_id)
+    return channel is not None and u_id in channel.member_ids
 
 def data_add_owner(u_id, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for user in data['users']:
-                if u_id == user['u_id']:
-                    channel['owners'].append(user)
-                    return
+    with channel_mutation(channel_id, 'data_add_owner', u_id, channel_id) as (channel, _):
+        # Checked again under the lock, in case another request added it first
+        if u_id in channel.owner_ids:
+            return
+        channel.owners.append(index['u_id'][u_id])
+        channel.owner_ids.add(u_id)
 
 
 
 def data_remove_owner(u_id, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for user in data['users']:
-                if u_id == user['u_id']:
-                    channel['owners'].remove(user)
-                    return
+    with channel_mutation(channel_id, 'data_remove_owner', u_id, channel_id) as (channel, _):
+        if u_id not in channel.owner_ids:
+            return
+        channel.owners.remove(index['u_id'][u_id])
+        channel.owner_ids.discard(u_id)
 
 
 
 def data_add_member(u_id, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for user in data['users']:
-                if u_id == user['u_id']:
-                    channel['members'].append(user)
-                    return
+    with channel_mutation(channel_id, 'data_add_member', u_id, channel_id) as (channel, _):
+        if u_id in channel.member_ids:
+            return
+        channel.members.append(index['u_id'][u_id])
+        channel.member_ids.add(u_id)
+        index['user_channels'].setdefault(u_id, set()).add(channel_id)
+
+def data_remove_member(u_id, channel_id):
+    with channel_mutation(channel_id, 'data_remove_member', u_id, channel_id) as (channel, _):
+        if u_id not in channel.member_ids:
+            return
+        channel.members.remove(index['u_id'][u_id])
+        channel.member_ids.discard(u_id)
+        index['user_channels'][u_id].discard(channel_id)
 
 
 def channel_numbers():
     return len(data['channels'])
 
 def data_clear():
+    with mutation('data_clear'):
+        _clear_memory()
+        storage.clear()
+
+def data_reset():
+    '''Empty the database held in memory before it is loaded again, keeping
+    the messages a storage engine keeps on disk'''
+    with gate.exclusive():
+        _clear_memory()
+        storage.reset()
+
+def _clear_memory():
     data['users'].clear()
     data['channels'].clear()
-    data['num_message'] = 0
+    data['message_ids'].reset()
+    data['channel_ids'].reset()
+    data['scheduled'].clear()
+    data['job_ids'].reset()
+    for table in index.values():
+        table.clear()
 
 
 
@@ -245,236 +421,407 @@ def data_users_list():
     user_list = []
     for user in data['users']:
         new_user = {}
-        new_user['u_id'] = user['u_id']
-        new_user['email'] = user['email']
-        new_user['name_first'] = user['name_first']
-        new_user['name_last'] = user['name_last']
-        new_user['handle_str'] = user['handle']
-        new_user['profile_img_url'] = user['profile_img_url']
+        new_user['u_id'] = user.u_id
+        new_user['email'] = user.email
+        new_user['name_first'] = user.name_first
+        new_user['name_last'] = user.name_last
+        new_user['handle_str'] = user.handle
+        new_user['profile_img_url'] = user.profile_img_url
         user_list.append(new_user)
     return user_list
 
 def data_user(u_id):
-    for user in data['users']:
-        if u_id == user['u_id']:
-            return user
+    return index['u_id'].get(u_id)
 
 def data_permission(u_id):
-    for user in data['users']:
-        if user['u_id'] == u_id:
-            return user['permission_id']
+    user = index['u_id'].get(u_id)
+    if user is not None:
+        return user.permission_id
 
 
 def data_change_permission(u_id, permission_id):
-    for user in data['users']:
-        if user['u_id'] == u_id:
-            user['permission_id'] = permission_id
-            return
+    with mutation('data_change_permission', u_id, permission_id):
+        index['u_id'][u_id].permission_id = permission_id
 
 
 def data_search_message(query_str, u_id):
+    channel_ids = index['user_channels'].get(u_id, set())
+    found = storage.search(query_str, [index['channel'][channel_id]
+                                       for channel_id in sorted(channel_ids)])
     message_list = []
-    for channel in data['channels']:
-        for member in channel['members']:
-            # add message to list if the user is a member of that channel
-            if member['u_id'] == u_id:
-                for message in channel['messages']:
-                    if query_str in message['message']:
-                        new_message = {}
-                        new_message['message_id'] = message['message_id']
-                        new_message['u_id'] = message['u_id']
-                        new_message['message'] = message['message']
-                        new_message['time_created'] = message['time_created']
-                        message_list.append(new_message)
-                break
+    for message in found:
+        new_message = {}
+        new_message['message_id'] = message.message_id
+        new_message['u_id'] = message.u_id
+        new_message['message'] = message.message
+        new_message['time_created'] = message.time_created
+        message_list.append(new_message)
     return message_list
 
 def data_message_send(channel_id, u_id, message):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            time = round(datetime.utcnow().replace(tzinfo=timezone.utc).timestamp(), 0)
-            newmessage = {
-                'message_id': data['num_message'],
-                'u_id': u_id,
-                'message': message,
-                'time_created': time,
-                'reacts': [],
-                'is_pinned': False,
-            }
-            channel['messages'].append(newmessage)
-            data['num_message'] += 1
-    return newmessage['message_id']
+    with channel_mutation(channel_id, 'data_message_insert', channel_id, u_id,
+                          message) as (channel, args):
+        # Allocated and timed under the channel's lock, so a channel's
+        # messages are stored in order of both id and time
+        message_id = data['message_ids'].allocate()
+        time = round(clock_time(), 0)
+        args += [message_id, time]
+        storage.add(channel, Message(message_id, u_id, message, time))
+    return message_id
+
+def data_message_insert(channel_id, u_id, message, message_id, time):
+    '''Store a message whose id and time are already decided, as when the
+    write-ahead log is replayed'''
+    with channel_mutation(channel_id, 'data_message_insert', channel_id, u_id, message,
+                          message_id, time) as (channel, _):
+        storage.add(channel, Message(message_id, u_id, message, time))
+        data['message_ids'].advance(message_id + 1)
+
+def data_message_bulk(channel_id, messages):
+    '''Store messages whose ids, times, reacts and pins are already decided,
+    given oldest first as (message_id, u_id, message, time_created, reacts,
+    is_pinned) tuples. They are stored and logged together, as one change.'''
+    with channel_mutation(channel_id, 'data_message_bulk', channel_id,
+                          messages) as (channel, _):
+        storage.add_many(channel, [Message(*fields) for fields in messages])
+        if messages:
+            data['message_ids'].advance(messages[-1][0] + 1)
+
+def data_set_num_ids(num_message, num_channel=0, num_job=0):
+    '''Make new messages, channels and scheduled jobs take ids from
+    num_message, num_channel and num_job on, unless one already has a later id'''
+    with mutation('data_set_num_ids', num_message, num_channel, num_job):
+        data['message_ids'].advance(num_message)
+        data['channel_ids'].advance(num_channel)
+        data['job_ids'].advance(num_job)
+
+def data_schedule_message(when, channel_id, u_id, message):
+    '''Send a message at time when, a timestamp in seconds. The message is
+    kept in the database until it is sent, so it survives a restart. Returns
+    the id of its job in the scheduler.'''
+    with mutation('data_schedule_insert', when, channel_id, u_id, message) as args:
+        job_id = data['job_ids'].allocate()
+        args.insert(0, job_id)
+        data['scheduled'][job_id] = (when, channel_id, u_id, message)
+    _schedule(job_id)
+    return job_id
+
+def data_schedule_insert(job_id, when, channel_id, u_id, message):
+    '''Keep a message to be sent later whose job_id is already decided, as
+    when the write-ahead log is replayed. data_schedule_start schedules it.'''
+    with mutation('data_schedule_insert', job_id, when, channel_id, u_id, message):
+        data['scheduled'][job_id] = (when, channel_id, u_id, message)
+        data['job_ids'].advance(job_id + 1)
+
+def data_schedule_start():
+    '''Schedule the messages kept in the database, once it is recovered at
+    startup. Those whose time has passed are sent at once, together.'''
+    for job_id in sorted(data['scheduled']):
+        _schedule(job_id)
+
+def data_schedule_get(job_id):
+    '''Return the (time, channel_id, u_id, message) of a message still to be
+    sent later, or None, as for the jobs of standups'''
+    try:
+        return data['scheduled'].get(job_id)
+    except TypeError:
+        # An unhashable job_id can never refer to a message
+        return None
+
+def _schedule(job_id):
+    when, channel_id, u_id, message = data['scheduled'][job_id]
+    scheduler_add(when, data_schedule_send, (job_id,),
+                  {'channel_id': channel_id, 'u_id': u_id, 'message': message},
+                  job_id, batch=True)
+
+def data_schedule_cancel(job_id):
+    '''Stop a message from being sent later. Returns False if it is being
+    sent already.'''
+    if scheduler_cancel(job_id) is None:
+        return False
+    data_schedule_remove(job_id)
+    return True
+
+def data_schedule_remove(job_id):
+    with mutation('data_schedule_remove', job_id):
+        data['scheduled'].pop(job_id, None)
+
+def data_schedule_send(jobs):
+    '''Send the scheduled messages of the (job_id,) args of jobs that came due
+    together. Each channel's messages are stored and logged as one change,
+    which also takes them out of the database's scheduled messages.'''
+    # channel_id -> job_ids of its messages, in the order they came due
+    channels = {}
+    for job_id, in jobs:
+        scheduled = data['scheduled'].get(job_id)
+        if scheduled is not None:
+            channels.setdefault(scheduled[1], []).append(job_id)
+    for channel_id, channel_job_ids in channels.items():
+        with channel_mutation(channel_id, 'data_schedule_sent', channel_id) as (channel, args):
+            sent = []
+            for job_id in channel_job_ids:
+                scheduled = data['scheduled'].pop(job_id, None)
+                if scheduled is not None:
+                    # Allocated under the channel's lock, as in data_message_send
+                    sent.append((job_id, data['message_ids'].allocate(), scheduled[2],
+                                 scheduled[3]))
+            # Timed after the ids, so times go up with them
+            time = round(clock_time(), 0)
+            args += [sent, time]
+            if sent:
+                storage.add_many(channel, [Message(message_id, u_id, message, time)
+                                           for _, message_id, u_id, message in sent])
+
+def data_schedule_sent(channel_id, sent, time):
+    '''Store scheduled messages sent as (job_id, message_id, u_id, message)
+    tuples and take them out of the scheduled messages, as when the
+    write-ahead log is replayed'''
+    with channel_mutation(channel_id, 'data_schedule_sent', channel_id, sent,
+                          time) as (channel, _):
+        for job_id, *_ in sent:
+            data['scheduled'].pop(job_id, None)
+        if sent:
+            storage.add_many(channel, [Message(message_id, u_id, message, time)
+                                       for _, message_id, u_id, message in sent])
+            data['message_ids'].advance(sent[-1][1] + 1)
 
 def data_get_channel_id(message_id):
-    for channel in data['channels']:
-        if channel['messages'] != []:
-            for message in channel['messages']:
-                if message_id == message['message_id']:
-                    return channel['channel_id']
-    raise InputError ("Message does not exist")
+    channel_id = storage.message_channel_id(message_id)
+    if channel_id is None:
+        raise InputError ("Message does not exist")
+    return channel_id
+
 
 
 
 
+def _check_message(message_id, channel_id):
+    '''Raise an InputError unless the message is in the channel. Changes to
+    a message check again under the channel's lock, as another request may
+    have removed it since the first check.'''
+    if storage.message_channel_id(message_id) != channel_id:
+        raise InputError("Message does not exist")
 
 def data_message_remove(channel_id, message_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            channel['messages'] = [i for i in channel['messages'] if not i['message_id'] \
-                == message_id]
+    with channel_mutation(channel_id, 'data_message_remove', channel_id,
+                          message_id) as (channel, _):
+        _check_message(message_id, channel_id)
+        storage.remove(channel, message_id)
 
 def data_message_edit(channel_id, message_id, message):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            if message == "":
-                channel['messages'] = [i for i in channel['messages'] if not i['message_id'] \
-                    == message_id]
-            for item in channel['messages']:
-                if message_id == item['message_id']:
-                    item['message'] = message
+    if message == "":
+        data_message_remove(channel_id, message_id)
+        return
+    with channel_mutation(channel_id, 'data_message_edit', channel_id, message_id,
+                          message) as (channel, _):
+        _check_message(message_id, channel_id)
+        storage.edit(channel, message_id, message)
 
 def is_standup_active(channel_id):
-    for channel in data['channels']:
-        if channel_id == channel['channel_id']:
-            return channel['is_active']
+    channel = data_get_channel(channel_id)
+    if channel is not None:
+        return channel.standup is not None
 
 
 def data_standup_start(u_id, channel_id, length):
-    for channel in data['channels']:
-        if channel_id == channel['channel_id']:
-            channel['is_active'] = True
-            time = (datetime.utcnow() + timedelta(seconds=length)).replace(tzinfo=timezone.utc).timestamp()
-            channel['time_finish'] = time = round(time, 0)
-            try:
-               new_thread = threading.Thread(target=sleep_when_standup, args=(length, channel, u_id))
-               new_thread.setDaemon(True)
-               new_thread.start()
-            except:
-                raise Exception('Cannot start thread MUDAMUDAMUDA!')
-            return time
-
-def sleep_when_standup(length, channel, u_id):
-    sleep(length)
-    channel['is_active'] = False
-    channel['time_finish'] = None
-    if channel['standup_message'] != '':
-        data_message_send(channel['channel_id'], u_id, channel['standup_message'])
-    channel['standup_message'] = ''
-    return
+    '''Start a standup in the channel, finishing length seconds from now on
+    the scheduler thread, and return its time_finish. Raises an InputError if
+    another request started one first.'''
+    channel = index['channel'][channel_id]
+    start = clock_time()
+    with channel.lock.exclusive():
+        if channel.standup is not None:
+            raise InputError('There is already an active standup')
+        standup = channel.standup = Standup(u_id, round(start + length, 0))
+    scheduler_add(start + length, data_standup_finish, (channel, standup))
+    return standup.time_finish
+
+def data_standup_finish(channel, standup):
+    '''End the standup, then send the messages sent to it as one message from
+    the user who started it'''
+    with channel.lock.exclusive():
+        # Not the standup of a channel cleared meanwhile
+        if channel.standup is not standup:
+            return
+        channel.standup = None
+    if standup.fragments:
+        data_message_send(channel.channel_id, standup.u_id, ''.join(standup.fragments))
 
 def data_standup_status(channel_id):
-    for channel in data['channels']:
-        if channel_id == channel['channel_id']:
-            return {
-                'is_active': channel['is_active'],
-                'time_finish': channel['time_finish']
-            }
+    # One read of the standup, so is_active and time_finish always agree
+    standup = index['channel'][channel_id].standup
+    return {
+        'is_active': standup is not None,
+        'time_finish': None if standup is None else standup.time_finish,
+    }
 
 
 def data_message_buffer(u_id, message, channel_id):
-    for user in data['users']:
-        if u_id == user['u_id']:
-            name = user['name_first'] + user['name_last']
-            break
-    message = f"{name}: {message}\n"
-    for channel in data['channels']:
-        if channel_id == channel['channel_id']:
-            channel['standup_message'] += message
-            break
+    '''Add a message to the standup running in the channel. Raises an
+    InputError if it has finished meanwhile.'''
+    user = index['u_id'][u_id]
+    name = user.name_first + user.name_last
+    channel = index['channel'][channel_id]
+    # Appends from many senders at once must not lose one another, nor go
+    # to a standup that is being sent
+    with channel.lock.exclusive():
+        if channel.standup is None:
+            raise InputError('An active standup is not currently running in this channel')
+        channel.standup.fragments.append(f"{name}: {message}\n")
     return
 
 def data_message_pinned(message_id, channel_id):
-    message_info = data_find_message(message_id, channel_id)
-    if message_info['message_id'] == message_id:
-        if message_info['is_pinned'] == True:
-            return True
-        message_info['is_pinned'] = True
-        return False
+    with channel_mutation(channel_id, 'data_message_pinned', message_id, channel_id):
+        _check_message(message_id, channel_id)
+        message_info = data_writable_message(message_id, channel_id)
+        if message_info.message_id == message_id:
+            if message_info.is_pinned == True:
+                return True
+            message_info.is_pinned = True
+            return False
 
 def data_message_unpinned(message_id, channel_id):
-    message_info = data_find_message(message_id, channel_id)
-    if message_info['message_id'] == message_id:
-        if message_info['is_pinned'] == False:
-            return True
-        message_info['is_pinned'] = False
-        return False
+    with channel_mutation(channel_id, 'data_message_unpinned', message_id, channel_id):
+        _check_message(message_id, channel_id)
+        message_info = data_writable_message(message_id, channel_id)
+        if message_info.message_id == message_id:
+            if message_info.is_pinned == False:
+                return True
+            message_info.is_pinned = False
+            return False
 
 
 def data_message_reacted(message_id, channel_id, react_id, u_id):
-    user_present = False
-    message_info = data_find_message(message_id, channel_id)
-    if message_info['message_id'] == message_id:
-        for reacts in message_info['reacts']:
-            if reacts['react_id'] == react_id:
-                for users in reacts['u_ids']:
-                    if users == u_id:
-                        return True
-                    user_present = True
-        if user_present == True:
-            for reacts in message_info['reacts']:
-                if reacts['react_id'] == react_id:
-                    user_old_list = reacts['u_ids']
-                    user_old_list.append(u_id)
-        else:
-            user_old_list = []
-            user_old_list.append(u_id)
-            new_react = {
-                'react_id' : react_id,
-                'u_ids' : user_old_list,
-                'is_this_user_reacted': False,
-            }
-            message_info['reacts'].append(new_react)
+    '''Add the react of u_id, returns True if it was already there'''
+    with channel_mutation(channel_id, 'data_message_reacted', message_id, channel_id,
+                          react_id, u_id):
+        _check_message(message_id, channel_id)
+        message_info = data_writable_message(message_id, channel_id)
+        reacts = message_info.reacts or {}
+        u_ids = reacts.get(react_id, {})
+        if u_id in u_ids:
+            return True
+        # New dicts replace the old ones rather than changing them, as views
+        # of the message read them without the channel's lock
+        message_info.reacts = {**reacts, react_id: {**u_ids, u_id: None}}
+        return False
 
 
 def data_find_message(message_id, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for item in channel['messages']:
-                if item['message_id'] == message_id:
-                    return item
+    if storage.message_channel_id(message_id) == channel_id:
+        return index['channel'][channel_id].messages.get(message_id)
+
+def data_writable_message(message_id, channel_id):
+    '''Return the message to be changed in place, copied out of any
+    checkpoint that is being written'''
+    if storage.message_channel_id(message_id) == channel_id:
+        return index['channel'][channel_id].messages.writable(message_id)
 
 def data_message_unreacted(message_id, channel_id, react_id, u_id):
-    user_count = 0
-    message_info = data_find_message(message_id, channel_id)
-    if message_info['message_id'] == message_id:
-        if message_info['reacts'] == []:
+    '''Remove the react of u_id, returns True if it was not there'''
+    with channel_mutation(channel_id, 'data_message_unreacted', message_id, channel_id,
+                          react_id, u_id):
+        _check_message(message_id, channel_id)
+        message_info = data_writable_message(message_id, channel_id)
+        reacts = message_info.reacts or {}
+        u_ids = reacts.get(react_id)
+        if u_ids is None or u_id not in u_ids:
             return True
-        for reacts in message_info['reacts']:
-            if reacts['react_id'] == react_id:
-                for users in reacts['u_ids']:
-                    if users == u_id:
-                        reacts['u_ids'].remove(u_id)
-        for reacts in message_info['reacts']:
-            if reacts['react_id'] == react_id:
-                for users in reacts['u_ids']:
-                    user_count += 1
-
-
-    if user_count == 0:
-        message_info['reacts'] = []
-
-def data_react_modify(before_list, u_id):
-    for message in before_list:
-        for react in message['reacts']:
-            if u_id in react['u_ids']:
-                react['is_this_user_reacted'] = True
-            else:
-                react['is_this_user_reacted'] = False
-    return before_list
+        # Replaced rather than changed, as in data_message_reacted
+        reacts = dict(reacts)
+        u_ids = {other: None for other in u_ids if other != u_id}
+        if u_ids:
+            reacts[react_id] = u_ids
+        else:
+            del reacts[react_id]
+        message_info.reacts = reacts or None
+        return False
+
+def data_message_view(message, u_id):
+    '''Return the message as the user with u_id sees it. The stored message is
+    only read, so any number of viewers can do this at the same time.'''
+    return {
+        'message_id': message.message_id,
+        'u_id': message.u_id,
+        'message': message.message,
+        'time_created': message.time_created,
+        'reacts': [{
+            'react_id': react_id,
+            'u_ids': list(u_ids),
+            'is_this_user_reacted': u_id in u_ids,
+        } for react_id, u_ids in (message.reacts or {}).items()],
+        'is_pinned': message.is_pinned,
+    }
 
 def data_reset_code_renew(u_id, reset_code):
-    for user in data['users']:
-        if user['u_id'] == u_id:
-            user['reset_code'] = reset_code
+    with mutation('data_reset_code_renew', u_id, reset_code):
+        index['u_id'][u_id].reset_code = reset_code
 
 def data_reset_code_check(reset_code):
     for user in data['users']:
-        if user['reset_code'] == reset_code:
-            return user['u_id']
+        if user.reset_code == reset_code:
+            return user.u_id
     return -1
 
 def data_password_renew(u_id, new_password):
-    for user in data['users']:
-        if user['u_id'] == u_id:
-            user['password'] = new_password
-            break
+    with mutation('data_password_renew', u_id, new_password):
+        index['u_id'][u_id].password = new_password
+
+def data_insert_channel(channel_id, name, visibility):
+    '''Add a new channel whose id is already decided, as when the write-ahead
+    log is replayed'''
+    data_add_channel(Channel(channel_id, name, visibility, data_new_store(channel_id)))
+    data['channel_ids'].advance(channel_id + 1)
+
+'''Write-ahead log op -> function that makes the change again from its args'''
+REPLAY = {
+    'data_upload': data_upload,
+    'data_insert_users': data_insert_users,
+    'data_login': data_login,
+    'data_logout': data_logout,
+    'data_set_email': lambda u_id, email: data_set_email(index['u_id'][u_id], email),
+    'data_set_handle': lambda u_id, handle: data_set_handle(index['u_id'][u_id], handle),
+    'data_set_name': lambda u_id, name_first, name_last:
+        data_set_name(index['u_id'][u_id], name_first, name_last),
+    'data_add_channel': data_insert_channel,
+    'data_add_owner': data_add_owner,
+    'data_remove_owner': data_remove_owner,
+    'data_add_member': data_add_member,
+    'data_remove_member': data_remove_member,
+    'data_clear': data_clear,
+    'data_change_permission': data_change_permission,
+    'data_message_insert': data_message_insert,
+    'data_message_bulk': data_message_bulk,
+    'data_set_num_ids': data_set_num_ids,
+    # Written by older logs, before channel and job ids were set too
+    'data_set_num_message': data_set_num_ids,
+    'data_schedule_insert': data_schedule_insert,
+    'data_schedule_remove': data_schedule_remove,
+    'data_schedule_sent': data_schedule_sent,
+    'data_message_remove': data_message_remove,
+    'data_message_edit': data_message_edit,
+    'data_message_pinned': data_message_pinned,
+    'data_message_unpinned': data_message_unpinned,
+    'data_message_reacted': data_message_reacted,
+    'data_message_unreacted': data_message_unreacted,
+    'data_reset_code_renew': data_reset_code_renew,
+    'data_password_renew': data_password_renew,
+}
+
+'''Message op -> position of the message_id in its args'''
+MESSAGE_OPS = {
+    'data_message_remove': 1,
+    'data_message_edit': 1,
+    'data_message_pinned': 0,
+    'data_message_unpinned': 0,
+    'data_message_reacted': 0,
+    'data_message_unreacted': 0,
+}
+
+def data_replay(op, args):
+    '''Make the change recorded in a write-ahead log record. A storage engine
+    that keeps messages itself may already hold later changes, so changes to
+    messages it no longer has are skipped.'''
+    if op in MESSAGE_OPS and storage.message_channel_id(args[MESSAGE_OPS[op]]) is None:
+        return
+    REPLAY[op](*args)
@@ -0,0 +1,184 @@
+'''Export and import of the whole database as newline-delimited JSON, to move
+it between environments and storage engines. Records are streamed one line at
+a time in both directions, so neither side holds the database twice.
+
+Every line is a JSON object with a 'type':
+    flockr     first line, the format version, num_message, num_channel and
+               num_job
+    user       a user, with its password hash and permission_id
+    channel    a channel, followed by its members, owners and messages
+    member     a u_id that is a member of a channel
+    owner      a u_id that is an owner of a channel
+    message    a message, with its reacts and pinned flag
+    scheduled  a message sent later that is still to be sent, with its job_id
+
+Importing keeps every id and skips the checks auth_register and message_send
+make: messages are stored in bulk, many to one write-ahead log record.
+Scheduled messages are sent once a server loading the database starts.
+
+Usage: python dump.py export|import PATH, where PATH may be - for stdout (export)
+or stdin (import)'''
+import json
+import sys
+from contextlib import redirect_stdout
+from database import data, data_barrier, data_upload, data_change_permission, data_insert_channel, \
+    data_add_member, data_add_owner, data_message_bulk, data_set_num_ids, data_schedule_insert
+
+'''Version of the format written by dump_records'''
+VERSION = 1
+'''Messages of a channel stored together on import'''
+BULK_MESSAGES = 10000
+
+def dump_records():
+    '''Yield the database as records, users then each channel with its members,
+    owners and messages. The database should not change meanwhile, as when
+    run from the command line.'''
+    with data_barrier():
+        num_message, num_channel = data['message_ids'].peek(), data['channel_ids'].peek()
+        num_job = data['job_ids'].peek()
+        scheduled = sorted(data['scheduled'].items())
+    yield {
+        'type': 'flockr',
+        'version': VERSION,
+        'num_message': num_message,
+        'num_channel': num_channel,
+        'num_job': num_job,
+    }
+    for user in list(data['users']):
+        yield {
+            'type': 'user',
+            'u_id': user.u_id,
+            'email': user.email,
+            'password': user.password,
+            'name_first': user.name_first,
+            'name_last': user.name_last,
+            'handle': user.handle,
+            'permission_id': user.permission_id,
+        }
+    for channel in list(data['channels']):
+        yield {
+            'type': 'channel',
+            'channel_id': channel.channel_id,
+            'name': channel.name,
+            'is_public': channel.visibility,
+        }
+        for member in list(channel.members):
+            yield {'type': 'member', 'channel_id': channel.channel_id, 'u_id': member.u_id}
+        for owner in list(channel.owners):
+            yield {'type': 'owner', 'channel_id': channel.channel_id, 'u_id': owner.u_id}
+        for message in channel.messages:
+            yield {
+                'type': 'message',
+                'channel_id': channel.channel_id,
+                'message_id': message.message_id,
+                'u_id': message.u_id,
+                'message': message.message,
+                'time_created': message.time_created,
+                'reacts': [{'react_id': react_id, 'u_ids': list(u_ids)}
+                           for react_id, u_ids in (message.reacts or {}).items()],
+                'is_pinned': message.is_pinned,
+            }
+    for job_id, (when, channel_id, u_id, message) in scheduled:
+        yield {
+            'type': 'scheduled',
+            'job_id': job_id,
+            'time_sent': when,
+            'channel_id': channel_id,
+            'u_id': u_id,
+            'message': message,
+        }
+
+def dump_export(file):
+    '''Write the database to the text file as one JSON record per line.
+    Returns the number of records written.'''
+    count = 0
+    for record in dump_records():
+        file.write(json.dumps(record, ensure_ascii=False))
+        file.write('\n')
+        count += 1
+    return count
+
+def dump_load(records):
+    '''Add the records yielded by dump_records to an empty database. Returns
+    the number of records loaded.'''
+    if data['users'] or data['channels']:
+        raise ValueError('Records can only be loaded into an empty database')
+    count = 0
+    # channel_id -> message tuples not stored yet
+    pending = {}
+    def flush(channel_id):
+        messages = pending.pop(channel_id, None)
+        if messages:
+            data_message_bulk(channel_id, messages)
+    for record in records:
+        kind = record['type']
+        if kind == 'message':
+            messages = pending.setdefault(record['channel_id'], [])
+            messages.append((record['message_id'], record['u_id'], record['message'],
+                             record['time_created'],
+                             {react['react_id']: dict.fromkeys(react['u_ids'])
+                              for react in record['reacts']} or None,
+                             record['is_pinned']))
+            if len(messages) == BULK_MESSAGES:
+                flush(record['channel_id'])
+        elif kind == 'user':
+            # Tokens are not exported, users log in again
+            data_upload(record['u_id'], record['email'], record['password'],
+                        record['name_first'], record['name_last'], record['handle'], None)
+            if record['permission_id'] != data['users'][-1].permission_id:
+                data_change_permission(record['u_id'], record['permission_id'])
+        elif kind == 'channel':
+            data_insert_channel(record['channel_id'], record['name'], record['is_public'])
+        elif kind == 'member':
+            data_add_member(record['u_id'], record['channel_id'])
+        elif kind == 'owner':
+            data_add_owner(record['u_id'], record['channel_id'])
+        elif kind == 'scheduled':
+            # Sent once the server that loads the database starts
+            data_schedule_insert(record['job_id'], record['time_sent'], record['channel_id'],
+                                 record['u_id'], record['message'])
+        elif kind == 'flockr':
+            if record['version'] != VERSION:
+                raise ValueError(f"Records version {record['version']} is not {VERSION}")
+            # Older dumps do not have num_channel and num_job
+            data_set_num_ids(record['num_message'], record.get('num_channel', 0),
+                             record.get('num_job', 0))
+        else:
+            raise ValueError(f'Unknown record type {kind!r}')
+        count += 1
+    for channel_id in list(pending):
+        flush(channel_id)
+    return count
+
+def dump_import(file):
+    '''Add the JSON records of the text file, one per line, to an empty
+    database. Returns the number of records loaded.'''
+    return dump_load(json.loads(line) for line in file if line.strip())
+
+if __name__ == "__main__":
+    from persistence import persistence_start, persistence_stop
+    command, path = sys.argv[1:3]
+    # Keeps stdout for the records
+    with redirect_stdout(sys.stderr):
+        persistence_start()
+    try:
+        if command == 'export':
+            if path == '-':
+                count = dump_export(sys.stdout)
+            else:
+                with open(path, 'w', encoding='utf-8') as file:
+                    count = dump_export(file)
+            print(f'Exported {count} records', file=sys.stderr)
+        elif command == 'import':
+            if path == '-':
+                count = dump_import(sys.stdin)
+            else:
+                with open(path, encoding='utf-8') as file:
+                    count = dump_import(file)
+            print(f'Imported {count} records', file=sys.stderr)
+        else:
+            sys.exit(f'Unknown command {command!r}, use export or import')
+    finally:
+        # The last snapshot holds what was imported
+        with redirect_stdout(sys.stderr):
+            persistence_stop()
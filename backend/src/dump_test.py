@@ -0,0 +1,95 @@
+import io
+import json
+import pytest
+import dump
+from auth import auth_register, auth_login
+from channels import channels_create
+from channel import channel_join, channel_messages, channel_details, channel_addowner
+from message import message_send, message_remove, message_pin, message_react
+from other import clear, search, users_all, admin_userpermission_change
+from dump import dump_export, dump_import
+from database import data
+
+def populate():
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    user1 = auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    channel1 = channels_create(user1['token'], "channel1", False)['channel_id']
+    channel_join(user1['token'], channel0)
+    channel_addowner(user0['token'], channel0, user1['u_id'])
+    admin_userpermission_change(user0['token'], user1['u_id'], 1)
+    for text in ('hello', 'héllo there', 'bye'):
+        message_send(user0['token'], channel0, text)
+    message_send(user1['token'], channel1, 'hello from channel1')
+    message_send(user0['token'], channel0, 'removed')
+    message_remove(user0['token'], 4)
+    message_pin(user0['token'], 0)
+    message_react(user1['token'], 1, 1)
+    return user0, user1, channel0, channel1
+
+# Test if an exported database imports back with the same ids, members,
+# messages, reacts and pins
+def test_dump_round_trip():
+    clear()
+    user0, user1, channel0, channel1 = populate()
+    users = users_all(user0['token'])
+    messages = channel_messages(user1['token'], channel0, 0)
+    details = [channel_details(user1['token'], channel_id) for channel_id in (channel0, channel1)]
+    file = io.StringIO()
+    assert dump_export(file) == 15
+    clear()
+    assert dump_import(io.StringIO(file.getvalue())) == 15
+    # Tokens are not exported
+    user0 = auth_login("leonwu@gmail.com", "ihfeh3hgi00d")
+    user1 = auth_login("billgates@outlook.com", "VukkFs")
+    assert users_all(user0['token']) == users
+    assert channel_messages(user1['token'], channel0, 0) == messages
+    assert [channel_details(user1['token'], channel_id)
+            for channel_id in (channel0, channel1)] == details
+    assert [item['message_id'] for item in search(user1['token'], 'hello')['messages']] \
+        == [0, 3]
+    # The removed message's id is not handed out again
+    assert message_send(user0['token'], channel0, 'again') == {'message_id': 5}
+    assert channels_create(user0['token'], "channel2", True) == {'channel_id': 2}
+    clear()
+
+# Test if messages are imported in bulk batches and records go one per line
+def test_dump_bulk(monkeypatch):
+    monkeypatch.setattr(dump, 'BULK_MESSAGES', 2)
+    clear()
+    user0, _, channel0, _ = populate()
+    file = io.StringIO()
+    dump_export(file)
+    lines = file.getvalue().splitlines()
+    assert [json.loads(line)['type'] for line in lines[:3]] == ['flockr', 'user', 'user']
+    clear()
+    dump_import(io.StringIO(file.getvalue()))
+    user0 = auth_login("leonwu@gmail.com", "ihfeh3hgi00d")
+    assert [item['message'] for item in channel_messages(user0['token'], channel0, 0)['messages']] \
+        == ['hello', 'héllo there', 'bye']
+
+# Test if records are only imported into an empty database
+def test_dump_not_empty():
+    clear()
+    populate()
+    file = io.StringIO()
+    dump_export(file)
+    with pytest.raises(ValueError):
+        dump_import(io.StringIO(file.getvalue()))
+    clear()
+
+# Test if new channels and scheduled jobs take ids after those of the dump,
+# and dumps without num_channel and num_job still import
+def test_dump_num_ids():
+    clear()
+    dump.dump_load([{'type': 'flockr', 'version': dump.VERSION, 'num_message': 3,
+                     'num_channel': 5, 'num_job': 7}])
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    assert channels_create(user0['token'], "channel5", True) == {'channel_id': 5}
+    assert message_send(user0['token'], 5, 'hello') == {'message_id': 3}
+    assert data['job_ids'].peek() == 7
+    clear()
+    dump.dump_load([{'type': 'flockr', 'version': dump.VERSION, 'num_message': 3}])
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    assert channels_create(user0['token'], "channel0", True) == {'channel_id': 0}
+    clear()
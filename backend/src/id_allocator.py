@@ -0,0 +1,38 @@
+'''Hands out ids to many threads at once without a lock'''
+import itertools
+import threading
+
+class IdAllocator:
+    '''Allocates increasing ids from first on. Each id is one next() on an
+    itertools.count, which runs as a single step of the interpreter, so
+    threads allocating at the same time never get the same id.
+
+    peek, advance and reset replace the counter, and may hand out an id twice
+    if a thread allocates meanwhile. The database allocates under the shared
+    hold of its gate, so they are safe under data_barrier or before the
+    server starts.'''
+
+    def __init__(self, first=0):
+        self._counter = itertools.count(first)
+        # Only for peek, advance and reset, against each other
+        self._lock = threading.Lock()
+
+    def allocate(self):
+        return next(self._counter)
+
+    def peek(self):
+        '''Return the next id without allocating it'''
+        with self._lock:
+            value = next(self._counter)
+            self._counter = itertools.count(value)
+            return value
+
+    def advance(self, first):
+        '''Allocate from first on, unless the next id is already past it'''
+        with self._lock:
+            value = next(self._counter)
+            self._counter = itertools.count(max(value, first))
+
+    def reset(self, first=0):
+        with self._lock:
+            self._counter = itertools.count(first)
@@ -0,0 +1,67 @@
+'''Stand-in for the message store of a channel loaded from a snapshot, so the
+server can start serving before every channel's messages are loaded'''
+import threading
+
+class LazyStore:
+    '''Has the interface of MessageStore, but holds no messages until one of
+    its methods needs them. The first such call builds the channel's store
+    with load(), puts it in place of this one in channel.messages and calls
+    loaded(channel). Calls already holding this object are passed on to it.
+
+    Until then the number of messages and the range of their ids are known
+    from the snapshot, and blob() returns the bytes the snapshot holds for
+    them, so a new snapshot can copy them without loading the channel.'''
+
+    def __init__(self, channel, load, loaded, blob, count, id_range):
+        self._channel = channel
+        self._load = load
+        self._loaded = loaded
+        self.blob = blob
+        self._count = count
+        self._id_range = id_range
+        self._store = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        '''Return the channel's store, loading it on the first call'''
+        store = self._store
+        if store is not None:
+            return store
+        with self._lock:
+            if self._store is None:
+                store = self._load()
+                self._channel.messages = store
+                self._loaded(self._channel)
+                # Set last, other threads only skip the lock once it is all done
+                self._store = store
+            return self._store
+
+    def is_loaded(self):
+        return self._store is not None
+
+    def __len__(self):
+        store = self._store
+        return self._count if store is None else len(store)
+
+    def id_range(self):
+        store = self._store
+        return self._id_range if store is None else store.id_range()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def freeze(self):
+        '''Start a point-in-time view, None while the messages are not loaded:
+        the snapshot they come from already holds them as they are'''
+        with self._lock:
+            if self._store is None:
+                return None
+        return self._store.freeze()
+
+    def thaw(self):
+        if self._store is not None:
+            self._store.thaw()
+
+    def __getattr__(self, name):
+        # Every other method of the store loads it
+        return getattr(self.load(), name)
@@ -4,8 +4,8 @@ from database import *
 from utility import *
 from auth import *
 from database import data
-import threading
-import time
+from scheduler import scheduler_pending
+from clock import clock_time
 
 
 def message_send(token, channel_id, message):
@@ -73,6 +73,43 @@ def message_sendlater(token, channel_id, message, time_sent):
     check_valid_channel(channel_id)
     check_authorised_member_channel(channel_id, u_id)
     check_valid_message_length(message)
-    time_diff = check_time_diff(time_sent).seconds
-    t = threading.Timer(time_diff, data_message_send, args=[channel_id, u_id, message])
-    t.start()
+    check_time_diff(time_sent)
+    if time_sent <= clock_time():
+        # A message due now is sent before returning, not racing the scheduler
+        data_message_send(channel_id, u_id, message)
+        # Sent already, so there is nothing to cancel
+        return {
+            'job_id': None,
+        }
+    job_id = data_schedule_message(time_sent, channel_id, u_id, message)
+    return {
+        'job_id': job_id,
+    }
+
+def message_sendlater_cancel(token, job_id):
+    '''Cancel a message the user scheduled with message_sendlater'''
+    check_valid_token(token)
+    u_id = auth_u_id_from_token(token)
+    # Only messages sent later, not the other jobs of the scheduler
+    scheduled = data_schedule_get(job_id)
+    if scheduled is None:
+        raise InputError('No message is waiting to be sent with that job_id')
+    if scheduled[2] != u_id:
+        raise AccessError('The message was scheduled by another user')
+    if not data_schedule_cancel(job_id):
+        raise InputError('The message has been sent already')
+    return {}
+
+def message_sendlater_pending(token):
+    '''Return the messages the user scheduled that are still to be sent,
+    soonest first'''
+    check_valid_token(token)
+    u_id = auth_u_id_from_token(token)
+    return {
+        'messages': [{
+            'job_id': job['job_id'],
+            'channel_id': job['channel_id'],
+            'message': job['message'],
+            'time_sent': job['time'],
+        } for job in scheduler_pending(u_id=u_id)],
+    }
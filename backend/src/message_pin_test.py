@@ -1,12 +1,13 @@
 from auth import auth_register
 from channels import channels_create
 from channel import channel_join, channel_messages
-from message import message_send, message_pin, message_unpin, message_sendlater
-from other import clear
+from message import message_send, message_pin, message_unpin, message_sendlater, \
+    message_sendlater_cancel, message_sendlater_pending
+from other import clear, standup_start
 from error import InputError, AccessError
-import time
 import pytest
 import datetime
+from scheduler import scheduler_advance
 
 def test_message_pin_valid0():
     '''Owner of the channel pin the message sent by a member'''
@@ -449,7 +450,7 @@ def test_message_sendlater_valid0():
     assert message_info['messages'][1]['message'] == "Hi"
 
 
-def test_message_sendlater_valid1():
+def test_message_sendlater_valid1(virtual_clock):
     "User 1 sent a message 1 second later"
     clear()
 
@@ -472,11 +473,10 @@ def test_message_sendlater_valid1():
     # User 2 send a message
     message_send(user2_info['token'], channel1_info['channel_id'], "Hello")
     # USer 1 send a message 1 second later
-    one_sec_later = datetime.datetime.now() + datetime.timedelta(seconds=1)
-    timestamp = int(datetime.datetime.timestamp(one_sec_later))
+    timestamp = int(virtual_clock.time()) + 1
     message_sendlater(user1_info['token'], channel1_info['channel_id'], "Hi", timestamp)
     # User 0 get the info of messages 1 sec later
-    time.sleep(2)
+    assert scheduler_advance(2) == 1
     message_info = channel_messages(user0_info['token'], channel1_info['channel_id'], 0)
     assert message_info['messages'][1]['message'] == "Hi"
 
@@ -617,3 +617,49 @@ def test_message_sendlater_invalid3():
     timestamp = int(datetime.datetime.timestamp(zero_sec_later))
     with pytest.raises(AccessError):
         message_sendlater(user0_info['token'], channel1_info['channel_id'], "Hi", timestamp)
+
+def test_message_sendlater_cancel(virtual_clock):
+    '''User 1 lists and cancels messages sent later, which are then not sent'''
+    clear()
+    user0_info = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    user1_info = auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    channel_id = channels_create(user1_info['token'], "channel1", True)['channel_id']
+    channel_join(user0_info['token'], channel_id)
+    now = virtual_clock.time()
+    job0 = message_sendlater(user1_info['token'], channel_id, "Later", int(now) + 60)['job_id']
+    job1 = message_sendlater(user1_info['token'], channel_id, "Sooner", now + 0.3)['job_id']
+    job2 = message_sendlater(user0_info['token'], channel_id, "Mine", int(now) + 60)['job_id']
+    # Soonest first, and only the user's own
+    pending = message_sendlater_pending(user1_info['token'])['messages']
+    assert [item['job_id'] for item in pending] == [job1, job0]
+    assert pending[1] == {'job_id': job0, 'channel_id': channel_id, 'message': "Later",
+                          'time_sent': int(now) + 60}
+    # Only the sender can cancel
+    with pytest.raises(AccessError):
+        message_sendlater_cancel(user1_info['token'], job2)
+    assert message_sendlater_cancel(user1_info['token'], job0) == {}
+    with pytest.raises(InputError):
+        message_sendlater_cancel(user1_info['token'], job0)
+    # Sub-second times are kept
+    assert scheduler_advance(0.25) == 0
+    assert scheduler_advance(0.1) == 1
+    messages = channel_messages(user1_info['token'], channel_id, 0)['messages']
+    assert [message['message'] for message in messages] == ["Sooner"]
+    assert message_sendlater_pending(user1_info['token']) == {'messages': []}
+    # A delivered message can no longer be cancelled
+    with pytest.raises(InputError):
+        message_sendlater_cancel(user1_info['token'], job1)
+    clear()
+
+def test_message_sendlater_cancel_standup():
+    '''User 1 cannot cancel a standup by its job_id, which is not a message'''
+    clear()
+    user1_info = auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    channel_id = channels_create(user1_info['token'], "channel1", True)['channel_id']
+    standup_start(user1_info['token'], channel_id, 60)
+    for job_id in range(3):
+        with pytest.raises(InputError):
+            message_sendlater_cancel(user1_info['token'], job_id)
+    with pytest.raises(InputError):
+        message_sendlater_cancel(user1_info['token'], [0])
+    clear()
@@ -220,3 +220,33 @@ def test_message_unreact_no_active_react():
     # Message already unreacted by user 1
     with pytest.raises(InputError):
         assert message_unreact(user1_info['token'], message0_info['message_id'] , 1)
+
+def test_message_unreact_not_reacted_by_user():
+    '''Test if function raises an input error when only other users reacted'''
+    clear()
+    user0_info = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    user1_info = auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    channel0_info = channels_create(user0_info['token'], "channel0", True)
+    channel_join(user1_info['token'], channel0_info['channel_id'])
+    message0_info = message_send(user0_info['token'], channel0_info['channel_id'], "Hello")
+    message_react(user0_info['token'], message0_info['message_id'], 1)
+    with pytest.raises(InputError):
+        message_unreact(user1_info['token'], message0_info['message_id'], 1)
+
+def test_channel_messages_views_do_not_share_reacts():
+    '''Test if each viewer gets their own react flags from channel messages'''
+    clear()
+    user0_info = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    user1_info = auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    channel0_info = channels_create(user0_info['token'], "channel0", True)
+    channel_join(user1_info['token'], channel0_info['channel_id'])
+    message0_info = message_send(user0_info['token'], channel0_info['channel_id'], "Hello")
+    message_react(user0_info['token'], message0_info['message_id'], 1)
+    view0 = channel_messages(user0_info['token'], channel0_info['channel_id'], 0)
+    view1 = channel_messages(user1_info['token'], channel0_info['channel_id'], 0)
+    assert view0['messages'][0]['reacts'][0]['is_this_user_reacted']
+    assert not view1['messages'][0]['reacts'][0]['is_this_user_reacted']
+    # Changing a returned view does not change what is stored
+    view1['messages'][0]['reacts'][0]['u_ids'].append(1)
+    view2 = channel_messages(user1_info['token'], channel0_info['channel_id'], 0)
+    assert view2['messages'][0]['reacts'][0]['u_ids'] == [0]
@@ -0,0 +1,238 @@
+'''Storage for the messages of one channel, kept in the order they were sent'''
+from bisect import bisect_left, insort
+import threading
+
+# A store is compacted once more than this share of its slots are tombstones
+COMPACT_RATIO = 0.25
+# and there are at least this many of them
+COMPACT_MIN = 64
+
+def live_slot(tombstones, index):
+    '''Return the slot position of the live message at index, given the sorted
+    slot positions of the tombstones'''
+    # The j-th tombstone has tombstones[j] - j live messages before it,
+    # find how many tombstones come before the wanted message
+    low, high = 0, len(tombstones)
+    while low < high:
+        middle = (low + high) // 2
+        if tombstones[middle] - middle <= index:
+            low = middle + 1
+        else:
+            high = middle
+    return index + low
+
+class MessageStore:
+    '''The messages of a channel, oldest first. Message ids ascend in the order
+    messages are appended, so a message can be found by bisecting the ids.
+
+    Removing a message leaves a tombstone (None) in its slot instead of
+    rebuilding the list. Once tombstones pass the compaction threshold a
+    background thread rebuilds the list without them.
+
+    freeze() starts a point-in-time view for a checkpoint. Until thaw(),
+    the slot list is copied before its first tombstone and a message is
+    copied before its first change through writable(), so the view keeps
+    the messages as they were.'''
+
+    def __init__(self, messages=()):
+        self._slots = list(messages)
+        self._ids = [message.message_id for message in self._slots]
+        # Sorted slot positions of the tombstones
+        self._tombstones = []
+        self._lock = threading.Lock()
+        self._compacting = False
+        # Ids of the messages copied out of the frozen view, None when not frozen
+        self._copied = None
+        # Whether _slots is still the list in the frozen view
+        self._slots_shared = False
+        # Slot positions writable() copied a message into while a compaction
+        # copies the slots, None when not compacting
+        self._replaced = None
+
+    def __len__(self):
+        return len(self._slots) - len(self._tombstones)
+
+    def __iter__(self):
+        for message in self._slots:
+            if message is not None:
+                yield message
+
+    def id_range(self):
+        '''Return the first and last message ids the store has held, or None'''
+        with self._lock:
+            return (self._ids[0], self._ids[-1]) if len(self._ids) else None
+
+    def message_ids(self):
+        '''Return the ids of the messages, oldest first'''
+        with self._lock:
+            return [message.message_id for message in self._slots if message is not None]
+
+    def append(self, message):
+        with self._lock:
+            self._slots.append(message)
+            self._ids.append(message.message_id)
+
+    def _position(self, message_id):
+        position = bisect_left(self._ids, message_id)
+        if position < len(self._ids) and self._ids[position] == message_id \
+                and self._slots[position] is not None:
+            return position
+        return None
+
+    def get(self, message_id):
+        '''Return the message with the given id, or None'''
+        with self._lock:
+            position = self._position(message_id)
+            if position is None:
+                return None
+            return self._slots[position]
+
+    def writable(self, message_id):
+        '''Return the message with the given id to be changed in place, or None'''
+        with self._lock:
+            position = self._position(message_id)
+            if position is None:
+                return None
+            message = self._slots[position]
+            if self._copied is not None and message_id not in self._copied:
+                self._unshare()
+                message = self._slots[position] = message.copy()
+                self._copied.add(message_id)
+                if self._replaced is not None:
+                    self._replaced.append(position)
+            return message
+
+    def _unshare(self):
+        if self._slots_shared:
+            self._slots = list(self._slots)
+            self._slots_shared = False
+
+    def freeze(self):
+        '''Start a point-in-time view of the store, returned for export_frozen'''
+        with self._lock:
+            self._copied = set()
+            self._slots_shared = True
+            return self._slots, len(self._slots)
+
+    def thaw(self):
+        '''End the view started by freeze'''
+        with self._lock:
+            self._copied = None
+            self._slots_shared = False
+
+    @staticmethod
+    def frozen_messages(view):
+        '''Return the live messages of a view returned by freeze, oldest first'''
+        slots, length = view
+        return [message for message in slots[:length] if message is not None]
+
+    def remove(self, message_id):
+        '''Tombstone the message with the given id, returns whether it was there'''
+        with self._lock:
+            position = self._position(message_id)
+            if position is None:
+                return False
+            self._unshare()
+            self._slots[position] = None
+            insort(self._tombstones, position)
+            start_compaction = self._needs_compaction()
+            if start_compaction:
+                self._compacting = True
+        if start_compaction:
+            threading.Thread(target=self._compact, daemon=True).start()
+        return True
+
+    def _needs_compaction(self):
+        tombstones = len(self._tombstones)
+        return not self._compacting and tombstones >= COMPACT_MIN \
+            and tombstones > len(self._slots) * COMPACT_RATIO
+
+    def _slot(self, index):
+        '''Return the slot position of the live message at index, counting
+        from the oldest message'''
+        return live_slot(self._tombstones, index)
+
+    def page(self, start, end=-1, newest_first=False):
+        '''Return the messages from index start up to but excluding end (-1 for
+        the last message), counted from the oldest or the newest message'''
+        with self._lock:
+            total = len(self)
+            if end == -1 or end > total:
+                end = total
+            count = end - start
+            if count <= 0:
+                return []
+            if not newest_first:
+                if not self._tombstones:
+                    return self._slots[start:end]
+                position, step = self._slot(start), 1
+            else:
+                position, step = self._slot(total - 1 - start), -1
+            messages = []
+            while len(messages) < count:
+                message = self._slots[position]
+                if message is not None:
+                    messages.append(message)
+                position += step
+            return messages
+
+    def search(self, query_str):
+        '''Return the messages whose text contains query_str, oldest first'''
+        with self._lock:
+            return [message for message in self._slots
+                    if message is not None and query_str in message.message]
+
+    def by_user(self, u_id):
+        '''Return the messages sent by the user with u_id, oldest first'''
+        with self._lock:
+            return [message for message in self._slots
+                    if message is not None and message.u_id == u_id]
+
+    def in_time_range(self, start, end):
+        '''Return the messages created from time start up to but excluding end'''
+        with self._lock:
+            return [message for message in self._slots
+                    if message is not None and start <= message.time_created < end]
+
+    def compact(self):
+        '''Rebuild the store without its tombstones'''
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        self._compact()
+
+    def _compact(self):
+        # Copy the live slots without holding the lock, so requests on this
+        # channel carry on while the new list is built
+        with self._lock:
+            length = len(self._slots)
+            dropped = list(self._tombstones)
+            slots, ids = self._slots, self._ids
+            self._replaced = []
+        skip = set(dropped)
+        kept = [position for position in range(length) if position not in skip]
+        new_slots = [slots[position] for position in kept]
+        new_ids = [ids[position] for position in kept]
+        with self._lock:
+            # Messages copied out of a frozen view meanwhile may be in slots
+            # the copy has already read
+            for position in self._replaced:
+                if position < length and position not in skip:
+                    new_slots[position - bisect_left(dropped, position)] = self._slots[position]
+            self._replaced = None
+            # Messages appended or tombstoned while the copy was made still
+            # have to be carried over into the new list
+            new_slots.extend(self._slots[length:])
+            new_ids.extend(self._ids[length:])
+            new_tombstones = []
+            for position in self._tombstones:
+                if position >= length:
+                    new_tombstones.append(position - len(dropped))
+                elif position not in skip:
+                    new_tombstones.append(position - bisect_left(dropped, position))
+            for position in new_tombstones:
+                new_slots[position] = None
+            self._slots, self._ids, self._tombstones = new_slots, new_ids, new_tombstones
+            self._slots_shared = False
+            self._compacting = False
@@ -0,0 +1,146 @@
+import threading
+from message_store import MessageStore
+from records import Message
+
+def make_store(count):
+    store = MessageStore()
+    for message_id in range(count):
+        store.append(Message(message_id * 2, 0, f'message {message_id}', 0))
+    return store
+
+def ids(messages):
+    return [message.message_id for message in messages]
+
+# Test if pages are slices counted from the oldest message
+def test_page_oldest_first():
+    store = make_store(5)
+    assert len(store) == 5
+    assert ids(store.page(0)) == [0, 2, 4, 6, 8]
+    assert ids(store.page(1, 3)) == [2, 4]
+    assert ids(store.page(3, 10)) == [6, 8]
+    assert store.page(5) == []
+
+# Test if pages can be counted from the newest message
+def test_page_newest_first():
+    store = make_store(5)
+    assert ids(store.page(0, -1, True)) == [8, 6, 4, 2, 0]
+    assert ids(store.page(1, 3, True)) == [6, 4]
+    assert ids(store.page(3, 10, True)) == [2, 0]
+    assert store.page(5, -1, True) == []
+
+# Test if messages are found and removed by id
+def test_get_remove():
+    store = make_store(5)
+    assert store.get(4)['message'] == 'message 2'
+    assert store.get(5) is None
+    assert store.remove(4)
+    assert not store.remove(4)
+    assert store.get(4) is None
+    assert ids(store) == [0, 2, 6, 8]
+
+# Test if pages skip tombstones in both directions
+def test_page_with_tombstones():
+    store = make_store(10)
+    for message_id in (0, 6, 8, 18):
+        store.remove(message_id)
+    assert len(store) == 6
+    assert ids(store) == [2, 4, 10, 12, 14, 16]
+    assert ids(store.page(0)) == [2, 4, 10, 12, 14, 16]
+    assert ids(store.page(1, 4)) == [4, 10, 12]
+    assert ids(store.page(2, -1, True)) == [12, 10, 4, 2]
+    assert ids(store.page(5, 6, True)) == [2]
+    assert store.page(6) == []
+
+# Test if compaction drops tombstones without changing what the store holds
+def test_compact():
+    store = make_store(10)
+    for message_id in (0, 6, 8, 18):
+        store.remove(message_id)
+    store.compact()
+    assert store._tombstones == []
+    assert len(store._slots) == 6
+    assert ids(store.page(1, 4)) == [4, 10, 12]
+    assert store.get(10)['message'] == 'message 5'
+    assert store.remove(10)
+    assert ids(store.page(0)) == [2, 4, 12, 14, 16]
+
+# Test if enough removes compact the store in the background
+def test_background_compaction():
+    store = make_store(1000)
+    for message_id in range(0, 1000, 2):
+        store.remove(message_id)
+    for thread in threading.enumerate():
+        # The scheduler thread runs for as long as the process
+        if thread is not threading.current_thread() and thread.name != 'scheduler':
+            thread.join(timeout=5)
+    assert len(store) == 500
+    assert len(store._slots) < 1000
+    assert ids(store.page(0, 3)) == [1000, 1002, 1004]
+    assert ids(store.page(0, 2, True)) == [1998, 1996]
+
+class InterruptedList(list):
+    '''A list that runs a callback the first time one of its items is read'''
+    def __getitem__(self, key):
+        if not isinstance(key, slice) and self.callback is not None:
+            callback, self.callback = self.callback, None
+            callback()
+        return super().__getitem__(key)
+
+# Test if messages removed or appended while a compaction copies the store are
+# carried over
+def test_compact_concurrent_changes():
+    store = make_store(10)
+    store.remove(2)
+    def concurrent_changes():
+        store.append(Message(20, 0, 'late', 0))
+        store.remove(0)
+        store.remove(8)
+    store._slots = InterruptedList(store._slots)
+    store._slots.callback = concurrent_changes
+    store.compact()
+    assert ids(store) == [4, 6, 10, 12, 14, 16, 18, 20]
+    assert store._tombstones == [0, 3]
+    assert ids(store.page(6, -1, True)) == [6, 4]
+    assert store.get(8) is None
+    assert store.get(20)['message'] == 'late'
+
+class LateList(list):
+    '''A list that runs a callback the first time its item at position is read'''
+    def __getitem__(self, key):
+        if key == self.position and self.callback is not None:
+            callback, self.callback = self.callback, None
+            callback()
+        return super().__getitem__(key)
+
+# Test if a message changed in a frozen store while a compaction copies it keeps
+# its change, even in a slot the compaction has already copied
+def test_compact_frozen_writable():
+    store = make_store(10)
+    view = store.freeze()
+    store.remove(2)
+    def edit():
+        store.writable(0).message = 'edited'
+    store._slots = LateList(store._slots)
+    store._slots.position, store._slots.callback = 9, edit
+    store.compact()
+    assert store.get(0).message == 'edited'
+    assert MessageStore.frozen_messages(view)[0].message == 'message 0'
+    store.thaw()
+
+# Test if a frozen view keeps the messages as they were while the store changes
+def test_freeze():
+    store = make_store(5)
+    view = store.freeze()
+    store.writable(2).message = 'changed'
+    store.writable(2).is_pinned = True
+    store.remove(4)
+    store.append(Message(10, 0, 'late', 0))
+    store.compact()
+    frozen = MessageStore.frozen_messages(view)
+    assert ids(frozen) == [0, 2, 4, 6, 8]
+    assert frozen[1].message == 'message 1' and not frozen[1].is_pinned
+    store.thaw()
+    assert ids(store) == [0, 2, 6, 8, 10]
+    assert store.get(2).message == 'changed'
+    # Once thawed changes are made in place again
+    assert store.writable(2) is store.get(2)
@@ -2,12 +2,21 @@ import auth
 import channel
 import channels
 import pytest
+import itertools
+import sys
+import threading
 import message
 from error import InputError
 from error import AccessError
 from database import data
 from datetime import datetime, timezone
 from other import clear
+from column_store import ColumnStore
+import database
+import storage
+import tiered_store
+import other
+from clock import VirtualClock, clock_set
 
 # Test if message_send function raises an InputError when the message is more than 1000 characters.
 def test_invalid_long_message():
@@ -166,3 +175,192 @@ def test_message_edit():
     }
 
 
+
+# Test if a message edited to an empty string can no longer be found by its id
+def test_message_edit_empty_removes_message():
+    clear()
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channel_id = channels.channels_create(info['token'], 'validchannelname', True)
+    firstmessage = message.message_send(info['token'], channel_id['channel_id'], 'first')
+    message.message_send(info['token'], channel_id['channel_id'], 'second')
+    message.message_edit(info['token'], firstmessage['message_id'], '')
+    with pytest.raises(InputError):
+        message.message_edit(info['token'], firstmessage['message_id'], 'again')
+    with pytest.raises(InputError):
+        message.message_remove(info['token'], firstmessage['message_id'])
+    assert len(data['channels'][0]['messages']) == 1
+
+# Test if a channel keeps working after its messages move to column storage
+@pytest.mark.skipif(database.storage.name != 'memory', reason='column storage is in memory')
+def test_message_column_store(monkeypatch):
+    # Channels are TieredStores instead when messages spill to disk
+    monkeypatch.setattr(database.storage, 'cold_directory', None)
+    clear()
+    monkeypatch.setattr(storage, 'COLUMN_STORE_THRESHOLD', 3)
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channel_id = channels.channels_create(info['token'], 'validchannelname', True)['channel_id']
+    for text in ('hello', 'My name', '1s sam!', 'hello again'):
+        message.message_send(info['token'], channel_id, text)
+    assert isinstance(database.data_get_channel(channel_id).messages, ColumnStore)
+    message.message_edit(info['token'], 1, 'My hello')
+    message.message_remove(info['token'], 0)
+    message.message_pin(info['token'], 2)
+    message.message_react(info['token'], 2, 1)
+    messages = channel.channel_messages(info['token'], channel_id, 0)['messages']
+    assert [item['message'] for item in messages] == ['My hello', '1s sam!', 'hello again']
+    assert messages[1]['is_pinned']
+    assert messages[1]['reacts'][0]['is_this_user_reacted']
+    assert [item['message_id'] for item in other.search(info['token'], 'hello')['messages']] \
+        == [1, 3]
+
+# Test if a channel keeps working after its older messages are spilled to disk
+@pytest.mark.skipif(database.storage.name != 'memory', reason='tiers are in the memory engine')
+def test_message_tiered_store(monkeypatch, tmp_path):
+    monkeypatch.setattr(database.storage, 'cold_directory', str(tmp_path))
+    monkeypatch.setattr(tiered_store, 'HOT_MESSAGES', 2)
+    monkeypatch.setattr(tiered_store, 'SEGMENT_MESSAGES', 2)
+    clear()
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channel_id = channels.channels_create(info['token'], 'validchannelname', True)['channel_id']
+    for text in ('hello', 'My name', '1s sam!', 'hello again', 'bye'):
+        message.message_send(info['token'], channel_id, text)
+    assert len(database.data_get_channel(channel_id).messages.hot) == 3
+    message.message_edit(info['token'], 1, 'My hello')
+    message.message_remove(info['token'], 0)
+    message.message_pin(info['token'], 2)
+    message.message_react(info['token'], 2, 1)
+    messages = channel.channel_messages(info['token'], channel_id, 0)['messages']
+    assert [item['message'] for item in messages] == ['My hello', '1s sam!', 'hello again', 'bye']
+    assert messages[1]['is_pinned']
+    assert messages[1]['reacts'][0]['is_this_user_reacted']
+    assert [item['message_id'] for item in other.search(info['token'], 'hello')['messages']] \
+        == [1, 3]
+    with pytest.raises(InputError):
+        message.message_remove(info['token'], 0)
+    clear()
+
+class TickingClock(VirtualClock):
+    '''A clock a second later every time it is read'''
+    def __init__(self):
+        super().__init__()
+        self._ticks = itertools.count(int(self.now))
+
+    def time(self):
+        return next(self._ticks)
+
+# Test if messages sent from many threads at once all get different ids, and
+# each channel stores its messages in order of id and time
+def test_message_send_concurrent():
+    clear()
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channel_ids = [channels.channels_create(info['token'], f'channel{number}', True)['channel_id']
+                   for number in range(4)]
+    sent = []
+    def send(number):
+        for count in range(250):
+            channel_id = channel_ids[(number + count) % len(channel_ids)]
+            sent.append(message.message_send(info['token'], channel_id, 'hi')['message_id'])
+    threads = [threading.Thread(target=send, args=(number,)) for number in range(16)]
+    # Every send is at a different time, and threads switch often
+    previous = clock_set(TickingClock())
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+        clock_set(previous)
+    assert len(set(sent)) == len(sent) == 4000
+    assert sorted(sent) == list(range(4000))
+    for channel_id in channel_ids:
+        stored = database.data_channel_messages(channel_id, 0, -1)
+        ids = [item.message_id for item in stored]
+        assert len(ids) == 1000 and ids == sorted(ids)
+        # Times go up with ids, as searches by time expect
+        times = [item.time_created for item in stored]
+        assert times == sorted(times)
+    assert message.message_send(info['token'], channel_ids[0], 'last') == {'message_id': 4000}
+
+# Test if users registering, creating and joining channels at the same time
+# all get different ids and handles
+def test_register_join_concurrent():
+    clear()
+    owner = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channel_id = channels.channels_create(owner['token'], 'channel', True)['channel_id']
+    users, created = [], []
+    def register(number):
+        for count in range(20):
+            user = auth.auth_register(f'user{number}x{count}@gmail.com', 'password', 'Bill',
+                                      'Gates')
+            users.append(user['u_id'])
+            channel.channel_join(user['token'], channel_id)
+            created.append(channels.channels_create(user['token'], 'mine', True)['channel_id'])
+    threads = [threading.Thread(target=register, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(users) == list(range(1, 161))
+    assert sorted(created) == list(range(1, 161))
+    assert len(database.data_channel_members(channel_id)) == 161
+    assert len({user.handle for user in data['users']}) == 161
+
+# Test if a message removed after a request checked it is not changed, as each
+# change checks again under the channel's lock
+def test_message_removed_meanwhile():
+    clear()
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channel_id = channels.channels_create(info['token'], 'channel', True)['channel_id']
+    message_id = message.message_send(info['token'], channel_id, 'hi')['message_id']
+    database.data_message_remove(channel_id, message_id)
+    changes = [
+        lambda: database.data_message_edit(channel_id, message_id, 'edited'),
+        lambda: database.data_message_remove(channel_id, message_id),
+        lambda: database.data_message_pinned(message_id, channel_id),
+        lambda: database.data_message_unpinned(message_id, channel_id),
+        lambda: database.data_message_reacted(message_id, channel_id, 1, info['u_id']),
+        lambda: database.data_message_unreacted(message_id, channel_id, 1, info['u_id']),
+    ]
+    for change in changes:
+        with pytest.raises(InputError):
+            change()
+    assert database.data_channel_messages(channel_id, 0, -1) == []
+
+# Test if messages can be viewed while their reacts are being changed, as
+# views read the reacts without the channel's lock
+def test_message_view_reacting():
+    clear()
+    info = auth.auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Bill", "Gates")
+    channel_id = channels.channels_create(info['token'], 'channel', True)['channel_id']
+    message_id = message.message_send(info['token'], channel_id, 'hi')['message_id']
+    done = threading.Event()
+    def react():
+        for count in range(300):
+            for react_id in range(1, 20):
+                database.data_message_reacted(message_id, channel_id, react_id, count)
+            for react_id in range(1, 20):
+                database.data_message_unreacted(message_id, channel_id, react_id, count)
+        done.set()
+    failed = []
+    def view():
+        while not done.is_set():
+            try:
+                channel.channel_messages(info['token'], channel_id, 0)
+            except RuntimeError as error:
+                failed.append(error)
+                return
+    threads = [threading.Thread(target=react)] + [threading.Thread(target=view) for _ in range(4)]
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert failed == []
+    assert channel.channel_messages(info['token'], channel_id, 0)['messages'][0]['reacts'] == []
@@ -1,10 +1,13 @@
 from database import *
 from utility import *
 from auth import auth_u_id_from_token
+from scheduler import scheduler_clear
 
 
 # Resets the internal data of the application to it's initial state
 def clear():
+    # Messages sent later would go to channels that no longer exist
+    scheduler_clear()
     data_clear()
 
 # Returns a list of all users and their associated details
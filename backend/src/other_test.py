@@ -7,10 +7,11 @@ from database import *
 from error import AccessError, InputError
 from other import clear
 from time import sleep, time
-from message import message_send
+from message import message_send, message_edit, message_remove
 import pytest
 import threading
 from datetime import datetime, timezone, timedelta
+from scheduler import scheduler_advance
 
 # Test users_all function
 def test_users_all():
@@ -134,6 +135,29 @@ def test_search():
         },
     ]}
 
+# test if search follows edits, removes and the channels the user is in
+def test_search_after_changes():
+    clear()
+    info1 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    info2 = auth_register("johnson@icloud.com", "RFVtgb45678", "M", "Johnson")
+    channels_create(info1['token'], 'first', True)
+    channels_create(info2['token'], 'second', True)
+    message_send(info1['token'], 0, "first hello")
+    message_send(info2['token'], 1, "second hello")
+    message_send(info1['token'], 0, "third hello")
+    assert [m['message_id'] for m in search(info1['token'], 'hello')['messages']] == [0, 2]
+    assert [m['message_id'] for m in search(info2['token'], 'hello')['messages']] == [1]
+    message_edit(info1['token'], 0, "first goodbye")
+    assert [m['message_id'] for m in search(info1['token'], 'hello')['messages']] == [2]
+    assert search(info1['token'], 'goodbye')['messages'][0]['message'] == "first goodbye"
+    message_remove(info1['token'], 2)
+    assert search(info1['token'], 'hello')['messages'] == []
+    channel_join(info1['token'], 1)
+    assert [m['message_id'] for m in search(info1['token'], 'hello')['messages']] == [1]
+    # queries shorter than three characters still match substrings
+    assert [m['message_id'] for m in search(info1['token'], 'he')['messages']] == [1]
+    assert len(search(info1['token'], '')['messages']) == 2
+
 # test if function raises Exception if the token is invalid
 def test_search_except():
     clear()
@@ -214,17 +238,17 @@ def test_standup_active_invalid_token():
         standup_active(info2['token'] + 'a', 0)
 
 
-def test_standup_send1():
+def test_standup_send1(virtual_clock):
     clear()
     info2 = auth_register("johnson@icloud.com", "RFVtgb45678", "M", "Johnson")
     channels_create(info2['token'], 'first', True)
     standup_start(info2['token'], 0, 5)
-    time = round((datetime.utcnow() + timedelta(seconds=5)).replace(tzinfo=timezone.utc).timestamp(), 0)
+    time = round(virtual_clock.time() + 5, 0)
     standup_send(info2['token'], 0, 'hello')
     standup_send(info2['token'], 0, 'asd')
     standup_send(info2['token'], 0, 'dfg')
     standup_send(info2['token'], 0, 'abc')
-    sleep(6)
+    scheduler_advance(6)
     assert channel_messages(info2['token'], 0, 0) == {
         'messages':
         [
@@ -313,3 +337,50 @@ def test_standup_send_invalid_token():
     standup_start(info2['token'], 0, 20)
     with pytest.raises(AccessError):
         standup_send(info2['token'] + 'a', 0, 'abc')
+
+# Test if hundreds of standups at once run without a thread each, and each
+# sends its own messages joined into one when it finishes
+def test_standup_many(virtual_clock):
+    clear()
+    info2 = auth_register("johnson@icloud.com", "RFVtgb45678", "M", "Johnson")
+    channel_ids = [channels_create(info2['token'], f'channel{number}', True)['channel_id']
+                   for number in range(300)]
+    standup_start(info2['token'], channel_ids[0], 0.5)
+    threads = threading.active_count()
+    for channel_id in channel_ids[1:]:
+        standup_start(info2['token'], channel_id, 0.5)
+    assert threading.active_count() == threads
+    for channel_id in channel_ids:
+        standup_send(info2['token'], channel_id, f'in {channel_id}')
+        standup_send(info2['token'], channel_id, 'bye')
+    assert all(standup_active(info2['token'], channel_id)['is_active']
+               for channel_id in channel_ids)
+    assert scheduler_advance(1) == 300
+    for channel_id in channel_ids:
+        assert standup_active(info2['token'], channel_id) == {
+            'is_active': False,
+            'time_finish': None,
+        }
+        messages = channel_messages(info2['token'], channel_id, 0)['messages']
+        assert [message['message'] for message in messages] == \
+            [f'MJohnson: in {channel_id}\nMJohnson: bye\n']
+    clear()
+
+# Test if only one of many standups started at once in a channel runs
+def test_standup_start_concurrent():
+    clear()
+    info2 = auth_register("johnson@icloud.com", "RFVtgb45678", "M", "Johnson")
+    channels_create(info2['token'], 'first', True)
+    started = []
+    def start():
+        try:
+            started.append(data_standup_start(0, 0, 20))
+        except InputError:
+            pass
+    threads = [threading.Thread(target=start) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(started) == 1
+    clear()
@@ -0,0 +1,31 @@
+'''Keeps the database on disk: recovers it at startup from the latest snapshot
+and the write-ahead log records after it, then logs every change and takes
+snapshots in the background. The messages sent later that it recovers are
+scheduled again, and those overdue sent at once.'''
+import config
+from database import data_replay, data_schedule_start
+from snapshot import snapshot_load, snapshot_save, snapshot_start
+from wal import wal_replay, wal_open, wal_close
+
+def persistence_start():
+    '''Recover the database and start persisting it, as set in config'''
+    first_segment = 0
+    if config.SNAPSHOT_PATH:
+        loaded = snapshot_load(config.SNAPSHOT_PATH)
+        if loaded is not None:
+            print(f"Loaded {loaded['messages']} messages in {loaded['seconds']:.3f}s")
+            first_segment = loaded['wal_segment'] or 0
+    if config.WAL_DIRECTORY:
+        replayed = wal_replay(config.WAL_DIRECTORY, first_segment, data_replay)
+        print(f"Replayed {replayed} write-ahead log records")
+        wal_open(config.WAL_DIRECTORY, config.WAL_FSYNC, config.WAL_INTERVAL)
+    if config.SNAPSHOT_PATH:
+        snapshot_start(config.SNAPSHOT_PATH, config.SNAPSHOT_INTERVAL)
+    # Once the log is open, so the messages sent from now on are logged
+    data_schedule_start()
+
+def persistence_stop():
+    '''Save a last snapshot and close the write-ahead log'''
+    if config.SNAPSHOT_PATH:
+        snapshot_save(config.SNAPSHOT_PATH)
+    wal_close()
@@ -0,0 +1,44 @@
+'''Registers whole cohorts of users at once from a CSV file with the columns
+email, password, name_first and name_last. Users are registered in batches
+with auth_register_bulk: each batch is checked first and registered only if
+every user in it is valid.
+
+Usage: python provision.py PATH, where PATH may be - for stdin'''
+import csv
+import sys
+from auth import auth_register_bulk
+
+'''Users registered together'''
+BATCH_USERS = 1000
+
+def provision_users(rows):
+    '''Register the users of rows, dicts with the arguments of auth_register,
+    in batches. Returns their u_ids.'''
+    u_ids = []
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_USERS:
+            u_ids.extend(auth_register_bulk(batch)['u_ids'])
+            batch = []
+    if batch:
+        u_ids.extend(auth_register_bulk(batch)['u_ids'])
+    return u_ids
+
+def provision_csv(file):
+    '''Register the users of a CSV file. Returns their u_ids.'''
+    return provision_users(csv.DictReader(file))
+
+if __name__ == "__main__":
+    from persistence import persistence_start, persistence_stop
+    path = sys.argv[1]
+    persistence_start()
+    try:
+        if path == '-':
+            u_ids = provision_csv(sys.stdin)
+        else:
+            with open(path, newline='', encoding='utf-8') as file:
+                u_ids = provision_csv(file)
+        print(f'Registered {len(u_ids)} users')
+    finally:
+        persistence_stop()
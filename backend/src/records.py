@@ -0,0 +1,88 @@
+'''Compact record types for the users, channels and messages in the database.
+Each record keeps its fields in __slots__ instead of a per-object dict, and
+can still be read and written like a dict (record['name']) by older code.'''
+from rwlock import RWLock
+
+class Record:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{type(self).__name__}({fields})'
+
+class User(Record):
+    __slots__ = ('u_id', 'email', 'password', 'name_first', 'name_last', 'handle', 'token',
+                 'permission_id', 'profile_img_url', 'reset_code')
+
+    def __init__(self, u_id, email, password, name_first, name_last, handle, token,
+                 permission_id):
+        self.u_id = u_id
+        self.email = email
+        self.password = password
+        self.name_first = name_first
+        self.name_last = name_last
+        self.handle = handle
+        self.token = token
+        self.permission_id = permission_id
+        self.profile_img_url = f'static/{u_id}.jpg'
+        self.reset_code = ""
+
+class Channel(Record):
+    __slots__ = ('channel_id', 'name', 'visibility', 'members', 'owners', 'member_ids',
+                 'owner_ids', 'messages', 'standup', 'lock')
+
+    def __init__(self, channel_id, name, visibility, messages):
+        self.channel_id = channel_id
+        self.name = name
+        self.visibility = visibility
+        self.members = []
+        self.owners = []
+        self.member_ids = set()
+        self.owner_ids = set()
+        self.messages = messages
+        # The Standup running in the channel, or None
+        self.standup = None
+        # Held exclusively to change the channel's members or messages, and
+        # shared to read them
+        self.lock = RWLock()
+
+class Standup(Record):
+    '''A standup started by the user with u_id, finishing at time_finish.
+    Messages sent to it are kept as fragments and joined once, when it
+    finishes.'''
+    __slots__ = ('u_id', 'time_finish', 'fragments')
+
+    def __init__(self, u_id, time_finish):
+        self.u_id = u_id
+        self.time_finish = time_finish
+        self.fragments = []
+
+class Message(Record):
+    __slots__ = ('message_id', 'u_id', 'message', 'time_created', 'reacts', 'is_pinned')
+
+    def __init__(self, message_id, u_id, message, time_created, reacts=None, is_pinned=False):
+        self.message_id = message_id
+        self.u_id = u_id
+        self.message = message
+        self.time_created = time_created
+        # react_id -> u_ids that reacted, a dict so they keep their order.
+        # None until the first react, most messages never get one.
+        self.reacts = reacts
+        self.is_pinned = is_pinned
+
+    def copy(self):
+        '''Return a copy that shares nothing mutable with this message'''
+        reacts = self.reacts
+        if reacts is not None:
+            reacts = {react_id: dict(u_ids) for react_id, u_ids in reacts.items()}
+        return Message(self.message_id, self.u_id, self.message, self.time_created, reacts,
+                       self.is_pinned)
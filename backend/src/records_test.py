@@ -0,0 +1,25 @@
+import pytest
+from records import User, Channel, Message
+
+# Test if records can be read and written like the dicts they replace
+def test_record_item_access():
+    message = Message(3, 1, 'hello', 100.0)
+    assert message['message_id'] == 3
+    assert message['reacts'] is None
+    message['is_pinned'] = True
+    assert message.is_pinned
+    with pytest.raises(KeyError):
+        message['handle']
+    with pytest.raises(AttributeError):
+        message.handle = 'nope'
+
+# Test if records fill in their defaults
+def test_record_defaults():
+    user = User(2, 'a@b.com', 'hash', 'A', 'B', 'ab', None, 2)
+    assert user['profile_img_url'] == 'static/2.jpg'
+    assert user['reset_code'] == ''
+    channel = Channel(0, 'first', True, [])
+    assert channel['members'] == [] and channel['member_ids'] == set()
+    assert channel['standup'] is None
+    assert repr(Message(0, 1, 'hi', 5.0)) == \
+        "Message(message_id=0, u_id=1, message='hi', time_created=5.0, reacts=None, is_pinned=False)"
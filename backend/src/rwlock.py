@@ -0,0 +1,65 @@
+'''A lock that many threads can hold shared, or one thread can hold exclusively'''
+from contextlib import contextmanager
+import threading
+
+class RWLock:
+    '''Shared holders run together, an exclusive holder runs alone. Once a
+    thread waits for exclusive access new shared holders wait behind it, so a
+    steady stream of shared holders cannot starve it. Not reentrant.'''
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+        # Threads blocked in wait(), releases only notify when there are some
+        self._sleepers = 0
+
+    def acquire_shared(self):
+        with self._cond:
+            while self._exclusive or self._waiting:
+                self._wait()
+            self._shared += 1
+
+    def release_shared(self):
+        with self._cond:
+            self._shared -= 1
+            if not self._shared and self._sleepers:
+                self._cond.notify_all()
+
+    def acquire_exclusive(self):
+        with self._cond:
+            self._waiting += 1
+            while self._exclusive or self._shared:
+                self._wait()
+            self._waiting -= 1
+            self._exclusive = True
+
+    def release_exclusive(self):
+        with self._cond:
+            self._exclusive = False
+            if self._sleepers:
+                self._cond.notify_all()
+
+    def _wait(self):
+        self._sleepers += 1
+        try:
+            self._cond.wait()
+        finally:
+            self._sleepers -= 1
+
+    @contextmanager
+    def shared(self):
+        self.acquire_shared()
+        try:
+            yield
+        finally:
+            self.release_shared()
+
+    @contextmanager
+    def exclusive(self):
+        self.acquire_exclusive()
+        try:
+            yield
+        finally:
+            self.release_exclusive()
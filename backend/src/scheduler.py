@@ -0,0 +1,176 @@
+'''One thread that runs functions at given times, such as the messages sent
+later. Jobs wait in a heap ordered by their time, so however many are pending
+there is still one thread, and each job costs one small object.
+
+Jobs that come due together are taken off the heap together, and those added
+with batch set are run with one call per function, such as the messages of
+many users sent later to the same second, or caught up after a restart.
+
+Times are read from the clock module. Under a VirtualClock the thread runs
+nothing, and scheduler_advance runs the jobs as it moves the time on.'''
+import heapq
+import threading
+import traceback
+from clock import clock_get, clock_listen
+from id_allocator import IdAllocator
+
+'''Cancelled jobs stay in the heap until they reach the top, unless they come
+to outnumber the live ones, when the heap is rebuilt without them'''
+_heap = []
+'''job_id -> Job still to run'''
+_pending = {}
+_cond = threading.Condition()
+'''Allocates the ids of jobs. The database saves it with the scheduled
+messages, so their ids are not handed out again after a restart.'''
+job_ids = IdAllocator()
+_state = {'thread': None}
+
+class Job:
+    '''A call of function(*args) at time when, or of function([args]) with
+    the args of every job due with it if batch is set. tags describe the job
+    to scheduler_pending, such as the channel and sender of a message.'''
+    __slots__ = ('job_id', 'when', 'function', 'args', 'tags', 'batch')
+
+    def __init__(self, job_id, when, function, args, tags, batch):
+        self.job_id = job_id
+        self.when = when
+        self.function = function
+        self.args = args
+        self.tags = tags
+        self.batch = batch
+
+    def view(self):
+        return {'job_id': self.job_id, 'time': self.when, **self.tags}
+
+def scheduler_add(when, function, args=(), tags=None, job_id=None, batch=False):
+    '''Run function(*args) on the scheduler thread once the time is when, a
+    timestamp in seconds. With batch set, function takes a list of args
+    instead, of this job and the others for it that come due together.
+    Returns the id of the job, allocated unless job_id is given.'''
+    if job_id is None:
+        job_id = job_ids.allocate()
+    job = Job(job_id, when, function, tuple(args), tags or {}, batch)
+    with _cond:
+        _pending[job.job_id] = job
+        heapq.heappush(_heap, (when, job.job_id))
+        if _state['thread'] is None:
+            _state['thread'] = threading.Thread(target=_run, name='scheduler',
+                                                 daemon=True)
+            _state['thread'].start()
+        # Only a new first job changes how long the thread should sleep
+        if _heap[0][1] == job.job_id:
+            _cond.notify()
+    return job.job_id
+
+def scheduler_cancel(job_id):
+    '''Stop a job from running. Returns its view, or None if it is not
+    pending.'''
+    with _cond:
+        job = _pending.pop(job_id, None)
+        if job is None:
+            return None
+        if len(_heap) > 2 * len(_pending) + 64:
+            _heap[:] = [entry for entry in _heap if entry[1] in _pending]
+            heapq.heapify(_heap)
+        return job.view()
+
+def scheduler_get(job_id):
+    '''Return the view of a pending job, or None'''
+    with _cond:
+        job = _pending.get(job_id)
+        return None if job is None else job.view()
+
+def scheduler_pending(**tags):
+    '''Return the views of the pending jobs with the given tags, soonest first'''
+    with _cond:
+        jobs = [job for job in _pending.values()
+                if all(job.tags.get(name) == value for name, value in tags.items())]
+    jobs.sort(key=lambda job: (job.when, job.job_id))
+    return [job.view() for job in jobs]
+
+def scheduler_clear():
+    '''Cancel every pending job'''
+    with _cond:
+        _pending.clear()
+        _heap.clear()
+
+def scheduler_advance(seconds):
+    '''Move the virtual clock on by seconds. The jobs that come due meanwhile
+    are run on this thread as they would be on the scheduler thread: soonest
+    first, with the clock at their time. Returns the number of jobs run.'''
+    clock = clock_get()
+    if not clock.virtual:
+        raise ValueError('Only a virtual clock can be advanced')
+    end = clock.now + seconds
+    count = 0
+    while True:
+        with _cond:
+            _drop_cancelled()
+            if not _heap or _heap[0][0] > end:
+                break
+            clock.now = max(clock.now, _heap[0][0])
+            due = _take_due(clock.now)
+        # Jobs run outside the lock, so they can add jobs of their own
+        _run_jobs(due)
+        count += len(due)
+    clock.now = max(clock.now, end)
+    return count
+
+def _drop_cancelled():
+    while _heap and _heap[0][1] not in _pending:
+        heapq.heappop(_heap)
+
+def _take_due(now):
+    '''Take every job due by now off the heap and return them, soonest first'''
+    due = []
+    while _heap and _heap[0][0] <= now:
+        job = _pending.pop(heapq.heappop(_heap)[1], None)
+        if job is not None:
+            due.append(job)
+    return due
+
+def _next_due():
+    '''Wait for the first job to be due, then take every job due by then off
+    the heap and return them'''
+    with _cond:
+        while True:
+            _drop_cancelled()
+            clock = clock_get()
+            # Virtual time only moves in scheduler_advance, which runs the jobs
+            if not _heap or clock.virtual:
+                _cond.wait()
+                continue
+            now = clock.time()
+            if _heap[0][0] > now:
+                _cond.wait(_heap[0][0] - now)
+                continue
+            return _take_due(now)
+
+def _wake():
+    with _cond:
+        _cond.notify()
+
+clock_listen(_wake)
+
+def _run():
+    while True:
+        _run_jobs(_next_due())
+
+def _run_jobs(due):
+    # function -> args of the batch jobs for it, in the order they came due
+    batches = {}
+    for job in due:
+        if job.batch:
+            batches.setdefault(job.function, []).append(job.args)
+        else:
+            _call(job.function, *job.args)
+    for function, args in batches.items():
+        _call(function, args)
+
+def _call(function, *args):
+    try:
+        function(*args)
+    except Exception:
+        # A failing job, say for a channel cleared meanwhile, must not stop
+        # the jobs after it
+        traceback.print_exc()
@@ -0,0 +1,86 @@
+import threading
+import time
+import pytest
+from clock import clock_time
+from scheduler import scheduler_add, scheduler_cancel, scheduler_get, scheduler_pending, \
+    scheduler_clear, scheduler_advance
+
+# Test if jobs run in the order of their times, whatever order they are added in
+def test_scheduler_order():
+    scheduler_clear()
+    ran = []
+    done = threading.Event()
+    now = time.time()
+    for delay in (0.3, 0.1, 0.2):
+        scheduler_add(now + delay, ran.append, (delay,))
+    scheduler_add(now + 0.4, done.set)
+    assert done.wait(5)
+    assert ran == [0.1, 0.2, 0.3]
+
+# Test if a cancelled job does not run and is no longer pending
+def test_scheduler_cancel():
+    scheduler_clear()
+    ran = []
+    done = threading.Event()
+    now = time.time()
+    job_id = scheduler_add(now + 0.1, ran.append, ('cancelled',), {'u_id': 1})
+    scheduler_add(now + 0.2, done.set)
+    assert scheduler_get(job_id) == {'job_id': job_id, 'time': now + 0.1, 'u_id': 1}
+    assert scheduler_cancel(job_id)['u_id'] == 1
+    assert scheduler_get(job_id) is None
+    assert scheduler_cancel(job_id) is None
+    assert done.wait(5)
+    assert ran == []
+
+# Test if pending jobs are filtered by their tags and listed soonest first
+def test_scheduler_pending():
+    scheduler_clear()
+    now = time.time()
+    later = scheduler_add(now + 120, print, (), {'u_id': 0})
+    sooner = scheduler_add(now + 60, print, (), {'u_id': 0})
+    scheduler_add(now + 30, print, (), {'u_id': 1})
+    assert [job['job_id'] for job in scheduler_pending(u_id=0)] == [sooner, later]
+    assert len(scheduler_pending()) == 3
+    scheduler_clear()
+    assert scheduler_pending() == []
+
+# Test if many pending jobs share one thread, and the cancelled ones leave the heap
+def test_scheduler_many():
+    scheduler_clear()
+    now = time.time()
+    scheduler_add(now + 60, print)
+    threads = threading.active_count()
+    job_ids = [scheduler_add(now + 60 + i, print) for i in range(10000)]
+    assert threading.active_count() == threads
+    for job_id in job_ids:
+        scheduler_cancel(job_id)
+    import scheduler
+    assert len(scheduler._heap) < 100
+    scheduler_clear()
+
+# Test if advancing a virtual clock runs the jobs due on the way in order, each
+# at its own time, including those the jobs add
+def test_scheduler_advance(virtual_clock):
+    scheduler_clear()
+    virtual_clock.now = 1000
+    ran = []
+    def first():
+        ran.append(('first', clock_time()))
+        scheduler_add(clock_time() + 1, lambda: ran.append(('added', clock_time())))
+    scheduler_add(1010, lambda: ran.append(('second', clock_time())))
+    scheduler_add(1005, first)
+    scheduler_add(1020, lambda: ran.append(('after', clock_time())))
+    assert scheduler_advance(15) == 3
+    assert ran == [('first', 1005), ('added', 1006), ('second', 1010)]
+    assert virtual_clock.time() == 1015
+    # A job already due waits for the clock to be advanced
+    scheduler_add(900, lambda: ran.append(('overdue', clock_time())))
+    time.sleep(0.1)
+    assert len(ran) == 3
+    assert scheduler_advance(0) == 1
+    assert ran[-1] == ('overdue', 1015)
+
+# Test if only a virtual clock can be advanced
+def test_scheduler_advance_system():
+    with pytest.raises(ValueError):
+        scheduler_advance(1)
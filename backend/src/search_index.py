@@ -0,0 +1,109 @@
+'''Inverted index from the trigrams of message texts to message ids. A message
+can only contain a query if it contains every trigram of the query, so search
+only has to check the messages in the intersection of those posting lists.'''
+import threading
+
+'''trigram -> set of the message_ids whose text contains that trigram'''
+postings = {}
+'''Whether postings covers every message, it does not while messages are being
+indexed by search_index_build'''
+state = {'ready': True, 'building': 0}
+_lock = threading.Lock()
+# Messages indexed at a time by search_index_build
+BUILD_BATCH = 1000
+
+def trigrams(text):
+    '''Return the set of three character substrings of text'''
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def _add(message_id, text):
+    for gram in trigrams(text):
+        ids = postings.get(gram)
+        if ids is None:
+            postings[gram] = {message_id}
+        else:
+            ids.add(message_id)
+
+def search_index_add(message_id, text):
+    with _lock:
+        _add(message_id, text)
+
+def search_index_remove(message_id, text):
+    with _lock:
+        for gram in trigrams(text):
+            ids = postings.get(gram)
+            if ids is not None:
+                ids.discard(message_id)
+                if not ids:
+                    del postings[gram]
+
+def search_index_drop(messages):
+    '''Remove the (message_id, text) pairs of many messages at once. Sets never
+    shrink as ids are discarded, so the posting lists they leave smaller are
+    copied to sets of the size they have now.'''
+    with _lock:
+        touched = set()
+        for message_id, text in messages:
+            for gram in trigrams(text):
+                ids = postings.get(gram)
+                if ids is not None:
+                    ids.discard(message_id)
+                    touched.add(gram)
+        for gram in touched:
+            ids = postings[gram]
+            if ids:
+                postings[gram] = set(ids)
+            else:
+                del postings[gram]
+
+def search_index_build(messages):
+    '''Index the (message_id, text) pairs of messages in a background thread.
+    Until every build is done search_index_candidates answers None, so
+    searches check the messages themselves.'''
+    with _lock:
+        state['building'] += 1
+        state['ready'] = False
+    def build():
+        batch = []
+        for pair in messages:
+            batch.append(pair)
+            if len(batch) == BUILD_BATCH:
+                add_batch(batch)
+        add_batch(batch)
+        with _lock:
+            state['building'] -= 1
+            state['ready'] = not state['building']
+    def add_batch(batch):
+        # Sends and edits only wait for one batch, not the whole build
+        with _lock:
+            for message_id, text in batch:
+                _add(message_id, text)
+        batch.clear()
+    thread = threading.Thread(target=build, daemon=True)
+    thread.start()
+    return thread
+
+def search_index_candidates(query_str):
+    '''Return the ids of the messages containing every trigram of query_str, or
+    None if the query is too short or the index is being built. The caller still
+    has to check the candidates really contain query_str.'''
+    grams = trigrams(query_str)
+    if not grams or not state['ready']:
+        return None
+    lists = []
+    for gram in grams:
+        ids = postings.get(gram)
+        if ids is None:
+            return set()
+        lists.append(ids)
+    # Intersect starting from the shortest posting list
+    lists.sort(key=len)
+    candidates = set(lists[0])
+    for ids in lists[1:]:
+        candidates &= ids
+        if not candidates:
+            break
+    return candidates
+
+def search_index_clear():
+    postings.clear()
@@ -0,0 +1,43 @@
+from search_index import trigrams, search_index_add, search_index_remove, \
+    search_index_candidates, search_index_clear, search_index_drop, postings
+
+# Test if trigrams are all the three character substrings
+def test_trigrams():
+    assert trigrams('hello') == {'hel', 'ell', 'llo'}
+    assert trigrams('ab') == set()
+
+# Test if candidates contain every message with all the trigrams of the query
+def test_search_index_candidates():
+    search_index_clear()
+    search_index_add(0, 'I am ok haha')
+    search_index_add(1, 'he is ok haha')
+    search_index_add(2, 'Old man and sea')
+    assert search_index_candidates('haha') == {0, 1}
+    assert search_index_candidates(' ok ') == {0, 1}
+    assert search_index_candidates('sea') == {2}
+    assert search_index_candidates('nothing') == set()
+    # Queries shorter than a trigram cannot be answered by the index
+    assert search_index_candidates('ok') is None
+    search_index_clear()
+
+# Test if removed messages are no longer candidates and empty postings are dropped
+def test_search_index_remove():
+    search_index_clear()
+    search_index_add(0, 'hello')
+    search_index_add(1, 'help')
+    search_index_remove(0, 'hello')
+    assert search_index_candidates('hel') == {1}
+    assert search_index_candidates('llo') == set()
+    assert 'llo' not in postings
+    search_index_clear()
+    assert postings == {}
+
+# Test if many messages are removed at once and their postings dropped or kept
+def test_search_index_drop():
+    search_index_clear()
+    for message_id in range(100):
+        search_index_add(message_id, f'hello {message_id}')
+    search_index_drop((message_id, f'hello {message_id}') for message_id in range(99))
+    assert search_index_candidates('hello') == {99}
+    assert ' 12' not in postings
+    search_index_clear()
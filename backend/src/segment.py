@@ -0,0 +1,272 @@
+'''Segment files holding the messages a TieredStore spills out of memory. A
+segment file never changes once written: removals, edits, pins and reacts of
+its messages are kept in memory beside it.'''
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from column_store import ColumnStore
+from message_store import live_slot
+from records import Message
+
+SUFFIX = '.seg'
+
+def copy_reacts(reacts):
+    return {react_id: dict(u_ids) for react_id, u_ids in reacts.items()}
+
+def write_file(path, chunks):
+    '''Write the byte chunks to a new file at path, replacing it only once it
+    is complete'''
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        for chunk in chunks:
+            file.write(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+class Columns:
+    '''The columns of count messages laid out in buffer from offset: the ids,
+    times, text starts, u_ids and pinned flags, then the utf-8 texts back to
+    back. buffer can be bytes or an mmap.'''
+
+    def __init__(self, buffer, offset, count):
+        self.buffer = buffer
+        self.count = count
+        view = memoryview(buffer)
+        def column(typecode, length):
+            nonlocal offset
+            size = struct.calcsize(typecode) * length
+            cast = view[offset:offset + size].cast(typecode)
+            offset += size
+            return cast
+        self.ids = column('q', count)
+        self.times = column('d', count)
+        self.starts = column('q', count + 1)
+        self.u_ids = column('i', count)
+        self._pinned = offset
+        self._text = offset + count
+
+    @staticmethod
+    def encode(messages):
+        '''Return the columns of messages as a list of byte chunks'''
+        columns = ColumnStore(messages).export_columns()
+        return [columns[name] for name in ('ids', 'times', 'starts', 'u_ids', 'pinned', 'text')]
+
+    def row(self, message_id):
+        '''Return the row of the message with the given id, or None'''
+        row = bisect_left(self.ids, message_id)
+        if row == self.count or self.ids[row] != message_id:
+            return None
+        return row
+
+    def fields(self, row):
+        '''Return the id, u_id, text, time and pinned flag of a row'''
+        text = self.buffer[self._text + self.starts[row]:self._text + self.starts[row + 1]]
+        return (self.ids[row], self.u_ids[row], text.decode(errors='surrogatepass'),
+                self.times[row], bool(self.buffer[self._pinned + row]))
+
+    def text_rows(self, needle):
+        '''Return the rows whose text contains the bytes needle, in order'''
+        first, last = self._text, self._text + self.starts[self.count]
+        rows = []
+        # As in ColumnStore.search, the whole text is searched at once,
+        # and an mmap is searched without copying it out of the page cache
+        found = self.buffer.find(needle, first, last)
+        while found != -1:
+            row = bisect_right(self.starts, found - first) - 1
+            end = first + self.starts[row + 1]
+            if found + len(needle) <= end:
+                rows.append(row)
+                found = self.buffer.find(needle, end, last)
+            else:
+                found = self.buffer.find(needle, found + 1, last)
+        return rows
+
+    def user_rows(self, u_id):
+        '''Return the rows sent by the user with u_id, in order'''
+        needle = array('i', [u_id]).tobytes()
+        size = len(needle)
+        first = self._pinned - size * self.count
+        rows = []
+        found = self.buffer.find(needle, first, self._pinned)
+        while found != -1:
+            # Only matches aligned to an item are a whole u_id
+            if (found - first) % size == 0:
+                rows.append((found - first) // size)
+                found = self.buffer.find(needle, found + size, self._pinned)
+            else:
+                found = self.buffer.find(needle, found + 1, self._pinned)
+        return rows
+
+    def time_rows(self, start, end):
+        '''Return the rows created from time start up to but excluding end'''
+        first = bisect_left(self.times, start)
+        return range(first, bisect_left(self.times, end, first))
+
+class Segment:
+    '''Messages spilled out of a TieredStore, oldest first, with the changes
+    made to them since. Subclasses read the file: they set count, first_id and
+    last_id, and implement _row, _fields, _text_rows, _user_rows and
+    _time_rows over rows numbered from 0 for the oldest message.'''
+
+    def __init__(self, path, overlay=None):
+        self.path = path
+        # Sorted rows of the removed messages
+        self.tombstones = []
+        # message_id -> new text, pinned flag or reacts of a changed message
+        self.edited = {}
+        self.pinned = {}
+        self.reacts = {}
+        if overlay is not None:
+            self.tombstones, self.edited, self.pinned, self.reacts = overlay
+
+    def __len__(self):
+        return self.count - len(self.tombstones)
+
+    def overlay(self):
+        '''Return a copy of the changes kept beside the file'''
+        return (list(self.tombstones), dict(self.edited), dict(self.pinned),
+                {message_id: copy_reacts(reacts) for message_id, reacts in self.reacts.items()})
+
+    def row(self, message_id):
+        '''Return the row of the message with the given id, or None'''
+        if not self.first_id <= message_id <= self.last_id:
+            return None
+        row = self._row(message_id)
+        if row is None:
+            return None
+        position = bisect_left(self.tombstones, row)
+        if position < len(self.tombstones) and self.tombstones[position] == row:
+            return None
+        return row
+
+    def message(self, row):
+        '''Return a Message record copied from the given row'''
+        return self._record(self._fields(row))
+
+    def _record(self, fields):
+        '''Return a Message record of the fields of a row, with its changes'''
+        message_id, u_id, text, time_created, is_pinned = fields
+        edited = self.edited.get(message_id)
+        pinned = self.pinned.get(message_id)
+        return Message(message_id, u_id, text if edited is None else edited, time_created,
+                       self.reacts.get(message_id), is_pinned if pinned is None else pinned)
+
+    def read(self, row, field):
+        return getattr(self.message(row), field)
+
+    def write_field(self, row, field, value):
+        message_id = self._fields(row)[0]
+        if field == 'message':
+            self.edited[message_id] = value
+        elif field == 'is_pinned':
+            self.pinned[message_id] = bool(value)
+        elif value is None:
+            self.reacts.pop(message_id, None)
+        else:
+            self.reacts[message_id] = value
+
+    def remove(self, row):
+        message_id = self._fields(row)[0]
+        insort(self.tombstones, row)
+        self.edited.pop(message_id, None)
+        self.pinned.pop(message_id, None)
+        self.reacts.pop(message_id, None)
+
+    def live_rows(self, rows=None):
+        '''Return the rows among rows, or among all rows, that are not removed'''
+        removed = set(self.tombstones)
+        return [row for row in (range(self.count) if rows is None else rows)
+                if row not in removed]
+
+    def messages(self, rows):
+        '''Return the messages of the live rows among rows'''
+        return [self.message(row) for row in self.live_rows(rows)]
+
+    def message_ids(self):
+        '''Return the ids of the live messages, oldest first'''
+        return [self._fields(row)[0] for row in self.live_rows()]
+
+    def page(self, start, end):
+        '''Return the messages from index start up to but excluding end'''
+        tombstones = self.tombstones
+        row = live_slot(tombstones, start)
+        # The next tombstone at or after row
+        position = bisect_left(tombstones, row)
+        messages = []
+        while len(messages) < end - start:
+            if position < len(tombstones) and tombstones[position] == row:
+                position += 1
+            else:
+                messages.append(self.message(row))
+            row += 1
+        return messages
+
+    def search(self, query_str):
+        '''Return the messages whose text contains query_str, oldest first'''
+        if query_str == '':
+            return self.messages(range(self.count))
+        needle = query_str.encode(errors='surrogatepass')
+        rows = {row for row in self._text_rows(needle)
+                if self._fields(row)[0] not in self.edited}
+        # Edited messages are matched against their new text instead
+        for message_id, edited in self.edited.items():
+            if query_str in edited:
+                rows.add(self._row(message_id))
+        return self.messages(sorted(rows))
+
+    def by_user(self, u_id):
+        '''Return the messages sent by the user with u_id, oldest first'''
+        return self.messages(self._user_rows(u_id))
+
+    def in_time_range(self, start, end):
+        '''Return the messages created from time start up to but excluding end'''
+        return self.messages(self._time_rows(start, end))
+
+class MappedSegment(Segment):
+    '''A segment file read through mmap, so deep pages are served straight from
+    the page cache. After the header the file holds the Columns of its
+    messages.'''
+    # magic, version, number of messages
+    HEADER = struct.Struct('<4sIQ')
+    MAGIC = b'FSEG'
+    VERSION = 1
+
+    def __init__(self, path, overlay=None):
+        super().__init__(path, overlay)
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(f'{path} is not a version {self.VERSION} segment')
+        self._columns = Columns(self._map, self.HEADER.size, self.count)
+        self.first_id = self._columns.ids[0]
+        self.last_id = self._columns.ids[-1]
+
+    @classmethod
+    def write(cls, path, messages):
+        '''Write messages to a new segment file at path'''
+        write_file(path, [cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(messages)),
+                          *Columns.encode(messages)])
+
+    def message_ids(self):
+        if not self.tombstones:
+            return self._columns.ids.tolist()
+        return super().message_ids()
+
+    def _row(self, message_id):
+        return self._columns.row(message_id)
+
+    def _fields(self, row):
+        return self._columns.fields(row)
+
+    def _text_rows(self, needle):
+        return self._columns.text_rows(needle)
+
+    def _user_rows(self, u_id):
+        return self._columns.user_rows(u_id)
+
+    def _time_rows(self, start, end):
+        return self._columns.time_rows(start, end)
@@ -4,15 +4,17 @@ from flask import Flask, request, send_from_directory
 from flask_cors import CORS
 from error import InputError
 from auth import auth_login, auth_logout, auth_register, auth_passwordreset_request, \
-    auth_passwordreset_reset
+    auth_passwordreset_reset, auth_register_bulk
 from channels import channels_list, channels_listall, channels_create
 from channel import channel_invite, channel_details, channel_messages, channel_leave, \
     channel_join, channel_addowner, channel_removeowner
 from message import message_send, message_remove, message_edit, message_pin, message_unpin, \
-    message_react, message_unreact, message_sendlater
+    message_react, message_unreact, message_sendlater, message_sendlater_cancel, \
+    message_sendlater_pending
 from user import user_profile, user_profile_setname, user_profile_setemail, user_profile_sethandle, user_profile_uploadphoto
 from other import clear, users_all, admin_userpermission_change, search, standup_active, \
     standup_send, standup_start
+from persistence import persistence_start, persistence_stop
 
 def defaultHandler(err):
     response = err.get_response()
@@ -59,6 +61,11 @@ def server_register():
     return dumps(auth_register(data['email'], data['password'], data['name_first'], \
         data['name_last']))
 
+@APP.route('/auth/register/bulk', methods=['POST'])
+def server_register_bulk():
+    data = request.get_json()
+    return dumps(auth_register_bulk(data['users']))
+
 @APP.route('/auth/passwordreset/request', methods=['POST'])
 def server_passwordreset_request():
     data = request.get_json()
@@ -214,6 +221,15 @@ def server_sendlater():
     return dumps(message_sendlater(data['token'], int(data['channel_id']), data['message'], \
         int(data['time_sent'])))
 
+@APP.route('/message/sendlater/cancel', methods=['POST'])
+def server_sendlater_cancel():
+    data = request.get_json()
+    return dumps(message_sendlater_cancel(data['token'], int(data['job_id'])))
+
+@APP.route('/message/sendlater/pending', methods=['GET'])
+def server_sendlater_pending():
+    return dumps(message_sendlater_pending(request.args.get('token')))
+
 @APP.route('/standup/start', methods=['POST'])
 def server_start_standup():
     data = request.get_json()
@@ -229,4 +245,8 @@ def server_send_standup():
     return dumps(standup_send(data['token'], int(data['channel_id']), data['message']))
 
 if __name__ == "__main__":
-    APP.run(port=0) # Do not edit this port
+    persistence_start()
+    try:
+        APP.run(port=0) # Do not edit this port
+    finally:
+        persistence_stop()
@@ -453,4 +453,22 @@ def test_server_password_reset_invalid0(url):
     r = requests.post(f"{url}/auth/passwordreset/reset", \
         json=user0_password_reset_input)
     user0_reset_output = r.json()
-    assert user0_reset_output['message'] == '<p>reset_code is not a valid reset code</p>'
\ No newline at end of file
+    assert user0_reset_output['message'] == '<p>reset_code is not a valid reset code</p>'
+
+
+def test_server_auth_register_bulk(url):
+    requests.delete(f"{url}/clear")
+
+    # Register three users at once
+    users = [{'email': f'user{number}@gmail.com', 'password': 'password',
+              'name_first': 'Bill', 'name_last': 'Gates'} for number in range(3)]
+    r = requests.post(f"{url}/auth/register/bulk", json={'users': users})
+    assert r.json() == {'u_ids': [0, 1, 2]}
+
+    # A batch with a registered email registers no one
+    r = requests.post(f"{url}/auth/register/bulk", json={'users': users[:1]})
+    assert r.status_code == 400
+
+    r = requests.post(f"{url}/auth/login", json={'email': 'user2@gmail.com',
+                                                'password': 'password'})
+    assert r.json()['u_id'] == 2
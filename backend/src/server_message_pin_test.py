@@ -2130,3 +2130,53 @@ def test_message_sendlater_invalid3(url):
     r = requests.post(f"{url}/message/sendlater", json=user0_sendlater_input)
     message_info = r.json()
     assert message_info['message'] == '<p>User is not in channel</p>'
+
+def test_message_sendlater_cancel(url):
+    "User 1 lists and cancels a message sent later"
+    # Register user 1
+    user1_data_input = {
+        'email': "billgates@outlook.com",
+        'password':  "VukkFs",
+        'name_first': "Bill",
+        'name_last': "Gates"
+    }
+    r = requests.post(f"{url}/auth/register", json=user1_data_input)
+    user1_data_output = r.json()
+    # User 1 create a channel
+    channel1_data_input = {
+        'token': user1_data_output['token'],
+        'name': "channel1",
+        'is_public': True,
+    }
+    r = requests.post(f"{url}/channels/create", json=channel1_data_input)
+    channel1_data_output = r.json()
+    # User 1 send a message a minute later
+    timestamp = int(time.time()) + 60
+    user1_sendlater_input = {
+        'token': user1_data_output['token'],
+        'channel_id': channel1_data_output['channel_id'],
+        'message': "Hi",
+        'time_sent': timestamp,
+    }
+    r = requests.post(f"{url}/message/sendlater", json=user1_sendlater_input)
+    job_id = r.json()['job_id']
+    r = requests.get(f"{url}/message/sendlater/pending",
+                     params={'token': user1_data_output['token']})
+    assert r.json() == {'messages': [{
+        'job_id': job_id,
+        'channel_id': channel1_data_output['channel_id'],
+        'message': "Hi",
+        'time_sent': timestamp,
+    }]}
+    # User 1 cancel the message
+    user1_cancel_input = {
+        'token': user1_data_output['token'],
+        'job_id': job_id,
+    }
+    r = requests.post(f"{url}/message/sendlater/cancel", json=user1_cancel_input)
+    assert r.json() == {}
+    r = requests.post(f"{url}/message/sendlater/cancel", json=user1_cancel_input)
+    assert r.status_code == 400
+    r = requests.get(f"{url}/message/sendlater/pending",
+                     params={'token': user1_data_output['token']})
+    assert r.json() == {'messages': []}
@@ -0,0 +1,243 @@
+'''Snapshots of the whole database in one file, so the server keeps its data
+across restarts. Users and channels are saved as tuples. With the memory
+storage engine the messages of each channel are saved as the byte columns of
+a ColumnStore, which load straight into arrays without building an object
+per message. Messages spilled to segment files are saved as the names of the
+files and the changes kept beside them. Engines that keep messages on disk
+themselves save none.
+
+The file holds each channel's messages as a pickled blob of its own, then a
+header with the users, the channels and where their blobs are. Loading reads
+only the header: each channel's blob is read the first time its messages are
+used, so the server starts in time that does not grow with the messages.
+
+A snapshot holds off changes only while it copies the users and channels and
+freezes each message store. The messages are written out from the frozen
+views afterwards, while changes carry on copy-on-write.'''
+import os
+import pickle
+import struct
+import threading
+import traceback
+from time import perf_counter, sleep
+from records import User, Channel
+from lazy_store import LazyStore
+from wal import wal_is_open, wal_rotate, wal_compact
+from database import data, index, storage, data_reset, data_add_channel, data_add_owner, \
+    data_add_member, data_barrier
+
+'''Snapshots written with a different version are refused by snapshot_load'''
+VERSION = 3
+# Every snapshot file starts with MAGIC and ends with the offset of its header
+MAGIC = b'FLOCKR3\n'
+TRAILER = struct.Struct('<Q')
+
+'''Measurements of the snapshots taken since the server started'''
+metrics = {
+    'snapshots': 0,
+    'last_seconds': 0.0,
+    'last_paused': 0.0,
+    'last_bytes': 0,
+    'total_seconds': 0.0,
+    'total_bytes': 0,
+}
+# Only one snapshot is written at a time
+_saving = threading.Lock()
+
+def snapshot_freeze():
+    '''Return the database as plain values, except that each channel's messages
+    are a (store, view) pair from freezing its store, after their number and
+    the range of their ids. Takes time in proportion to the users and
+    memberships, but not to the messages.'''
+    users = [tuple(getattr(user, field) for field in User.__slots__)
+             for user in list(data['users'])]
+    channels = []
+    for channel in list(data['channels']):
+        channels.append((
+            channel.channel_id,
+            channel.name,
+            channel.visibility,
+            [owner.u_id for owner in channel.owners],
+            [member.u_id for member in channel.members],
+            len(channel.messages),
+            channel.messages.id_range(),
+            (channel.messages, channel.messages.freeze()),
+        ))
+    return {
+        'version': VERSION,
+        'num_message': data['message_ids'].peek(),
+        'num_channel': data['channel_ids'].peek(),
+        'num_job': data['job_ids'].peek(),
+        'users': users,
+        'channels': channels,
+        'scheduled': dict(data['scheduled']),
+    }
+
+def _blob(store, view):
+    '''Return the pickled message columns of a frozen store'''
+    if isinstance(store, LazyStore):
+        if view is None:
+            # Not loaded since the snapshot it came from, which holds it as is
+            return store.blob()
+        store = store.load()
+    return pickle.dumps(storage.frozen_columns(store, view), protocol=pickle.HIGHEST_PROTOCOL)
+
+def _frozen_blobs(state):
+    '''Yield each channel of a state from snapshot_freeze with the blob of its
+    messages in place of its frozen store, thawing each store once it is done'''
+    for *fields, (store, view) in state['channels']:
+        try:
+            blob = _blob(store, view)
+        finally:
+            store.thaw()
+        yield fields, blob
+
+def snapshot_export(state):
+    '''Replace the frozen stores in a state from snapshot_freeze with their
+    message columns'''
+    state['channels'] = [(*fields, pickle.loads(blob))
+                         for fields, blob in _frozen_blobs(state)]
+    return state
+
+def snapshot_state():
+    '''Return the database as plain values that can be pickled'''
+    with data_barrier():
+        state = snapshot_freeze()
+    return snapshot_export(state)
+
+def snapshot_save(path):
+    '''Write a snapshot of the database to path, replacing the old one only
+    once the new one is complete. Returns the seconds taken, the seconds
+    changes were held off for and the bytes written.
+
+    The snapshot holds exactly the write-ahead log records before the segment
+    it starts. Once it is written those older segments are deleted.'''
+    with _saving:
+        return _save(path)
+
+def _save(path):
+    start = perf_counter()
+    with data_barrier():
+        segment = wal_rotate() if wal_is_open() else None
+        state = snapshot_freeze()
+    paused = perf_counter() - start
+    state['wal_segment'] = segment
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as file:
+        _write(file, state)
+        size = file.tell()
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+    if segment is not None:
+        wal_compact(segment)
+    seconds = perf_counter() - start
+    metrics['snapshots'] += 1
+    metrics['last_seconds'] = seconds
+    metrics['last_paused'] = paused
+    metrics['last_bytes'] = size
+    metrics['total_seconds'] += seconds
+    metrics['total_bytes'] += size
+    return {
+        'seconds': seconds,
+        'paused': paused,
+        'bytes': size,
+    }
+
+def _write(file, state):
+    '''Write a state from snapshot_freeze to file, one channel's messages at a
+    time, then the header'''
+    file.write(MAGIC)
+    channels = []
+    for fields, blob in _frozen_blobs(state):
+        channels.append((*fields, (file.tell(), len(blob))))
+        file.write(blob)
+    offset = file.tell()
+    pickle.dump(dict(state, channels=channels), file, protocol=pickle.HIGHEST_PROTOCOL)
+    file.write(TRAILER.pack(offset))
+
+def snapshot_restore(state, file=None):
+    '''Replace the database with the state returned by snapshot_state. Given
+    the file of a snapshot, state is its header instead, and each channel's
+    messages are read from the file the first time they are used.'''
+    if state.get('version') != VERSION:
+        raise ValueError(f"Snapshot version {state.get('version')} is not {VERSION}")
+    data_reset()
+    for fields in state['users']:
+        user = User.__new__(User)
+        for field, value in zip(User.__slots__, fields):
+            setattr(user, field, value)
+        data['users'].append(user)
+        index['u_id'][user.u_id] = user
+        index['email'][user.email] = user
+        index['handle'][user.handle] = user
+        if user.token is not None:
+            index['token'][user.token] = user
+    for channel_id, name, visibility, owners, members, count, id_range, columns \
+            in state['channels']:
+        channel = Channel(channel_id, name, visibility, None)
+        if file is None:
+            channel.messages = storage.restore_store(channel_id, columns)
+        else:
+            offset, length = columns
+            # pread leaves the file position alone, so channels load at once
+            blob = lambda offset=offset, length=length: \
+                os.pread(file.fileno(), length, offset)
+            load_columns = lambda blob=blob: pickle.loads(blob())
+            channel.messages = storage.lazy_store(channel, load_columns, blob, count,
+                                                  id_range)
+        data_add_channel(channel)
+        for u_id in owners:
+            data_add_owner(u_id, channel_id)
+        for u_id in members:
+            data_add_member(u_id, channel_id)
+    data['message_ids'].reset(state['num_message'])
+    data['channel_ids'].reset(state['num_channel'])
+    # Snapshots from before messages sent later were kept have none
+    data['scheduled'].update(state.get('scheduled', {}))
+    data['job_ids'].reset(state.get('num_job', 0))
+    storage.restored(list(data['channels']))
+    return sum(count for *_, count, _, _ in state['channels'])
+
+def snapshot_load(path):
+    '''Replace the database with the snapshot at path, leaving each channel's
+    messages to be loaded when first used. Returns None if there is no
+    snapshot, otherwise the seconds taken, the number of records it holds and
+    the first write-ahead log segment the snapshot does not hold.'''
+    if not os.path.exists(path):
+        return None
+    start = perf_counter()
+    # Stays open for the channels still to load, even once a new snapshot
+    # replaces the file
+    file = open(path, 'rb')
+    if file.read(len(MAGIC)) != MAGIC:
+        file.close()
+        raise ValueError(f'{path} is not a version {VERSION} snapshot')
+    file.seek(-TRAILER.size, os.SEEK_END)
+    offset, = TRAILER.unpack(file.read(TRAILER.size))
+    file.seek(offset)
+    state = pickle.load(file)
+    messages = snapshot_restore(state, file)
+    return {
+        'seconds': perf_counter() - start,
+        'users': len(state['users']),
+        'channels': len(state['channels']),
+        'messages': messages,
+        'wal_segment': state['wal_segment'],
+    }
+
+def snapshot_start(path, interval):
+    '''Snapshot the database to path every interval seconds from a daemon
+    checkpointer thread'''
+    def run():
+        while True:
+            sleep(interval)
+            try:
+                snapshot_save(path)
+            except Exception:
+                # The next checkpoint may still succeed, so one that fails
+                # must not stop the thread
+                traceback.print_exc()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,177 @@
+from auth import auth_register
+from channels import channels_create, channels_list
+from channel import channel_join, channel_messages, channel_details
+from message import message_send, message_edit, message_remove, message_pin, message_react, \
+    message_sendlater
+from other import clear, search, users_all
+from search_index import state
+from snapshot import snapshot_save, snapshot_load, snapshot_freeze, snapshot_export, \
+    snapshot_restore, metrics
+from database import data, data_barrier, storage
+import threading
+import time
+import pytest
+import tiered_store
+from lazy_store import LazyStore
+
+# Engines that keep messages themselves do not save them in snapshots
+memory_only = pytest.mark.skipif(storage.name != 'memory',
+                                 reason='messages are kept by the storage engine')
+
+def wait_for_search_index():
+    for thread in threading.enumerate():
+        # The scheduler thread runs for as long as the process
+        if thread is not threading.current_thread() and thread.daemon \
+                and thread.name != 'scheduler':
+            thread.join(timeout=5)
+    assert state['ready']
+
+# Test if a saved snapshot loads back into the same users, channels and messages
+@memory_only
+def test_snapshot_round_trip(tmp_path):
+    clear()
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    user1 = auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    channels_create(user1['token'], "channel1", False)
+    channel_join(user1['token'], channel0)
+    for text in ('hello', 'héllo there', 'bye'):
+        message_send(user0['token'], channel0, text)
+    message_edit(user0['token'], 1, 'hello there')
+    message_remove(user0['token'], 2)
+    message_pin(user0['token'], 0)
+    message_react(user1['token'], 0, 1)
+    message_sendlater(user0['token'], channel0, 'later', time.time() + 60)
+    scheduled = dict(data['scheduled'])
+    users = users_all(user0['token'])
+    messages = channel_messages(user1['token'], channel0, 0)
+    details = channel_details(user0['token'], channel0)
+    path = str(tmp_path / 'flockr.snapshot')
+    saved = snapshot_save(path)
+    assert saved['bytes'] > 0 and metrics['last_bytes'] == saved['bytes']
+    clear()
+    loaded = snapshot_load(path)
+    assert loaded['users'] == 2 and loaded['channels'] == 2 and loaded['messages'] == 2
+    wait_for_search_index()
+    # Tokens survive, so logged in users stay logged in
+    assert users_all(user0['token']) == users
+    assert channel_messages(user1['token'], channel0, 0) == messages
+    assert channel_details(user0['token'], channel0) == details
+    assert data['scheduled'] == scheduled
+    assert channels_list(user1['token']) == {'channels': [
+        {'channel_id': 0, 'name': 'channel0'},
+        {'channel_id': 1, 'name': 'channel1'},
+    ]}
+    assert [item['message_id'] for item in search(user1['token'], 'hello')['messages']] == [0, 1]
+    # New ids carry on from the snapshot
+    assert message_send(user0['token'], channel0, 'again') == {'message_id': 3}
+    assert channels_create(user0['token'], "channel2", True) == {'channel_id': 2}
+    clear()
+
+# Test if there is nothing to load without a snapshot
+def test_snapshot_missing(tmp_path):
+    assert snapshot_load(str(tmp_path / 'missing')) is None
+
+# Test if a snapshot holds the database as it was when it was frozen, even
+# though changes carry on while it is written out
+@memory_only
+def test_snapshot_point_in_time(tmp_path):
+    clear()
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    message_send(user0['token'], channel0, 'hello')
+    messages = channel_messages(user0['token'], channel0, 0)
+    with data_barrier():
+        state = snapshot_freeze()
+    message_edit(user0['token'], 0, 'changed')
+    message_pin(user0['token'], 0)
+    message_send(user0['token'], channel0, 'later')
+    state = snapshot_export(state)
+    changed = channel_messages(user0['token'], channel0, 0)
+    snapshot_restore(state)
+    wait_for_search_index()
+    assert channel_messages(user0['token'], channel0, 0) == messages
+    assert [item['message'] for item in changed['messages']] == ['changed', 'later']
+    clear()
+
+# Test if a snapshot refers to the segment files of spilled messages and loads
+# them back with the changes made to their messages
+@memory_only
+def test_snapshot_tiered(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'cold_directory', str(tmp_path / 'cold'))
+    monkeypatch.setattr(tiered_store, 'HOT_MESSAGES', 2)
+    monkeypatch.setattr(tiered_store, 'SEGMENT_MESSAGES', 2)
+    clear()
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    for text in ('hello', 'there', 'hello again', 'bye', 'later'):
+        message_send(user0['token'], channel0, text)
+    message_edit(user0['token'], 1, 'hello there')
+    message_remove(user0['token'], 2)
+    message_react(user0['token'], 0, 1)
+    messages = channel_messages(user0['token'], channel0, 0)
+    path = str(tmp_path / 'flockr.snapshot')
+    snapshot_save(path)
+    message_edit(user0['token'], 0, 'changed')
+    # Loading at startup keeps the segment files, unlike clear()
+    loaded = snapshot_load(path)
+    assert loaded['messages'] == 4
+    wait_for_search_index()
+    assert channel_messages(user0['token'], channel0, 0) == messages
+    assert [item['message_id'] for item in search(user0['token'], 'hello')['messages']] == [0, 1]
+    message_edit(user0['token'], 0, 'changed')
+    assert [item['message_id'] for item in search(user0['token'], 'hello')['messages']] == [1]
+    clear()
+
+def loaded_channels():
+    # A channel's LazyStore puts the store it loads in its place
+    return [not isinstance(channel.messages, LazyStore) for channel in data['channels']]
+
+# Test if channels load their messages from the snapshot only once they are
+# first used, and a snapshot taken before then copies them as they are
+@memory_only
+def test_snapshot_lazy(tmp_path):
+    clear()
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    for name in ('channel0', 'channel1', 'channel2'):
+        channel_id = channels_create(user0['token'], name, True)['channel_id']
+        message_send(user0['token'], channel_id, f'hello {name}')
+        message_send(user0['token'], channel_id, f'bye {name}')
+    messages = [channel_messages(user0['token'], channel_id, 0) for channel_id in range(3)]
+    path = str(tmp_path / 'flockr.snapshot')
+    snapshot_save(path)
+    assert snapshot_load(path)['messages'] == 6
+    assert loaded_channels() == [False, False, False]
+    assert [len(channel.messages) for channel in data['channels']] == [2, 2, 2]
+    assert channel_messages(user0['token'], 1, 0) == messages[1]
+    assert loaded_channels() == [False, True, False]
+    # A message is found in the channel whose ids hold it
+    message_edit(user0['token'], 5, 'changed')
+    assert loaded_channels() == [False, True, True]
+    # Saved again with channel0 still as it was in the first snapshot
+    snapshot_save(path)
+    snapshot_load(path)
+    assert loaded_channels() == [False, False, False]
+    assert [item['message_id'] for item in search(user0['token'], 'channel')['messages']] \
+        == [0, 1, 2, 3, 4]
+    assert loaded_channels() == [True, True, True]
+    assert channel_messages(user0['token'], 0, 0) == messages[0]
+    assert channel_messages(user0['token'], 2, 0)['messages'][1]['message'] == 'changed'
+    snapshot_load(path)
+    assert message_send(user0['token'], 0, 'again') == {'message_id': 6}
+    assert loaded_channels() == [True, False, False]
+    clear()
+
+# Test if a message with a lone surrogate is saved and loaded back
+@memory_only
+def test_snapshot_surrogate(tmp_path):
+    clear()
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    message_send(user0['token'], channel0, 'hi \ud800')
+    path = str(tmp_path / 'flockr.snapshot')
+    snapshot_save(path)
+    clear()
+    snapshot_load(path)
+    assert channel_messages(user0['token'], channel0, 0)['messages'][0]['message'] == 'hi \ud800'
+    clear()
@@ -0,0 +1,353 @@
+'''Storage engine keeping the messages in a SQLite database file, so they do not
+have to fit in memory and are not lost between restarts. Users, channels and
+memberships stay in memory and are kept by the snapshot and write-ahead log.
+
+The file runs in WAL journal mode, so readers are not blocked by a writer.
+Messages are found by channel through an index on (channel_id, message_id)
+and searched through an FTS5 trigram index over their text. Every statement
+is written once below with ? parameters, and sqlite3 keeps its compiled form
+in the connection's statement cache.'''
+import marshal
+import sqlite3
+import threading
+from records import Record, Message
+from storage import Storage
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_created REAL NOT NULL,
+    reacts BLOB,
+    is_pinned INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel_id, message_id);
+CREATE INDEX IF NOT EXISTS messages_user ON messages (channel_id, u_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    message, content='messages', content_rowid='message_id',
+    tokenize='trigram case_sensitive 1'
+);
+CREATE TRIGGER IF NOT EXISTS messages_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, message) VALUES (new.message_id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, message)
+        VALUES ('delete', old.message_id, old.message);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_edit AFTER UPDATE OF message ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, message)
+        VALUES ('delete', old.message_id, old.message);
+    INSERT INTO messages_fts (rowid, message) VALUES (new.message_id, new.message);
+END;
+'''
+
+COLUMNS = 'message_id, u_id, message, time_created, reacts, is_pinned'
+JOINED_COLUMNS = ', '.join('m.' + column for column in COLUMNS.split(', '))
+# Messages read per query while iterating over a channel
+CHUNK = 1000
+# Queries shorter than a trigram cannot use the full text index
+TRIGRAM = 3
+
+def _pack_reacts(reacts):
+    if not reacts:
+        return None
+    return marshal.dumps([(react_id, list(u_ids)) for react_id, u_ids in reacts.items()])
+
+def _unpack_reacts(blob):
+    if blob is None:
+        return None
+    return {react_id: dict.fromkeys(u_ids) for react_id, u_ids in marshal.loads(blob)}
+
+# A message replayed from the write-ahead log may already be stored
+INSERT = (f'INSERT OR IGNORE INTO messages (channel_id, {COLUMNS}) '
+          'VALUES (?, ?, ?, ?, ?, ?, ?)')
+
+def _row(channel_id, message):
+    return (channel_id, message.message_id, message.u_id, message.message,
+            message.time_created, _pack_reacts(message.reacts), int(message.is_pinned))
+
+def _message(row):
+    message_id, u_id, text, time_created, reacts, is_pinned = row
+    return Message(message_id, u_id, text, time_created, _unpack_reacts(reacts),
+                   bool(is_pinned))
+
+def _phrase(query_str):
+    '''Quote query_str as an FTS5 phrase, so it is matched as plain text'''
+    return '"' + query_str.replace('"', '""') + '"'
+
+class SQLiteMessage(Record):
+    '''A message in a SQLiteStore. Its fields are read from and written to its
+    row, so changes made through it are kept by the database.'''
+    __slots__ = ('_store', 'message_id')
+
+    def __init__(self, store, message_id):
+        self._store = store
+        self.message_id = message_id
+
+    def __repr__(self):
+        return f'SQLiteMessage(message_id={self.message_id!r})'
+
+    @property
+    def u_id(self):
+        return self._store._read(self.message_id, 'u_id')
+
+    @property
+    def time_created(self):
+        return self._store._read(self.message_id, 'time_created')
+
+    @property
+    def message(self):
+        return self._store._read(self.message_id, 'message')
+
+    @message.setter
+    def message(self, value):
+        self._store._write(self.message_id, 'message', value)
+
+    @property
+    def reacts(self):
+        return _unpack_reacts(self._store._read(self.message_id, 'reacts'))
+
+    @reacts.setter
+    def reacts(self, value):
+        self._store._write(self.message_id, 'reacts', _pack_reacts(value))
+
+    @property
+    def is_pinned(self):
+        return bool(self._store._read(self.message_id, 'is_pinned'))
+
+    @is_pinned.setter
+    def is_pinned(self, value):
+        self._store._write(self.message_id, 'is_pinned', int(value))
+
+class SQLiteStore:
+    '''The messages of a channel in a SQLiteStorage, oldest first, with the same
+    interface as MessageStore. get() returns a SQLiteMessage that writes
+    through to the row, every other read returns Message records.'''
+
+    def __init__(self, storage, channel_id):
+        self._storage = storage
+        self.channel_id = channel_id
+
+    def _query(self, sql, *args):
+        return self._storage._query(sql, (self.channel_id, *args))
+
+    def __len__(self):
+        return self._storage._counts.get(self.channel_id, 0)
+
+    def __iter__(self):
+        # Read in chunks after the last id seen, so changes made meanwhile
+        # do not shift the messages still to come
+        last = -1
+        while True:
+            rows = self._query(f'SELECT {COLUMNS} FROM messages WHERE channel_id = ? '
+                               'AND message_id > ? ORDER BY message_id LIMIT ?',
+                               last, CHUNK)
+            for row in rows:
+                yield _message(row)
+            if len(rows) < CHUNK:
+                return
+            last = rows[-1][0]
+
+    def id_range(self):
+        '''Messages are found through the database, not by range'''
+        return None
+
+    def message_ids(self):
+        '''Return the ids of the messages, oldest first'''
+        return [row[0] for row in self._query(
+            'SELECT message_id FROM messages WHERE channel_id = ? ORDER BY message_id')]
+
+    def append(self, message):
+        self._storage._insert(self.channel_id, message)
+
+    def get(self, message_id):
+        '''Return the message with the given id, or None'''
+        if not self._query('SELECT 1 FROM messages WHERE channel_id = ? AND message_id = ?',
+                           message_id):
+            return None
+        return SQLiteMessage(self, message_id)
+
+    def writable(self, message_id):
+        '''Return the message with the given id to be changed in place, or None'''
+        return self.get(message_id)
+
+    def _read(self, message_id, field):
+        rows = self._storage._query(f'SELECT {field} FROM messages WHERE message_id = ?',
+                                    (message_id,))
+        if not rows:
+            raise KeyError(message_id)
+        return rows[0][0]
+
+    def _write(self, message_id, field, value):
+        self._storage._execute(f'UPDATE messages SET {field} = ? WHERE message_id = ?',
+                               (value, message_id))
+
+    def remove(self, message_id):
+        '''Delete the message with the given id, returns whether it was there'''
+        return self._storage._delete(self.channel_id, message_id)
+
+    def page(self, start, end=-1, newest_first=False):
+        '''Return the messages from index start up to but excluding end (-1 for
+        the last message), counted from the oldest or the newest message'''
+        total = len(self)
+        if end == -1 or end > total:
+            end = total
+        if end - start <= 0:
+            return []
+        if start > total - end:
+            # Count from the nearer end, and read the page the other way round
+            start, end, newest_first = total - end, total - start, not newest_first
+            return self._page(start, end - start, newest_first)[::-1]
+        return self._page(start, end - start, newest_first)
+
+    def _page(self, offset, count, newest_first):
+        # The offset is skipped over the (channel_id, message_id) index alone,
+        # only the rows of the page are read from the table
+        order, compare = ('DESC', '<=') if newest_first else ('ASC', '>=')
+        return [_message(row) for row in self._query(
+            f'SELECT {COLUMNS} FROM messages WHERE channel_id = ?1 AND message_id {compare} '
+            f'(SELECT message_id FROM messages WHERE channel_id = ?1 '
+            f'ORDER BY message_id {order} LIMIT 1 OFFSET ?2) '
+            f'ORDER BY message_id {order} LIMIT ?3', offset, count)]
+
+    def search(self, query_str):
+        '''Return the messages whose text contains query_str, oldest first'''
+        return self._storage.search(query_str, [self])
+
+    def by_user(self, u_id):
+        '''Return the messages sent by the user with u_id, oldest first'''
+        return [_message(row) for row in self._query(
+            f'SELECT {COLUMNS} FROM messages WHERE channel_id = ? AND u_id = ? '
+            'ORDER BY message_id', u_id)]
+
+    def in_time_range(self, start, end):
+        '''Return the messages created from time start up to but excluding end'''
+        return [_message(row) for row in self._query(
+            f'SELECT {COLUMNS} FROM messages WHERE channel_id = ? '
+            'AND time_created >= ? AND time_created < ? ORDER BY message_id', start, end)]
+
+    def compact(self):
+        '''Deleted rows are reclaimed by SQLite itself'''
+
+    def freeze(self):
+        '''The messages are kept by the database file, not by snapshots'''
+        return None
+
+    def thaw(self):
+        pass
+
+class SQLiteStorage(Storage):
+    '''Keeps messages in a SQLite database at path, ':memory:' for one that only
+    lasts as long as the server. One connection is shared by every thread and
+    used by one at a time.'''
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, isolation_level=None,
+                                           check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode = WAL')
+            self._connection.execute('PRAGMA synchronous = NORMAL')
+            self._connection.executescript(SCHEMA)
+        # channel_id -> number of messages, so len() of a store is not a query
+        self._counts = dict(self._query(
+            'SELECT channel_id, COUNT(*) FROM messages GROUP BY channel_id'))
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._connection.execute(sql, args).fetchall()
+
+    def _execute(self, sql, args=()):
+        with self._lock:
+            return self._connection.execute(sql, args).rowcount
+
+    def _insert(self, channel_id, message):
+        with self._lock:
+            if self._execute(INSERT, _row(channel_id, message)):
+                self._counts[channel_id] = self._counts.get(channel_id, 0) + 1
+
+    def _insert_many(self, channel_id, messages):
+        rows = [_row(channel_id, message) for message in messages]
+        with self._lock:
+            # One transaction, so the rows share one commit
+            self._connection.execute('BEGIN')
+            try:
+                added = self._connection.executemany(INSERT, rows).rowcount
+                self._connection.execute('COMMIT')
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._counts[channel_id] = self._counts.get(channel_id, 0) + added
+
+    def _delete(self, channel_id, message_id):
+        with self._lock:
+            if not self._execute('DELETE FROM messages WHERE message_id = ? '
+                                 'AND channel_id = ?', (message_id, channel_id)):
+                return False
+            self._counts[channel_id] -= 1
+            return True
+
+    def new_store(self, channel_id):
+        return SQLiteStore(self, channel_id)
+
+    def restore_store(self, channel_id, columns):
+        return SQLiteStore(self, channel_id)
+
+    def frozen_columns(self, store, view):
+        return None
+
+    def message_channel_id(self, message_id):
+        # SQLite would compare a string such as '3' as the integer 3, but only
+        # integers refer to messages
+        if not isinstance(message_id, int):
+            return None
+        try:
+            rows = self._query('SELECT channel_id FROM messages WHERE message_id = ?',
+                               (message_id,))
+        except OverflowError:
+            return None
+        return rows[0][0] if rows else None
+
+    def add(self, channel, message):
+        self._insert(channel.channel_id, message)
+
+    def add_many(self, channel, messages):
+        self._insert_many(channel.channel_id, messages)
+
+    def remove(self, channel, message_id):
+        self._delete(channel.channel_id, message_id)
+
+    def edit(self, channel, message_id, text):
+        channel.messages.writable(message_id).message = text
+
+    def search(self, query_str, channels):
+        channel_ids = [channel.channel_id for channel in channels]
+        if not channel_ids:
+            return []
+        marks = ', '.join('?' * len(channel_ids))
+        if len(query_str) >= TRIGRAM:
+            # The trigram index finds the candidates, instr checks each one
+            # holds query_str as it is
+            rows = self._query(
+                f'SELECT {JOINED_COLUMNS} '
+                'FROM messages_fts JOIN messages m ON m.message_id = messages_fts.rowid '
+                f'WHERE messages_fts MATCH ? AND m.channel_id IN ({marks}) '
+                'AND instr(m.message, ?) ORDER BY m.channel_id, m.message_id',
+                (_phrase(query_str), *channel_ids, query_str))
+        else:
+            rows = self._query(
+                f'SELECT {COLUMNS} FROM messages WHERE channel_id IN ({marks}) '
+                'AND instr(message, ?) ORDER BY channel_id, message_id',
+                (*channel_ids, query_str))
+        return [_message(row) for row in rows]
+
+    def clear(self):
+        with self._lock:
+            self._execute('DELETE FROM messages')
+            self._counts.clear()
+
+    def reset(self):
+        '''The messages stay in the database file for the restored channels'''
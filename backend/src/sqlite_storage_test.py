@@ -0,0 +1,66 @@
+from sqlite_storage import SQLiteStorage
+from records import Channel, Message
+
+def make_channel(storage, channel_id, count):
+    channel = Channel(channel_id, f'channel{channel_id}', True, storage.new_store(channel_id))
+    for number in range(count):
+        message_id = channel_id * 100 + number
+        storage.add(channel, Message(message_id, number % 2, f'message {number}', number))
+    return channel
+
+def ids(messages):
+    return [message.message_id for message in messages]
+
+# Test if a channel's store pages, finds and removes messages like a MessageStore
+def test_sqlite_store():
+    storage = SQLiteStorage(':memory:')
+    channel = make_channel(storage, 0, 5)
+    store = channel.messages
+    assert len(store) == 5
+    assert ids(store.page(1, 3)) == [1, 2]
+    assert ids(store.page(0, -1, True)) == [4, 3, 2, 1, 0]
+    assert store.get(2).message == 'message 2'
+    assert store.get(7) is None
+    assert ids(store.by_user(1)) == [1, 3]
+    assert ids(store.in_time_range(1, 3)) == [1, 2]
+    assert store.remove(2)
+    assert not store.remove(2)
+    assert len(store) == 4 and ids(store) == [0, 1, 3, 4]
+    assert storage.message_channel_id(3) == 0
+    assert storage.message_channel_id(2) is None
+    assert storage.message_channel_id('3') is None
+
+# Test if changes made through a message are written to its row
+def test_sqlite_write_through():
+    storage = SQLiteStorage(':memory:')
+    channel = make_channel(storage, 0, 2)
+    message = channel.messages.writable(1)
+    message.is_pinned = True
+    message.reacts = {1: {0: None, 1: None}}
+    storage.edit(channel, 1, 'edited')
+    stored = channel.messages.page(1)[0]
+    assert (stored.message, stored.is_pinned, stored.reacts) == \
+        ('edited', True, {1: {0: None, 1: None}})
+    assert ids(storage.search('edited', [channel])) == [1]
+    assert storage.search('message 1', [channel]) == []
+
+# Test if search only finds exact text in the given channels, ordered by channel
+def test_sqlite_search():
+    storage = SQLiteStorage(':memory:')
+    channel0 = make_channel(storage, 0, 3)
+    channel1 = make_channel(storage, 1, 3)
+    make_channel(storage, 2, 3)
+    assert ids(storage.search('message 1', [channel0, channel1])) == [1, 101]
+    assert ids(storage.search('Message', [channel0])) == []
+    assert ids(storage.search('1', [channel1])) == [101]
+    assert ids(storage.search('', [channel0])) == [0, 1, 2]
+    assert ids(storage.search('"', [channel0])) == []
+
+# Test if the messages stay in the database file after it is closed
+def test_sqlite_reopen(tmp_path):
+    path = str(tmp_path / 'messages.db')
+    make_channel(SQLiteStorage(path), 0, 3)
+    storage = SQLiteStorage(path)
+    store = storage.restore_store(0, None)
+    assert len(store) == 3 and ids(store) == [0, 1, 2]
+    assert ids(storage.search('message 2', [Channel(0, 'channel0', True, store)])) == [2]
@@ -0,0 +1,276 @@
+'''Storage engines for the messages of the database. Users, channels and
+memberships always live in database.py. An engine owns the message store of
+every channel, the lookup from a message_id to its channel, and search.
+config.STORAGE picks the engine the database uses.'''
+import os
+from message_store import MessageStore
+from column_store import ColumnStore
+from tiered_store import TieredStore
+from lazy_store import LazyStore
+from segment import SUFFIX
+from archive import archive_cache_clear
+from search_index import search_index_add, search_index_remove, search_index_candidates, \
+    search_index_clear, search_index_build, search_index_drop, BUILD_BATCH
+
+'''Channels move their messages to column storage once they hold this many'''
+COLUMN_STORE_THRESHOLD = 100000
+
+class Storage:
+    '''The interface every storage engine implements. A channel's store has the
+    interface of MessageStore.'''
+    name = None
+
+    def new_store(self, channel_id):
+        '''Return an empty message store for a new channel'''
+        raise NotImplementedError
+
+    def restore_store(self, channel_id, columns):
+        '''Return the message store of a channel loaded from a snapshot, columns
+        being what frozen_columns returned when the snapshot was taken'''
+        raise NotImplementedError
+
+    def lazy_store(self, channel, load_columns, blob, count, id_range):
+        '''Return the message store of a channel loaded from a snapshot, which
+        may wait to call load_columns until its messages are first used. blob
+        returns the bytes the snapshot holds for them, count and id_range are
+        their number and the range of their ids. By default the store is
+        restored at once.'''
+        return self.restore_store(channel.channel_id, load_columns())
+
+    def frozen_columns(self, store, view):
+        '''Return what a snapshot keeps of a store frozen with the given view'''
+        raise NotImplementedError
+
+    def restored(self, channels):
+        '''Called once the channels of a snapshot are restored'''
+
+    def message_channel_id(self, message_id):
+        '''Return the id of the channel holding the message, or None'''
+        raise NotImplementedError
+
+    def add(self, channel, message):
+        '''Store a new message in the channel'''
+        raise NotImplementedError
+
+    def add_many(self, channel, messages):
+        '''Store new messages in the channel, oldest first'''
+        for message in messages:
+            self.add(channel, message)
+
+    def remove(self, channel, message_id):
+        '''Remove a message from the channel'''
+        raise NotImplementedError
+
+    def edit(self, channel, message_id, text):
+        '''Change the text of a message in the channel'''
+        raise NotImplementedError
+
+    def search(self, query_str, channels):
+        '''Return the messages of the channels containing query_str, ordered by
+        channel_id and then message_id'''
+        raise NotImplementedError
+
+    def clear(self):
+        '''Remove every message'''
+        raise NotImplementedError
+
+    def reset(self):
+        '''Forget the messages held in memory, before the channels are restored'''
+        raise NotImplementedError
+
+class MemoryStorage(Storage):
+    '''Keeps messages in memory, in a MessageStore per channel that becomes a
+    ColumnStore once it is large. Messages are found through a message_id ->
+    channel_id dict and searched through the trigram index.
+
+    With a cold_directory every channel is a TieredStore instead, which
+    spills its older messages to segment files there, compressed in blocks
+    with compression ('zlib' or 'lzma') if it is set. Only the messages
+    still in memory are in the dict and the trigram index, spilled ones are
+    found by asking the tiered stores and searched in their segments.
+
+    Channels loaded from a snapshot hold a LazyStore until their messages are
+    first used, and only then join the dict and the trigram index. Until then
+    a message_id is looked for in the channels whose range of ids holds it.'''
+    name = 'memory'
+
+    def __init__(self, cold_directory=None, compression=None):
+        self.locations = {}
+        self.cold_directory = cold_directory
+        self.compression = compression
+        # channel_id -> TieredStore
+        self.tiered = {}
+        # channel_id -> LazyStore not loaded yet
+        self.lazy = {}
+
+    def new_store(self, channel_id):
+        if self.cold_directory is None:
+            return MessageStore()
+        store = self.tiered[channel_id] = TieredStore(self.cold_directory, channel_id,
+                                                     compression=self.compression)
+        return store
+
+    def restore_store(self, channel_id, columns):
+        if 'tiers' in columns:
+            store = self.tiered[channel_id] = TieredStore.from_columns(channel_id, columns,
+                                                                       self.compression)
+            return store
+        return ColumnStore.from_columns(columns)
+
+    def lazy_store(self, channel, load_columns, blob, count, id_range):
+        channel_id = channel.channel_id
+        store = self.lazy[channel_id] = LazyStore(
+            channel, lambda: self.restore_store(channel_id, load_columns()),
+            self._loaded, blob, count, id_range)
+        return store
+
+    def _loaded(self, channel):
+        self.lazy.pop(channel.channel_id, None)
+        self.restored([channel])
+
+    def frozen_columns(self, store, view):
+        if isinstance(store, MessageStore):
+            return ColumnStore(MessageStore.frozen_messages(view)).export_columns()
+        return store.export_frozen(view)
+
+    @staticmethod
+    def _in_memory(store):
+        '''Return the part of a channel's store that is kept in memory'''
+        return store.hot if isinstance(store, TieredStore) else store
+
+    def restored(self, channels):
+        stores = [(channel.channel_id, self._in_memory(channel.messages))
+                  for channel in channels if not isinstance(channel.messages, LazyStore)]
+        for channel_id, store in stores:
+            self.locations.update(dict.fromkeys(store.message_ids(), channel_id))
+        # Searches scan the channels until the trigram index is rebuilt
+        search_index_build((message.message_id, message.message)
+                           for _, store in stores for message in store)
+
+    def message_channel_id(self, message_id):
+        try:
+            channel_id = self.locations.get(message_id)
+            if channel_id is None:
+                for store in self.tiered.values():
+                    if store.holds_spilled(message_id):
+                        return store.channel_id
+                for store in list(self.lazy.values()):
+                    id_range = store.id_range()
+                    if id_range is not None and id_range[0] <= message_id <= id_range[1]:
+                        store.load()
+                        # Loaded stores leave self.lazy, so this ends
+                        return self.message_channel_id(message_id)
+            return channel_id
+        except TypeError:
+            # An unhashable message_id can never refer to a message
+            return None
+
+    def add(self, channel, message):
+        channel.messages.append(message)
+        self.locations[message.message_id] = channel.channel_id
+        search_index_add(message.message_id, message.message)
+        if isinstance(channel.messages, TieredStore):
+            spilled = channel.messages.spill()
+            for message in spilled:
+                del self.locations[message.message_id]
+            search_index_drop((message.message_id, message.message) for message in spilled)
+        elif len(channel.messages) == COLUMN_STORE_THRESHOLD \
+                and isinstance(channel.messages, MessageStore):
+            channel.messages = ColumnStore(channel.messages)
+
+    def add_many(self, channel, messages):
+        '''Indexes the messages for search in the background, as when a
+        snapshot is loaded, instead of one at a time'''
+        channel_id = channel.channel_id
+        for message in messages:
+            channel.messages.append(message)
+            self.locations[message.message_id] = channel_id
+        if isinstance(channel.messages, TieredStore):
+            spilled = []
+            while True:
+                segment = channel.messages.spill()
+                if not segment:
+                    break
+                spilled.extend(segment)
+            for message in spilled:
+                del self.locations[message.message_id]
+            search_index_drop((message.message_id, message.message) for message in spilled)
+        elif len(channel.messages) >= COLUMN_STORE_THRESHOLD \
+                and isinstance(channel.messages, MessageStore):
+            channel.messages = ColumnStore(channel.messages)
+        pairs = [(message.message_id, message.message) for message in messages
+                 if message.message_id in self.locations]
+        if len(pairs) < BUILD_BATCH:
+            # Too few to be worth a thread, such as scheduled messages sent
+            # together
+            for message_id, text in pairs:
+                search_index_add(message_id, text)
+        else:
+            search_index_build(pairs)
+
+    def remove(self, channel, message_id):
+        if self.locations.pop(message_id, None) is not None:
+            message = channel.messages.get(message_id)
+            search_index_remove(message_id, message.message)
+        channel.messages.remove(message_id)
+
+    def edit(self, channel, message_id, text):
+        item = channel.messages.writable(message_id)
+        if message_id in self.locations:
+            search_index_remove(message_id, item.message)
+            search_index_add(message_id, text)
+        item.message = text
+
+    def search(self, query_str, channels):
+        for channel in channels:
+            if isinstance(channel.messages, LazyStore):
+                channel.messages.load()
+        candidates = search_index_candidates(query_str)
+        if candidates is None or len(candidates) > sum(len(channel.messages)
+                                                       for channel in channels):
+            # Checking every message of the channels is cheaper than the candidates
+            found = []
+            for channel in channels:
+                found.extend(channel.messages.search(query_str))
+            return found
+        by_id = {channel.channel_id: channel for channel in channels}
+        matches = []
+        for message_id in candidates:
+            channel = by_id.get(self.locations.get(message_id))
+            # add message to list if the user is a member of that channel
+            if channel is None:
+                continue
+            message = channel.messages.get(message_id)
+            if message is not None and query_str in message.message:
+                matches.append((channel.channel_id, message_id, message))
+        # Spilled messages are not in the trigram index
+        for channel in channels:
+            if isinstance(channel.messages, TieredStore):
+                matches.extend((channel.channel_id, message.message_id, message)
+                               for message in channel.messages.search_spilled(query_str))
+        matches.sort(key=lambda match: match[:2])
+        return [message for _, _, message in matches]
+
+    def clear(self):
+        self.reset()
+        if self.cold_directory is not None and os.path.isdir(self.cold_directory):
+            for name in os.listdir(self.cold_directory):
+                if name.endswith(SUFFIX):
+                    os.remove(os.path.join(self.cold_directory, name))
+
+    def reset(self):
+        '''The segment files stay for the restored channels'''
+        self.locations.clear()
+        self.tiered.clear()
+        self.lazy.clear()
+        search_index_clear()
+        archive_cache_clear()
+
+def storage_open(name, sqlite_path=None, cold_directory=None, cold_compression=None):
+    '''Return a storage engine by name, 'memory' or 'sqlite' '''
+    if name == 'memory':
+        return MemoryStorage(cold_directory, cold_compression)
+    if name == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(sqlite_path)
+    raise ValueError(f'Unknown storage engine {name!r}')
@@ -0,0 +1,264 @@
+'''Tiered storage for the messages of one channel. The newest messages, which
+most reads are for, stay in memory. Older messages are spilled in segments to
+files, read through mmap or compressed in blocks, so the memory the process
+holds stays bounded however long the history grows.'''
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from column_store import ColumnStore, ColumnMessage
+from message_store import MessageStore
+from segment import MappedSegment, SUFFIX, copy_reacts
+from archive import ArchiveSegment
+
+'''Messages a channel keeps in memory before spilling its oldest ones'''
+HOT_MESSAGES = 10000
+'''Messages written to each segment file'''
+SEGMENT_MESSAGES = 50000
+
+def open_segment(path, overlay=None):
+    '''Return the segment in the file at path, mapped or archived'''
+    with open(path, 'rb') as file:
+        magic = file.read(4)
+    kind = ArchiveSegment if magic == ArchiveSegment.MAGIC else MappedSegment
+    return kind(path, overlay)
+
+class TieredStore:
+    '''The messages of a channel, oldest first, with the same interface as
+    MessageStore. The newest messages are kept in a MessageStore. Once it
+    holds HOT_MESSAGES + SEGMENT_MESSAGES, spill() writes its oldest
+    SEGMENT_MESSAGES to a segment file in directory: a MappedSegment, or an
+    ArchiveSegment compressed with compression ('zlib' or 'lzma').
+
+    Every message in a segment is older than every message in memory, so
+    a message is found by comparing its id with the last spilled one.
+    get() returns a ColumnMessage for a spilled message, writing through
+    to its segment's changes.
+
+    freeze() starts a point-in-time view for a checkpoint. Segments are
+    never rewritten, so the view copies only the changes kept beside them
+    and freezes the messages in memory. Nothing is spilled until thaw().'''
+
+    def __init__(self, directory, channel_id, messages=(), compression=None):
+        self.directory = directory
+        self.channel_id = channel_id
+        self.compression = compression
+        self.hot = MessageStore(messages)
+        self._segments = []
+        # Id of the first message in each segment
+        self._firsts = []
+        self._lock = threading.Lock()
+        self._frozen = False
+
+    def __len__(self):
+        return sum(len(segment) for segment in self._segments) + len(self.hot)
+
+    def __iter__(self):
+        with self._lock:
+            segments, hot = list(self._segments), self.hot
+        for segment in segments:
+            for row in segment.live_rows():
+                yield segment.message(row)
+        yield from hot
+
+    def id_range(self):
+        '''Return the first and last message ids the store has held, or None'''
+        with self._lock:
+            hot = self.hot.id_range()
+            if not self._segments:
+                return hot
+            return self._segments[0].first_id, hot[1] if hot else self._segments[-1].last_id
+
+    def message_ids(self):
+        '''Return the ids of the messages, oldest first'''
+        with self._lock:
+            ids = array('q')
+            for segment in self._segments:
+                ids.extend(segment.message_ids())
+            ids.extend(self.hot.message_ids())
+            return ids
+
+    def append(self, message):
+        with self._lock:
+            self.hot.append(message)
+
+    def spill(self):
+        '''Write the oldest messages in memory to a new segment once there are
+        enough of them. Returns the messages spilled.'''
+        with self._lock:
+            if self._frozen or len(self.hot) < HOT_MESSAGES + SEGMENT_MESSAGES:
+                return []
+            spilled = self.hot.page(0, SEGMENT_MESSAGES)
+            name = f'{self.channel_id}-{spilled[0].message_id}{SUFFIX}'
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            if self.compression is None:
+                MappedSegment.write(path, spilled)
+            else:
+                ArchiveSegment.write(path, spilled, self.compression)
+            segment = open_segment(path)
+            segment.reacts = {message.message_id: copy_reacts(message.reacts)
+                              for message in spilled if message.reacts}
+            self._segments.append(segment)
+            self._firsts.append(spilled[0].message_id)
+            self.hot = MessageStore(self.hot.page(SEGMENT_MESSAGES))
+            return spilled
+
+    def _find(self, message_id):
+        '''Return the segment and row of a spilled message, or None, None'''
+        if not self._segments or message_id > self._segments[-1].last_id:
+            return None, None
+        position = bisect_right(self._firsts, message_id) - 1
+        if position < 0:
+            return None, None
+        segment = self._segments[position]
+        return segment, segment.row(message_id)
+
+    def holds_spilled(self, message_id):
+        '''Return whether a spilled message with the given id is in the store'''
+        with self._lock:
+            return self._find(message_id)[1] is not None
+
+    def _is_spilled(self, message_id):
+        return bool(self._segments) and message_id <= self._segments[-1].last_id
+
+    def get(self, message_id):
+        '''Return the message with the given id, or None'''
+        with self._lock:
+            if not self._is_spilled(message_id):
+                return self.hot.get(message_id)
+            segment, row = self._find(message_id)
+            if row is None:
+                return None
+            return segment.message(row)
+
+    def writable(self, message_id):
+        '''Return the message with the given id to be changed in place, or None'''
+        with self._lock:
+            if not self._is_spilled(message_id):
+                return self.hot.writable(message_id)
+            if self._find(message_id)[1] is None:
+                return None
+        # A frozen view holds its own copy of the changes beside each segment,
+        # so spilled messages can be changed in place
+        return ColumnMessage(self, message_id)
+
+    def _read(self, message_id, field):
+        with self._lock:
+            segment, row = self._find(message_id)
+            if row is None:
+                raise KeyError(message_id)
+            return segment.read(row, field)
+
+    def _write(self, message_id, field, value):
+        with self._lock:
+            segment, row = self._find(message_id)
+            if row is None:
+                raise KeyError(message_id)
+            segment.write_field(row, field, value)
+
+    def remove(self, message_id):
+        '''Remove the message with the given id, returns whether it was there'''
+        with self._lock:
+            if not self._is_spilled(message_id):
+                return self.hot.remove(message_id)
+            segment, row = self._find(message_id)
+            if row is None:
+                return False
+            segment.remove(row)
+            return True
+
+    def page(self, start, end=-1, newest_first=False):
+        '''Return the messages from index start up to but excluding end (-1 for
+        the last message), counted from the oldest or the newest message'''
+        with self._lock:
+            total = len(self)
+            if end == -1 or end > total:
+                end = total
+            if end - start <= 0:
+                return []
+            if newest_first:
+                start, end = total - end, total - start
+            messages = []
+            for tier in self._segments + [self.hot]:
+                length = len(tier)
+                if start < length and end > 0:
+                    messages.extend(tier.page(max(start, 0), min(end, length)))
+                start -= length
+                end -= length
+            if newest_first:
+                messages.reverse()
+            return messages
+
+    def _search_spilled(self, query_str):
+        found = []
+        for segment in self._segments:
+            found.extend(segment.search(query_str))
+        return found
+
+    def search_spilled(self, query_str):
+        '''Return the spilled messages whose text contains query_str, oldest first'''
+        with self._lock:
+            return self._search_spilled(query_str)
+
+    def search(self, query_str):
+        '''Return the messages whose text contains query_str, oldest first'''
+        with self._lock:
+            return self._search_spilled(query_str) + self.hot.search(query_str)
+
+    def by_user(self, u_id):
+        '''Return the messages sent by the user with u_id, oldest first'''
+        with self._lock:
+            found = []
+            for segment in self._segments:
+                found.extend(segment.by_user(u_id))
+            return found + self.hot.by_user(u_id)
+
+    def in_time_range(self, start, end):
+        '''Return the messages created from time start up to but excluding end'''
+        with self._lock:
+            found = []
+            for segment in self._segments:
+                found.extend(segment.in_time_range(start, end))
+            return found + self.hot.in_time_range(start, end)
+
+    def compact(self):
+        '''Rebuild the messages in memory without their tombstones'''
+        self.hot.compact()
+
+    def freeze(self):
+        '''Start a point-in-time view of the store, returned for export_frozen'''
+        with self._lock:
+            self._frozen = True
+            tiers = [(os.path.basename(segment.path), segment.overlay())
+                     for segment in self._segments]
+            return self.directory, tiers, self.hot.freeze()
+
+    def thaw(self):
+        '''End the view started by freeze'''
+        with self._lock:
+            self._frozen = False
+            self.hot.thaw()
+
+    @staticmethod
+    def export_frozen(view):
+        '''Return a view returned by freeze as plain values. Spilled messages are
+        referred to by their segment file, which must be kept.'''
+        directory, tiers, hot = view
+        return {
+            'directory': directory,
+            'tiers': tiers,
+            'hot': ColumnStore(MessageStore.frozen_messages(hot)).export_columns(),
+        }
+
+    @classmethod
+    def from_columns(cls, channel_id, columns, compression=None):
+        '''Return a store holding the messages exported by export_frozen, that
+        spills with compression from then on'''
+        store = cls(columns['directory'], channel_id, ColumnStore.from_columns(columns['hot']),
+                    compression)
+        for name, overlay in columns['tiers']:
+            segment = open_segment(os.path.join(store.directory, name), overlay)
+            store._segments.append(segment)
+            store._firsts.append(segment.first_id)
+        return store
@@ -0,0 +1,85 @@
+import os
+import pytest
+import archive
+import tiered_store
+from tiered_store import TieredStore
+from message_store import MessageStore
+from records import Message
+
+@pytest.fixture
+def small_tiers(monkeypatch):
+    monkeypatch.setattr(tiered_store, 'HOT_MESSAGES', 4)
+    monkeypatch.setattr(tiered_store, 'SEGMENT_MESSAGES', 4)
+    monkeypatch.setattr(archive, 'BLOCK_MESSAGES', 3)
+
+# Every test runs with mapped segments and with both kinds of archive
+@pytest.fixture(params=[None, 'zlib', 'lzma'])
+def compression(request):
+    return request.param
+
+def make_stores(directory, count, compression):
+    '''Return a TieredStore and a MessageStore holding the same messages'''
+    tiered, plain = TieredStore(str(directory), 0, compression=compression), MessageStore()
+    for number in range(count):
+        message = Message(number * 2, number % 3, f'message {number}', number)
+        tiered.append(message)
+        tiered.spill()
+        plain.append(message.copy())
+    return tiered, plain
+
+def ids(messages):
+    return [message.message_id for message in messages]
+
+# Test if older messages are spilled to segment files in whole segments
+def test_tiered_spill(tmp_path, small_tiers, compression):
+    tiered, _ = make_stores(tmp_path, 19, compression)
+    assert sorted(os.listdir(tmp_path)) == ['0-0.seg', '0-16.seg', '0-8.seg']
+    assert len(tiered.hot) == 7 and len(tiered) == 19
+    assert ids(tiered) == list(range(0, 38, 2))
+    assert list(tiered.message_ids()) == list(range(0, 38, 2))
+
+# Test if pages span segments and memory like pages of a MessageStore
+def test_tiered_page(tmp_path, small_tiers, compression):
+    tiered, plain = make_stores(tmp_path, 19, compression)
+    for message_id in (2, 14, 16, 30):
+        tiered.remove(message_id)
+        plain.remove(message_id)
+    assert not tiered.remove(2)
+    for start in range(17):
+        for end in (-1, start + 1, start + 5, 20):
+            for newest_first in (False, True):
+                assert ids(tiered.page(start, end, newest_first)) == \
+                    ids(plain.page(start, end, newest_first))
+
+# Test if spilled messages are found, changed and searched
+def test_tiered_spilled_messages(tmp_path, small_tiers, compression):
+    tiered, _ = make_stores(tmp_path, 19, compression)
+    assert tiered.get(3) is None and tiered.get(40) is None
+    message = tiered.writable(6)
+    assert (message.message, message.u_id, message.time_created) == ('message 3', 0, 3)
+    message.message = 'edited'
+    message.is_pinned = True
+    message.reacts = {1: {2: None}}
+    assert tiered.page(3, 4)[0].message == 'edited'
+    assert (tiered.get(6).is_pinned, tiered.get(6).reacts) == (True, {1: {2: None}})
+    assert ids(tiered.search('message 1')) == [2, 20, 22, 24, 26, 28, 30, 32, 34, 36]
+    assert ids(tiered.search('edited')) == [6] and ids(tiered.search_spilled('age 9')) == [18]
+    assert ids(tiered.by_user(1)) == [2, 8, 14, 20, 26, 32]
+    assert ids(tiered.in_time_range(6, 9)) == [12, 14, 16]
+    assert tiered.holds_spilled(6) and not tiered.holds_spilled(36)
+
+# Test if a frozen store exports as it was and restores from its segments
+def test_tiered_freeze(tmp_path, small_tiers, compression):
+    tiered, _ = make_stores(tmp_path, 19, compression)
+    view = tiered.freeze()
+    tiered.writable(4).message = 'changed'
+    tiered.remove(8)
+    for number in range(19, 30):
+        tiered.append(Message(number * 2, 0, f'message {number}', number))
+        assert tiered.spill() == []
+    columns = TieredStore.export_frozen(view)
+    tiered.thaw()
+    assert len(tiered.spill()) == 4
+    restored = TieredStore.from_columns(0, columns, compression)
+    assert ids(restored) == list(range(0, 38, 2))
+    assert restored.get(4).message == 'message 2'
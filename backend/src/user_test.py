@@ -1,4 +1,5 @@
 import pytest
+import threading
 from database import *
 from utility import *
 from user import *
@@ -84,6 +85,19 @@ def test_user_profile_setemail_success():
     assert data['users'][0]['email'] == 'abcdefg@gmail.com'
 
 
+def test_user_profile_setemail_frees_old_email():
+    clear()
+    user = auth_register('validemail@gmail.com', '123abc!@#', 
+    'Hayden', 'Everest')
+    user_profile_setemail(user['token'], 'abcdefg@gmail.com')
+    auth_logout(user['token'])
+    assert auth_login('abcdefg@gmail.com', '123abc!@#') == user
+    with pytest.raises(InputError):
+        auth_login('validemail@gmail.com', '123abc!@#')
+    # The old email can be registered again by someone else
+    auth_register('validemail@gmail.com', '124abc!@#', 'Dennis', 'Lin')
+
+
 def test_user_profile_sethandle_too_long():
     clear()
     user = auth_register('validemail@gmail.com', '123abc!@#', 
@@ -122,6 +136,19 @@ def test_user_profile_sethandle_success():
     assert user['handle'] == 'abcdefg'
 
 
+def test_user_profile_sethandle_frees_old_handle():
+    clear()
+    auth_register('validemail@gmail.com', '123abc!@#', 
+    'Hayden', 'Everest')
+    user = auth_register('validemail2@gmail.com', '123abc!@#', 
+    'Dennis', 'Lin')
+    user_profile_sethandle(data['users'][0]['token'], 'abcdefg')
+    user_profile_sethandle(user['token'], 'haydeneverest')
+    assert data_handle_search('haydeneverest') == data['users'][1]
+    with pytest.raises(InputError):
+        user_profile_sethandle(data['users'][0]['token'], 'haydeneverest')
+
+
 def test_user_profile_uploadphoto_success():
     clear()
     user = auth_register('validemail@gmail.com', '123abc!@#', 
@@ -210,3 +237,24 @@ def test_user_profile_uploadphoto_y_start_negative():
     with pytest.raises(InputError):
         user_profile_uploadphoto(user['token'], 'https://img1.looper.com/img/gallery/things-only-adults-notice-in-shrek/intro-1573597941.jpg', 0, -1, 500, 500)
 
+
+# Test if only one of two users setting the same handle at the same time gets it
+def test_user_profile_sethandle_concurrent():
+    clear()
+    users = [auth_register(f'validemail{number}@gmail.com', '123abc!@#', 'Hayden', 'Everest')
+             for number in range(2)]
+    barrier = threading.Barrier(2)
+    errors = []
+    def set_handle(user):
+        barrier.wait()
+        try:
+            user_profile_sethandle(user['token'], 'samehandle')
+        except InputError:
+            errors.append(user['u_id'])
+    threads = [threading.Thread(target=set_handle, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 1
+    assert [user.handle for user in data['users']].count('samehandle') == 1
@@ -7,6 +7,7 @@ import hashlib
 import urllib.request
 import datetime
 from database import *
+from clock import clock_time
 from error import InputError
 from error import AccessError
 from email.mime.multipart import MIMEMultipart
@@ -86,9 +87,8 @@ def check_member_not_exist(u_id, channel_id):
     return
 
 def check_handle_exist(handle_str):
-    for user in data['users']:
-        if user['handle'] == handle_str:
-            raise InputError('Handle is already used by another user')
+    if is_handle_taken(handle_str):
+        raise InputError('Handle is already used by another user')
     return
 
 def check_public_channel(channel_id):
@@ -97,12 +97,12 @@ def check_public_channel(channel_id):
     return
 
 def check_valid_message_start(start, channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            if start > len(channel['messages']):
-                raise InputError("Start is greater than the total number of messages in the channel")
-            return
-    raise InputError("Channel is invalid")
+    channel = data_get_channel(channel_id)
+    if channel is None:
+        raise InputError("Channel is invalid")
+    if start > len(channel.messages):
+        raise InputError("Start is greater than the total number of messages in the channel")
+    return
 
 def token_generate(u_id):
     '''Return the generated token'''
@@ -123,16 +123,16 @@ def check_handle_length(handle_str):
     return
 
 def valid_channel(channel_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            return channel
-    raise InputError("Channel_id is invalid")
+    channel = data_get_channel(channel_id)
+    if channel is None:
+        raise InputError("Channel_id is invalid")
+    return channel
 
 def valid_member(channel, token):
-    for member in channel['members']:
-        if token == member['token']:
-            return member
-    raise AccessError('Invalid token')
+    member = is_token_exist(token)
+    if not member or member.u_id not in channel.member_ids:
+        raise AccessError('Invalid token')
+    return member
 
 def check_valid_message_length(message):
     if len(message) > 1000:
@@ -148,14 +148,13 @@ def check_valid_message_length(message):
     '''
 
 def check_authorised_member_message(u_id, channel_id, message_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for owner in channel['owners']:
-                if u_id == owner['u_id']:
-                    return
-            for message in channel['messages']:
-                if u_id == message['u_id'] and message_id == message['message_id']:
-                    return
+    channel = data_get_channel(channel_id)
+    if channel is not None:
+        if u_id in channel.owner_ids:
+            return
+        message = data_find_message(message_id, channel_id)
+        if message is not None and u_id == message.u_id:
+            return
     raise AccessError('User is not the authorised user making this request nor an owner of this channel or the flockr')
 
 def email_check(email):
@@ -182,6 +181,24 @@ def register_check(email, password, name_first, name_last):
         # If the length of name_last is out of range (1 to 50)
         raise InputError("name_last is not between 1 and 50 characters inclusively in length")
 
+def register_bulk_check(users):
+    '''Check each user of a bulk register, a dict with the arguments of
+    register_check, and that no two of them share an email. If one is not
+    valid, raise an error naming its position.'''
+    emails = set()
+    for position, user in enumerate(users):
+        try:
+            try:
+                email = user['email']
+                register_check(email, user['password'], user['name_first'], user['name_last'])
+            except (KeyError, TypeError):
+                raise InputError("Users need an email, password, name_first and name_last")
+            if email in emails:
+                raise InputError(f"Email address {email} is given for more than one user")
+        except InputError as error:
+            raise InputError(f"User {position}: {error.description}") from None
+        emails.add(email)
+
 def login_check(email, password):
     '''Check whether the email and password are valid. If yes,
     return a dict of u_id and token. If not, raise error'''
@@ -192,22 +209,18 @@ def login_check(email, password):
         raise InputError(f"Error, email address {email} has not been registered yet")
 
     password = password_encode(password)
-    if correct_user['password'] != password:
+    if correct_user.password != password:
         raise InputError("Password is not correct")
 
-    return correct_user['u_id']
+    return correct_user.u_id
 
 def password_encode(password):
     ''' Return the encoded password'''
     return hashlib.sha256(password.encode()).hexdigest()
 
 def check_authorised_member_channel(channel_id, u_id):
-    for channel in data['channels']:
-        if channel['channel_id'] == channel_id:
-            for member in channel['members']:
-                if u_id == member['u_id']:
-                    return
-    raise AccessError("User is not in channel")
+    if not is_member_exist(u_id, channel_id):
+        raise AccessError("User is not in channel")
 
 def check_message_pinned(message_id, channel_id):
     if data_message_pinned(message_id, channel_id) == True:
@@ -244,12 +257,10 @@ def check_img_dimension(imageObject, x_start, y_start, x_end, y_end):
     if x_start < 0 or y_start < 0 or x_start > width or y_start > height or x_end < 0 or y_end < 0 or x_end > width or y_end > height:
         raise InputError('Dimension is out of range!')
 def check_time_diff(time_sent):
-    now = datetime.now() - timedelta(microseconds=datetime.now().microsecond)
-    time_input = datetime.fromtimestamp(time_sent)
-    if now > time_input:
+    # In whole seconds, so a time_sent of the current second is not past
+    now = int(clock_time())
+    if now > time_sent:
         raise InputError("Time sent is a time in the past")
-    time_diff = time_input - now
-    return time_diff
 
 def check_reset_code(reset_code):
     u_id = data_reset_code_check(reset_code)
@@ -0,0 +1,189 @@
+'''Append-only write-ahead log of the changes made to the database. Each record
+is an operation name and its arguments, written to numbered segment files in
+one directory. A background thread writes and syncs the records in groups,
+so a burst of changes shares one write and one fsync.
+
+fsync policies:
+    'always'    wal_wait blocks until the record is synced to disk
+    'interval'  records are synced at most every interval seconds
+    'never'     records are handed to the OS and never explicitly synced'''
+import marshal
+import os
+import struct
+import threading
+import zlib
+from time import sleep
+
+POLICIES = ('always', 'interval', 'never')
+# Every record starts with the length and the crc32 of its payload
+HEADER = struct.Struct('<II')
+SUFFIX = '.wal'
+
+'''The open log, file is None while no log is open'''
+_log = {
+    'file': None,
+    'directory': None,
+    'segment': 0,
+    'policy': 'interval',
+    'interval': 0.01,
+    'buffer': bytearray(),
+    # Number of records appended and number written out
+    'appended': 0,
+    'flushed': 0,
+    'closing': False,
+    # Whether the flush thread is writing a group outside the condition
+    'writing': False,
+    'thread': None,
+}
+_cond = threading.Condition()
+
+def wal_segments(directory):
+    '''Return the sorted segment numbers in directory'''
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name[:-len(SUFFIX)]) for name in os.listdir(directory)
+                  if name.endswith(SUFFIX) and name[:-len(SUFFIX)].isdigit())
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f'{segment:010d}{SUFFIX}')
+
+def wal_records(path):
+    '''Yield the (op, args) records of a segment file. A torn record at the end
+    of the file, left by a crash mid write, is cut off.'''
+    with open(path, 'r+b') as file:
+        contents = file.read()
+        offset = 0
+        while offset + HEADER.size <= len(contents):
+            length, checksum = HEADER.unpack_from(contents, offset)
+            payload = contents[offset + HEADER.size:offset + HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            yield marshal.loads(payload)
+            offset += HEADER.size + length
+        if offset < len(contents):
+            file.truncate(offset)
+
+def wal_replay(directory, first_segment, apply):
+    '''Call apply(op, args) for every record in the segments numbered from
+    first_segment on, in order. Returns the number of records replayed.'''
+    count = 0
+    for segment in wal_segments(directory):
+        if segment >= first_segment:
+            for op, args in wal_records(segment_path(directory, segment)):
+                apply(op, args)
+                count += 1
+    return count
+
+def wal_drop(directory, before_segment):
+    '''Delete the segments numbered before before_segment, once a snapshot
+    holds their changes'''
+    for segment in wal_segments(directory):
+        if segment < before_segment:
+            os.remove(segment_path(directory, segment))
+
+def wal_compact(before_segment):
+    '''Delete the open log's segments before before_segment'''
+    wal_drop(_log['directory'], before_segment)
+
+def wal_open(directory, policy='interval', interval=0.01):
+    '''Start logging to a new segment after the existing ones in directory'''
+    if policy not in POLICIES:
+        raise ValueError(f'Unknown fsync policy {policy!r}')
+    os.makedirs(directory, exist_ok=True)
+    segments = wal_segments(directory)
+    segment = segments[-1] + 1 if segments else 1
+    with _cond:
+        _log.update({
+            'file': open(segment_path(directory, segment), 'ab'),
+            'directory': directory,
+            'segment': segment,
+            'policy': policy,
+            'interval': interval,
+            'buffer': bytearray(),
+            'appended': 0,
+            'flushed': 0,
+            'closing': False,
+        })
+    _log['thread'] = threading.Thread(target=_flush_loop, daemon=True)
+    _log['thread'].start()
+
+def wal_is_open():
+    return _log['file'] is not None
+
+def wal_write(op, *args):
+    '''Append a record to the log. Returns its sequence number to pass to
+    wal_wait, or None when no log is open.'''
+    if _log['file'] is None:
+        return None
+    payload = marshal.dumps((op, args))
+    with _cond:
+        _log['buffer'] += HEADER.pack(len(payload), zlib.crc32(payload))
+        _log['buffer'] += payload
+        _log['appended'] += 1
+        sequence = _log['appended']
+        _cond.notify_all()
+    return sequence
+
+def wal_wait(sequence):
+    '''Under the 'always' policy, block until the record with the given sequence
+    number is synced to disk'''
+    if sequence is None or _log['policy'] != 'always':
+        return
+    with _cond:
+        while _log['flushed'] < sequence and _log['file'] is not None:
+            _cond.wait()
+
+def _write_out(file, buffer):
+    file.write(buffer)
+    file.flush()
+    if _log['policy'] != 'never':
+        os.fsync(file.fileno())
+
+def _flush_loop():
+    while True:
+        with _cond:
+            while not _log['buffer'] and not _log['closing']:
+                _cond.wait()
+            if not _log['buffer']:
+                return
+            buffer, _log['buffer'] = _log['buffer'], bytearray()
+            sequence = _log['appended']
+            _log['writing'] = True
+        # Records appended while this group is written form the next group
+        try:
+            _write_out(_log['file'], buffer)
+        finally:
+            with _cond:
+                _log['writing'] = False
+                _log['flushed'] = max(_log['flushed'], sequence)
+                _cond.notify_all()
+        if _log['policy'] == 'interval':
+            sleep(_log['interval'])
+
+def wal_rotate():
+    '''Write out the buffered records and start a new segment. Returns the new
+    segment's number, the records before it are all in older segments.'''
+    with _cond:
+        while _log['writing']:
+            _cond.wait()
+        buffer, _log['buffer'] = _log['buffer'], bytearray()
+        _write_out(_log['file'], buffer)
+        _log['file'].close()
+        _log['flushed'] = _log['appended']
+        _log['segment'] += 1
+        _log['file'] = open(segment_path(_log['directory'], _log['segment']), 'ab')
+        _cond.notify_all()
+        return _log['segment']
+
+def wal_close():
+    '''Write out the buffered records and stop logging'''
+    if _log['file'] is None:
+        return
+    with _cond:
+        _log['closing'] = True
+        _cond.notify_all()
+    _log['thread'].join()
+    with _cond:
+        _log['file'].close()
+        _log['file'] = None
+        _cond.notify_all()
@@ -0,0 +1,202 @@
+import os
+import sys
+import threading
+import time
+import pytest
+from auth import auth_register, auth_logout
+from channels import channels_create
+from channel import channel_join, channel_messages, channel_addowner, channel_details
+from message import message_send, message_edit, message_remove, message_pin, message_react, \
+    message_sendlater, message_sendlater_cancel, message_sendlater_pending
+from user import user_profile_setname, user_profile_sethandle
+from other import clear, users_all
+from database import data, data_replay, data_schedule_start, storage
+from snapshot import snapshot_save, snapshot_load
+from wal import wal_open, wal_close, wal_write, wal_wait, wal_rotate, wal_replay, \
+    wal_records, wal_segments, segment_path
+
+def replayed(directory, first_segment=0):
+    records = []
+    wal_replay(directory, first_segment, lambda op, args: records.append((op, args)))
+    return records
+
+# Test if records come back in order from the segments they were written to
+def test_wal_write_replay(tmp_path):
+    directory = str(tmp_path)
+    wal_open(directory, 'always')
+    wal_wait(wal_write('first', 1, 'a'))
+    assert wal_rotate() == 2
+    wal_write('second', None, 2.5)
+    wal_close()
+    assert wal_segments(directory) == [1, 2]
+    assert replayed(directory) == [('first', (1, 'a')), ('second', (None, 2.5))]
+    assert replayed(directory, 2) == [('second', (None, 2.5))]
+    # Reopening starts a new segment after the old ones
+    wal_open(directory, 'never')
+    wal_write('third')
+    wal_close()
+    assert wal_segments(directory) == [1, 2, 3]
+
+# Test if a record torn by a crash is dropped along with anything after it
+def test_wal_torn_record(tmp_path):
+    directory = str(tmp_path)
+    wal_open(directory, 'interval', 0)
+    wal_write('kept', 1)
+    wal_write('torn', 2)
+    wal_close()
+    path = segment_path(directory, 1)
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as file:
+        file.truncate(size - 1)
+    assert list(wal_records(path)) == [('kept', (1,))]
+    assert os.path.getsize(path) < size - 1
+
+# Test if an unknown fsync policy is refused
+def test_wal_policy(tmp_path):
+    with pytest.raises(ValueError):
+        wal_open(str(tmp_path), 'sometimes')
+
+def make_changes():
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    user1 = auth_register("billgates@outlook.com", "VukkFs", "Bill", "Gates")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    channel_join(user1['token'], channel0)
+    channel_addowner(user0['token'], channel0, 1)
+    for text in ('hello', 'there', 'bye'):
+        message_send(user1['token'], channel0, text)
+    message_edit(user0['token'], 1, 'edited')
+    message_remove(user0['token'], 2)
+    message_pin(user0['token'], 0)
+    message_react(user1['token'], 0, 1)
+    user_profile_setname(user1['token'], 'William', 'Gates')
+    user_profile_sethandle(user1['token'], 'billy')
+    return user0, user1, channel0
+
+def database_view(user0, channel0):
+    return (users_all(user0['token']), channel_messages(user0['token'], channel0, 0),
+            channel_details(user0['token'], channel0))
+
+# Test if replaying the log rebuilds the database it recorded
+def test_wal_recovery(tmp_path):
+    directory = str(tmp_path / 'wal')
+    clear()
+    wal_open(directory, 'always')
+    user0, user1, channel0 = make_changes()
+    expected = database_view(user0, channel0)
+    wal_close()
+    clear()
+    wal_replay(directory, 0, data_replay)
+    assert database_view(user0, channel0) == expected
+    assert message_send(user0['token'], channel0, 'next') == {'message_id': 3}
+    clear()
+
+# Test if messages sent to a channel from many threads at once are logged in
+# the order they are stored, so a replay stores them the same way
+def test_wal_recovery_concurrent(tmp_path):
+    directory = str(tmp_path / 'wal')
+    clear()
+    wal_open(directory, 'never')
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    def send(number):
+        for count in range(100):
+            message_send(user0['token'], channel0, f'{number} {count}')
+    threads = [threading.Thread(target=send, args=(number,)) for number in range(16)]
+    # Switch threads often, so sends interleave between storing and logging
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    pages = [channel_messages(user0['token'], channel0, start)
+             for start in range(0, 1600, 50)]
+    wal_close()
+    clear()
+    wal_replay(directory, 0, data_replay)
+    assert [channel_messages(user0['token'], channel0, start)
+            for start in range(0, 1600, 50)] == pages
+    # Every message can still be found by its id
+    message_edit(user0['token'], 0, 'edited')
+    clear()
+
+# Test if a snapshot folds in the log and recovery replays only what came after
+@pytest.mark.skipif(storage.name != 'memory',
+                    reason='messages are kept by the storage engine')
+def test_wal_snapshot_compaction(tmp_path):
+    directory = str(tmp_path / 'wal')
+    path = str(tmp_path / 'flockr.snapshot')
+    clear()
+    wal_open(directory, 'interval', 0)
+    user0, user1, channel0 = make_changes()
+    snapshot_save(path)
+    assert wal_segments(directory) == [2]
+    message_send(user0['token'], channel0, 'after the snapshot')
+    auth_logout(user1['token'])
+    expected = database_view(user0, channel0)
+    wal_close()
+    clear()
+    loaded = snapshot_load(path)
+    assert wal_replay(directory, loaded['wal_segment'], data_replay) == 2
+    assert database_view(user0, channel0) == expected
+    clear()
+
+def wait_for_messages(token, channel_id, count):
+    for _ in range(100):
+        messages = channel_messages(token, channel_id, 0)['messages']
+        if len(messages) >= count:
+            return [message['message'] for message in messages]
+        time.sleep(0.05)
+    raise AssertionError('The scheduled messages were not sent')
+
+# Test if messages sent later survive a restart, and those overdue by then are
+# sent once the database is recovered
+def test_wal_scheduled_recovery(tmp_path):
+    directory = str(tmp_path / 'wal')
+    clear()
+    wal_open(directory, 'always')
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    now = time.time()
+    message_sendlater(user0['token'], channel0, 'sent', now + 0.1)
+    cancelled = message_sendlater(user0['token'], channel0, 'cancelled', now + 60)['job_id']
+    message_sendlater(user0['token'], channel0, 'overdue', now + 0.5)
+    later = message_sendlater(user0['token'], channel0, 'later', now + 60)['job_id']
+    message_sendlater_cancel(user0['token'], cancelled)
+    assert wait_for_messages(user0['token'], channel0, 1) == ['sent']
+    wal_close()
+    # The server stops before 'overdue' is due
+    clear()
+    wal_replay(directory, 0, data_replay)
+    assert sorted(scheduled[3] for scheduled in data['scheduled'].values()) \
+        == ['later', 'overdue']
+    time.sleep(0.5)
+    data_schedule_start()
+    assert wait_for_messages(user0['token'], channel0, 2) == ['sent', 'overdue']
+    assert [job['job_id'] for job in message_sendlater_pending(user0['token'])['messages']] \
+        == [later]
+    # Job ids are not handed out again
+    assert message_sendlater(user0['token'], channel0, 'next', now + 60)['job_id'] > later
+    clear()
+
+# Test if messages that come due together are sent as one change per channel
+def test_wal_scheduled_batch(tmp_path):
+    directory = str(tmp_path / 'wal')
+    clear()
+    wal_open(directory, 'interval', 0)
+    user0 = auth_register("leonwu@gmail.com", "ihfeh3hgi00d", "Yilang", "W")
+    channel0 = channels_create(user0['token'], "channel0", True)['channel_id']
+    channel1 = channels_create(user0['token'], "channel1", True)['channel_id']
+    when = time.time() + 0.5
+    for number in range(100):
+        message_sendlater(user0['token'], (channel0, channel1)[number % 2], str(number), when)
+    wait_for_messages(user0['token'], channel1, 50)
+    assert wait_for_messages(user0['token'], channel0, 50) == [str(number)
+                                                              for number in range(0, 100, 2)]
+    wal_close()
+    sent = [args for op, args in replayed(directory) if op == 'data_schedule_sent']
+    assert [(args[0], len(args[1])) for args in sent] == [(channel0, 50), (channel1, 50)]
+    clear()